@@ -1,18 +1,53 @@
+"""
+Builds the UI executable with PyInstaller.
+
+By default the UI is packaged as a single file, which unpacks the whole bundle to a temporary
+folder on every launch. --onedir builds a folder with the executable instead, which starts
+without unpacking. --slim leaves out the optional output format packages and development tools.
+"""
+import argparse
 import PyInstaller.__main__
 
 tkinter_app = "ui.py"
-extra_import = "pyodbc"
+extra_imports = ["pyodbc", "main"]
 icon_name = "csv.ico"
 
-options = [
-    '--onefile',
-    '-w',
-    '--name', 'UC Export',
-    f'--icon={icon_name}',
-    f'--hidden-import={extra_import}',
-    '--add-data', '.env;.',
-    '--add-data', f'{icon_name};.',
-    f'{tkinter_app}'
+# Packages left out of a slim build. The parquet, arrow and csv.zst output formats and the batch cache need
+# pyarrow and zstandard and are not available in it.
+slim_excludes = [
+    "pyarrow", "zstandard", "aiosqlite",
+    "IPython", "matplotlib", "notebook", "pytest", "_pytest", "setuptools", "pip",
 ]
 
-PyInstaller.__main__.run(options)
+
+def build_options(onedir=False, slim=False):
+    """
+    Build the PyInstaller options.
+
+    :param onedir: Build a folder instead of a single file
+    :param slim: Leave out the packages in slim_excludes
+    :return: The list of options
+    """
+    options = [
+        '--onedir' if onedir else '--onefile',
+        '-w',
+        '--name', 'UC Export',
+        f'--icon={icon_name}',
+        '--add-data', '.env;.',
+        '--add-data', f'{icon_name};.',
+    ]
+    options += [f'--hidden-import={module}' for module in extra_imports]
+    if slim:
+        options += [f'--exclude-module={module}' for module in slim_excludes]
+    options.append(tkinter_app)
+    return options
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the UC Export executable.")
+    parser.add_argument('--onedir', action='store_true',
+                        help="Build a folder with the executable, which starts faster than a single file")
+    parser.add_argument('--slim', action='store_true',
+                        help="Leave out the optional output format packages and development tools")
+    arguments = parser.parse_args()
+    PyInstaller.__main__.run(build_options(arguments.onedir, arguments.slim))
@@ -1,117 +1,550 @@
 """
 This script will run daily and create CSVs from data in the MS SQL database.
+With --service it keeps running and exports on a schedule or whenever a new batch appears.
+With --targets it exports several schemas, each to its own folder, concurrently in one process.
+With --regenerate it writes past batches again from the local batch cache, without the database.
+
+pandas, SQLAlchemy and the modules built on them are imported by the functions that use them,
+so importing this module, e.g. from the UI, and parsing the arguments stay fast.
 """
+# pylint: disable=import-outside-toplevel
 import os
+import argparse
 import logging
-import pandas as pd
-from resources.db_functions import (
-    run_stored_procedure,
-    fetch_latest_units_export,
-    fetch_units_by_date
+import multiprocessing
+import signal
+from resources.checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+from resources.config import (
+    ExportConfig,
+    ServiceConfig,
+    TargetsConfig,
+    EXPORT_MODES,
+    EXPORT_POOLS,
+    Config,
+    get_setting,
+    use_target_settings
 )
-from resources.database import initialize_database
+from resources.metrics import get_report_path, reset_metrics, span, write_report
+from resources.output import OutputCommit, remove_stale_temp_files
+from resources.service import ExportService, parse_schedule
+from resources.watermark import load_watermark, save_watermark
+from resources.writers import OUTPUT_FORMATS, create_partition_writer, get_base_name
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def export_dataset(df, file_name, csv_folder_path, description=""):
+def export_units(units_completed, base_name, csv_folder_path, output_format='csv'):
     """
-    Exports a DataFrame to CSV with logging.
+    Exports fetched UnitsCompleteExport records through a pandas DataFrame.
 
-    :param df: DataFrame to export
-    :param file_name: Output file name
+    :param units_completed: List of UnitsCompleteExport records
+    :param base_name: Export base name, e.g. UC_20240101120000
     :param csv_folder_path: Output directory
-    :param description: Optional description for logging
+    :param output_format: One of writers.OUTPUT_FORMATS
     """
-    try:
-        file_path = os.path.join(csv_folder_path, file_name)
+    import pandas as pd
+    export_frame(pd.DataFrame([unit.to_dict() for unit in units_completed]), base_name, csv_folder_path,
+                 output_format)
+
+
+def export_frame(df, base_name, csv_folder_path, output_format='csv', dedup=None):
+    """
+    Exports a DataFrame of export rows to the missing budget file and one file per job date.
+    The rows are written one partition at a time without copying the DataFrame.
+
+    :param df: DataFrame with the columns of UnitsCompleteExport.to_dict
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param csv_folder_path: Output directory
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param dedup: Whether to skip unchanged partitions, falls back to the export_dedup setting
+    """
+    with OutputCommit(csv_folder_path, base_name, dedup=dedup) as output, \
+            create_partition_writer(csv_folder_path, base_name, output_format, output=output) as writer:
+        writer.write_frame(df)
+
+
+def write_frame(df, base_name, csv_folder_path, export_config, dedup=None):
+    """
+    Exports a DataFrame of export rows serially or, with more than one worker, in parallel.
+    """
+    if export_config.workers > 1:
+        from resources.export import export_frame_parallel
+        export_frame_parallel(df, base_name, csv_folder_path, export_config.workers, export_config.pool,
+                              export_config.output_format, dedup)
+    else:
+        export_frame(df, base_name, csv_folder_path, export_config.output_format, dedup)
+
+
+def export_latest_batch(csv_folder_path, export_config=None):
+    """
+    Exports the most recent UnitsCompleteExport batch.
+    The batch is found and read in a single query.
+
+    :param csv_folder_path: Output directory
+    :param export_config: ExportConfig, read from the environment if not provided
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    from resources.batch_cache import get_batch_cache
+    from resources.export import export_latest_arrow, export_latest_async, export_latest_cursor, export_latest_streaming
+
+    export_config = export_config or ExportConfig()
+    cache = get_batch_cache()
+    if export_config.mode == 'cursor':
+        return export_latest_cursor(csv_folder_path, export_config.chunk_size, export_config.output_format, cache)
+    if export_config.mode == 'stream':
+        return export_latest_streaming(csv_folder_path, export_config.chunk_size, export_config.output_format,
+                                       export_config.keyset, cache)
+    if export_config.mode == 'async':
+        import asyncio
+        return asyncio.run(export_latest_async(csv_folder_path, export_config.chunk_size,
+                                               export_config.output_format, cache))
+    if export_config.mode == 'arrow':
+        return export_latest_arrow(csv_folder_path, export_config.chunk_size, export_config.output_format, cache)
+
+    import pandas as pd
+    from resources.db_functions import fetch_latest_batch, fetch_latest_units_frame
+    if export_config.mode == 'columnar':
+        df = fetch_latest_units_frame()
+        latest_date = None if df.empty else pd.Timestamp(df['date_created'].iloc[0]).to_pydatetime()
+    else:
+        units_completed = fetch_latest_batch()
+        latest_date = units_completed[0].date_created if units_completed else None
+        with span('transform'):
+            df = pd.DataFrame([unit.to_dict() for unit in units_completed])
+    if latest_date is None:
+        return None, 0
+    logging.info("Fetched %d completed units", len(df))
+
+    write_frame(df, get_base_name(latest_date), csv_folder_path, export_config)
+    if cache is not None:
+        cache.store_frame(latest_date, df)
+    return latest_date, len(df)
+
+
+def export_batch(batch_date, csv_folder_path, export_config=None):
+    """
+    Exports the UnitsCompleteExport batch created at a date with the configured export mode.
+
+    :param batch_date: The date_created of the batch
+    :param csv_folder_path: Output directory
+    :param export_config: ExportConfig, read from the environment if not provided
+    :return: The number of exported records
+    """
+    from resources.batch_cache import get_batch_cache
+    from resources.export import export_arrow, export_async, export_cursor, export_streaming
+
+    export_config = export_config or ExportConfig()
+    cache = get_batch_cache()
+    base_name = get_base_name(batch_date)
+    if export_config.mode == 'cursor':
+        return export_cursor(batch_date, base_name, csv_folder_path, export_config.chunk_size,
+                             export_config.output_format, cache)
+    if export_config.mode == 'stream':
+        return export_streaming(batch_date, base_name, csv_folder_path, export_config.chunk_size,
+                                export_config.output_format, export_config.keyset, cache)
+    if export_config.mode == 'async':
+        import asyncio
+        return asyncio.run(export_async(batch_date, csv_folder_path, export_config.chunk_size,
+                                        export_config.output_format, cache))
+    if export_config.mode == 'arrow':
+        return export_arrow(batch_date, base_name, csv_folder_path, export_config.chunk_size,
+                            export_config.output_format, cache)
 
-        clean_df = df.drop(columns=['missing_from_budget'])
-        clean_df.to_csv(file_path, index=False)
+    import pandas as pd
+    from resources.db_functions import fetch_units_by_date, fetch_units_frame
+    if export_config.mode == 'columnar':
+        df = fetch_units_frame(batch_date)
+    else:
+        units_completed = fetch_units_by_date(batch_date)
+        with span('transform'):
+            df = pd.DataFrame([unit.to_dict() for unit in units_completed])
+    if df.empty:
+        return 0
 
-        log_msg = f"Created {file_path} ({len(clean_df)} records)"
-        if description:
-            log_msg += f" - {description}"
-        logging.info(log_msg)
+    write_frame(df, base_name, csv_folder_path, export_config)
+    if cache is not None:
+        cache.store_frame(batch_date, df)
+    return len(df)
+
+
+def export_catch_up(watermark, csv_folder_path, export_config=None):
+    """
+    Exports every batch created after the watermark, oldest first and one batch at a time, with
+    the configured export mode. The watermark is moved forward after each exported batch, so an
+    interrupted run resumes with the first batch that was not exported.
+
+    :param watermark: The date_created of the last exported batch
+    :param csv_folder_path: Output directory
+    :param export_config: ExportConfig, read from the environment if not provided
+    :return: The number of exported records
+    """
+    from resources.db_functions import fetch_batch_dates_after
+
+    export_config = export_config or ExportConfig()
+    batch_dates = fetch_batch_dates_after(watermark)
+    logging.info("Found %d unexported batches", len(batch_dates))
+
+    total_records = 0
+    for date_created in batch_dates:
+        records = export_batch(date_created, csv_folder_path, export_config)
+        logging.info("Exported batch %s (%d records)", date_created, records)
+        save_watermark(date_created, records)
+        total_records += records
+    return total_records
+
+
+def prepare_csv_folder():
+    """
+    Create the CSV folder if it doesn't exist and remove temporary files left by an interrupted run.
+
+    :return: The CSV folder path
+    :raises ValueError: If csv_folder_path is not set
+    """
+    csv_folder_path = get_setting('csv_folder_path')
+    if not csv_folder_path:
+        logging.error("CSV folder path is not set in environment variables.")
+        raise ValueError("Missing CSV folder path")
+    if not os.path.exists(csv_folder_path):
+        os.makedirs(csv_folder_path)
+        logging.info("CSV folder created: %s", csv_folder_path)
+    remove_stale_temp_files(csv_folder_path)
+    return csv_folder_path
+
+
+def regenerate_batches(batches, export_config=None):
+    """
+    Export batches again from the local batch cache, without connecting to the database.
+    The files are written to the CSV folder in the configured output format; the watermark is not changed.
+    Every partition is written, also with export_dedup, since the files are regenerated on purpose.
+
+    :param batches: Names of the batches, ISO date_created values or base names such as
+        UC_20240105120000, or 'all' for every cached batch
+    :param export_config: ExportConfig with the output settings, read from the environment if not provided
+    :return: The number of exported records
+    :raises ValueError: If the cache is not configured or a batch is not cached
+    """
+    from resources.batch_cache import get_batch_cache
+
+    export_config = export_config or ExportConfig()
+    cache = get_batch_cache()
+    if cache is None:
+        raise ValueError("The batch cache is not available, set export_cache_path and install pyarrow")
+    if 'all' in batches:
+        dates = [entry.date_created for entry in cache.entries()]
+    else:
+        dates = [cache.find(batch) for batch in batches]
+    csv_folder_path = prepare_csv_folder()
+
+    total_records = 0
+    for date_created in dates:
+        df = cache.load_frame(date_created)
+        write_frame(df, get_base_name(date_created), csv_folder_path, export_config, dedup=False)
+        logging.info("Regenerated batch %s (%d records) from the cache", date_created, len(df))
+        total_records += len(df)
+    return total_records
+
+
+def call_stored_procedure():
+    """
+    Execute the stored procedure once. It is not retried: it commits before it returns its row
+    count, so after a transient error it may have run, and a second call would report no changes.
+
+    :return: The number of affected rows, None if a transient error left the outcome unknown
+    """
+    from resources.db_functions import run_stored_procedure
+    from resources.retry import is_transient
+
+    try:
+        affected_rows = run_stored_procedure()
     except Exception as e:
-        logging.error("Failed to export %s: %s", file_name, e)
-        raise
+        if not is_transient(e):
+            raise
+        logging.warning("The stored procedure failed with a transient error and may have committed, "
+                        "exporting the latest batch if it is newer than the watermark: %s", e)
+        return None
+    logging.info("Stored procedure executed successfully")
+    logging.info("Number of affected rows: %d", affected_rows)
+    if affected_rows > 0:
+        save_checkpoint(affected_rows)
+    return affected_rows
 
 
-def main():
+def export_procedure_batch(csv_folder_path, export_config):
+    """
+    Execute the stored procedure and export the rows it returns, see export.export_procedure_rows.
+    A call that failed before the procedure committed left nothing behind and runs it again. Once the
+    procedure committed, a checkpoint is saved, and a call after a failed export of its files exports
+    the latest batch instead.
+
+    :param csv_folder_path: Output directory
+    :param export_config: ExportConfig with the export settings
+    :return: A tuple of the number of affected rows, the batch date_created (None if no rows were
+        exported) and the number of exported records
+    """
+    from resources.batch_cache import get_batch_cache
+    from resources.export import export_procedure_rows
+
+    checkpoint = load_checkpoint()
+    if checkpoint is not None:
+        logging.warning("The stored procedure committed before its export failed, exporting the latest batch")
+        return (checkpoint['affected_rows'],) + export_latest_batch(csv_folder_path, export_config)
+    return export_procedure_rows(csv_folder_path, export_config.chunk_size, export_config.output_format,
+                                 cache=get_batch_cache(), on_commit=save_checkpoint)
+
+
+def export_changes(csv_folder_path, export_config, retry, affected_rows=None, procedure_failed=False):
+    """
+    Export the batches of a procedure run, or the latest batch if the procedure did not run.
+    Every export is retried after transient errors and clears the checkpoint once it finished.
+
+    :param csv_folder_path: Output directory
+    :param export_config: ExportConfig with the export settings
+    :param retry: RetryPolicy for the database work
+    :param affected_rows: The number of rows affected by the procedure, None if it did not run
+    :param procedure_failed: Whether the outcome of the procedure is unknown, the latest batch is
+        then only exported if it is newer than the watermark
+    :return: The number of affected rows, or in catch-up mode the number of exported records
+    """
+    from resources.db_functions import fetch_batch_dates_after
+
+    watermark = load_watermark() if export_config.catch_up or procedure_failed else None
+    if watermark is not None and export_config.catch_up:
+        # Export every batch missed since the last run, even if the procedure added nothing.
+        # A retry continues after the last batch the failed attempt exported.
+        total_records = retry.call(lambda: export_catch_up(load_watermark(), csv_folder_path, export_config),
+                                   description="catch-up export")
+        clear_checkpoint()
+        logging.info("Total processed records: %d", total_records)
+        return total_records
+
+    if affected_rows is not None and affected_rows <= 0:
+        logging.info("No data changes - exiting")
+        return 0
+    if watermark is not None:
+        with span('latest_lookup'):
+            newer_batches = retry.call(fetch_batch_dates_after, watermark, description="batch lookup")
+        if not newer_batches:
+            logging.info("No batch newer than the watermark - exiting")
+            return 0
+
+    # Export the latest batch. Its files are committed together, so a failed attempt leaves nothing behind.
+    latest_date, total_records = retry.call(export_latest_batch, csv_folder_path, export_config,
+                                            description="export")
+    clear_checkpoint()
+    if latest_date is None:
+        logging.warning("No UnitsCompleteExport records found")
+        return 0
+    save_watermark(latest_date, total_records)
+
+    logging.info("Total processed records: %d", total_records)
+    return total_records if affected_rows is None else affected_rows
+
+
+def main(export_config=None, run_procedure=True):
     """
     Main processing workflow for generating CSV exports.
+
+    :param export_config: ExportConfig with the export settings, read from the environment if not provided
+    :param run_procedure: Whether to execute the stored procedure first. Without it the latest batch,
+        or in catch-up mode every new batch, is exported as it is.
+    :return: The number of affected rows, or in catch-up mode the number of exported records
     """
+    from resources.database import initialize_database
+    from resources.retry import RetryPolicy
+
+    metrics = reset_metrics()
+    status, error = 'success', None
     try:
+        export_config = export_config or ExportConfig()
+        retry = RetryPolicy.from_config()
 
         # Initialize the database
-        initialize_database()
-
-        # Create CSV folder if it doesn't exist
-        csv_folder_path = os.environ.get('csv_folder_path')
-        if not csv_folder_path:
-            logging.error("CSV folder path is not set in environment variables.")
-            raise ValueError("Missing CSV folder path")
-        if not os.path.exists(csv_folder_path):
-            os.makedirs(csv_folder_path)
-            logging.info("CSV folder created: %s", csv_folder_path)
-
-        # Execute the stored procedure
-        affected_rows = run_stored_procedure()
-        logging.info("Stored procedure executed successfully")
-        logging.info("Number of affected rows: %d", affected_rows)
+        with span('init'):
+            retry.call(initialize_database, description="database initialization")
 
-        if affected_rows <= 0:
-            logging.info("No data changes - exiting")
-            return 0
+        csv_folder_path = prepare_csv_folder()
+        if not run_procedure:
+            return export_changes(csv_folder_path, export_config, retry)
 
-        # Get latest data
-        latest_record = fetch_latest_units_export()
-        if not latest_record:
-            logging.warning("No UnitsCompleteExport records found")
-            return 0
+        resumed = 0
+        checkpoint = load_checkpoint()
+        if checkpoint is not None:
+            # The procedure of an earlier run finished, but its export failed. Its batch is exported
+            # first, then the procedure runs for the changes made since.
+            logging.warning("Resuming the export of the stored procedure run at %s, "
+                            "the stored procedure runs once it is exported", checkpoint['procedure_at'])
+            resumed = export_changes(csv_folder_path, export_config, retry, checkpoint['affected_rows'])
 
-        latest_date = latest_record.date_created
-        units_completed = fetch_units_by_date(latest_date)
-        logging.info("Fetched %d completed units", len(units_completed))
-
-        # Prepare data for export
-        base_name = f'UC_{latest_date.strftime("%Y%m%d%H%M%S")}'
-        df = pd.DataFrame([unit.to_dict() for unit in units_completed])
-
-        # Export missing budget data
-        missing_budget_df = df[df['missing_from_budget'] == 1]
-        if not missing_budget_df.empty:
-            export_dataset(
-                missing_budget_df,
-                f'{base_name}_missing_from_budget.csv',
-                csv_folder_path,
-                "Missing budget entries"
-            )
-
-        # Export data grouped by job_date
-        for job_date, group_df in df.groupby('job_date'):
-            try:
-                safe_date = pd.to_datetime(job_date).strftime("%Y%m%d")
-                export_dataset(
-                    group_df,
-                    f'{base_name}_{safe_date}.csv',
-                    csv_folder_path,
-                    f"Job date {job_date}"
-                )
-            except Exception as e:
-                logging.error("Failed to process job date %s: %s", job_date, e)
-                raise
-
-        logging.info("Total processed records: %d", len(units_completed))
-        return affected_rows
+        if export_config.procedure_rows:
+            # Execute the stored procedure and export the rows it returns in the same call
+            affected_rows, latest_date, total_records = retry.call(
+                export_procedure_batch, csv_folder_path, export_config, description="stored procedure export")
+            logging.info("Stored procedure executed successfully")
+            logging.info("Number of affected rows: %d", affected_rows)
+            if latest_date is not None:
+                save_watermark(latest_date, total_records)
+            clear_checkpoint()
+            logging.info("Total processed records: %d", total_records)
+            return resumed + affected_rows
+
+        # Execute the stored procedure, which commits only once it returned its row count
+        affected_rows = call_stored_procedure()
+        return resumed + export_changes(csv_folder_path, export_config, retry, affected_rows,
+                                        procedure_failed=affected_rows is None)
 
     except Exception as e:
+        status, error = 'failed', e
         logging.error("An error occurred: %s", e)
         raise e
 
+    finally:
+        write_run_report(metrics.report(status, error))
+
+
+def write_run_report(report):
+    """
+    Log the stage timings of a run and write its report.
+    A report that cannot be written is logged and does not fail the run.
+
+    :param report: The report built by RunMetrics.report
+    """
+    logging.info("Stage timings: %s", ", ".join(
+        f"{stage['name']} {stage['seconds']:.2f}s" for stage in report['spans']))
+    try:
+        write_report(report)
+        logging.info("Run report written to %s", get_report_path())
+    except OSError as e:
+        logging.warning("Failed to write the run report: %s", e)
+
+
+def run_service(service_config=None, export_config=None):
+    """
+    Run the export as a long-running service until SIGINT or SIGTERM.
+    The process, its database engine and the verified schema are reused by every run.
+
+    :param service_config: ServiceConfig with the schedule, read from the environment if not provided
+    :param export_config: ExportConfig with the export settings, read from the environment if not provided
+    """
+    from resources.db_functions import fetch_latest_batch_date
+
+    service_config = service_config or ServiceConfig()
+    export_config = export_config or ExportConfig()
+    service = ExportService(
+        lambda run_procedure: main(export_config, run_procedure),
+        schedule=parse_schedule(service_config.schedule) if service_config.schedule else None,
+        poll_interval=service_config.poll_interval,
+        latest_batch_date=fetch_latest_batch_date,
+        exported_batch_date=load_watermark,
+    )
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: service.stop())
+    service.run_forever()
+
+
+def run_target(target, export_options=None, run_procedure=True):
+    """
+    Run the export of one target with its settings.
+
+    :param target: ExportTarget to export
+    :param export_options: ExportConfig keyword arguments, the other settings are read from the
+        target and the environment
+    :param run_procedure: Whether to execute the stored procedure of the target first
+    :return: The result of main
+    """
+    with use_target_settings(target.settings):
+        logging.info("Exporting target %s", target)
+        result = main(ExportConfig(**(export_options or {})), run_procedure)
+        logging.info("Finished target %s", target.name)
+        return result
+
+
+def run_targets(targets_config=None, export_options=None, run_procedure=True):
+    """
+    Export several targets concurrently in one process.
+    Every target runs in a thread of its own, at most targets_config.concurrency at a time, and all
+    of them share the database engine and its connection pool. A failed target does not stop the
+    others, the failures are reported together once every target finished.
+
+    :param targets_config: TargetsConfig with the targets file, read from the environment if not provided
+    :param export_options: ExportConfig keyword arguments applied to every target
+    :param run_procedure: Whether to execute the stored procedure of every target first
+    :return: Dictionary of target name to the result of main
+    :raises TargetExportError: If one or more targets failed
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from resources.targets import TargetExportError, load_targets
+
+    targets_config = targets_config or TargetsConfig()
+    if not targets_config.path:
+        raise ValueError("Missing targets file, set export_targets_path or --targets")
+    targets = load_targets(targets_config.path)
+    workers = min(targets_config.concurrency, len(targets))
+    config = Config()
+    if workers > config.pool_size + config.pool_max_overflow:
+        logging.warning("%d targets run at once, but the connection pool holds at most %d connections",
+                        workers, config.pool_size + config.pool_max_overflow)
+
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {target.name: executor.submit(run_target, target, export_options, run_procedure)
+                   for target in targets}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                failures[name] = e
+    if failures:
+        raise TargetExportError(failures)
+    return results
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments.
+
+    :param argv: Arguments to parse, defaults to sys.argv
+    :return: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Export the latest UnitsCompleteExport batch to CSV files.")
+    parser.add_argument('--mode', choices=EXPORT_MODES, help="Export mode")
+    parser.add_argument('--format', dest='output_format', choices=sorted(OUTPUT_FORMATS), help="Output format")
+    parser.add_argument('--chunk-size', type=int, help="Rows per fetch in stream, async, arrow and cursor mode")
+    parser.add_argument('--workers', type=int, help="Number of workers writing partitions in parallel")
+    parser.add_argument('--pool', choices=EXPORT_POOLS, help="Worker pool type used with --workers")
+    parser.add_argument('--catch-up', action='store_true', default=None,
+                        help="Export every batch created since the last exported batch")
+    parser.add_argument('--procedure-rows', action='store_true', default=None,
+                        help="Export the rows returned by the stored procedure")
+    parser.add_argument('--keyset', action='store_true', default=None,
+                        help="Read the batch in stream mode with one query per chunk instead of a cursor")
+    parser.add_argument('--targets', help="JSON file with the targets to export concurrently")
+    parser.add_argument('--target-concurrency', dest='concurrency', type=int,
+                        help="Number of targets exported at the same time")
+    parser.add_argument('--regenerate', nargs='+', metavar='BATCH',
+                        help="Export batches again from the batch cache without the database, e.g. "
+                             "UC_20240105120000, 2024-01-05T12:00:00 or all")
+    parser.add_argument('--service', action='store_true',
+                        help="Keep running and export on a schedule or when a new batch appears")
+    parser.add_argument('--schedule', help="Service schedule, a cron expression or an interval such as 15m")
+    parser.add_argument('--poll-interval', type=int,
+                        help="Seconds between checks for a new batch in service mode, 0 to disable")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    main()
+    multiprocessing.freeze_support()
+    arguments = vars(parse_args())
+    service_mode = arguments.pop('service')
+    regenerate = arguments.pop('regenerate')
+    service_arguments = {name: arguments.pop(name) for name in ('schedule', 'poll_interval')}
+    targets_config = TargetsConfig(arguments.pop('targets'), arguments.pop('concurrency'))
+    if regenerate:
+        regenerate_batches(regenerate, ExportConfig(**arguments))
+    elif service_mode:
+        run_service(ServiceConfig(**service_arguments), ExportConfig(**arguments))
+    elif targets_config.path:
+        run_targets(targets_config, arguments)
+    else:
+        main(ExportConfig(**arguments))
@@ -0,0 +1,121 @@
+"""
+This module contains the Arrow tables the arrow export mode works on.
+Fetched rows are converted once, chunk by chunk, into Arrow record batches that make up a single
+table, notes and cost_code are derived with Arrow compute functions, and the rows of every
+partition are selected with index arrays over the table instead of copies of it. Requires pyarrow.
+"""
+import pyarrow as pa
+import pyarrow.compute as pc
+from resources.writers import MISSING_FROM_BUDGET
+
+# Arrow types of the columns read from UnitsCompleteExport, see db_functions.EXPORT_SOURCE_COLUMNS
+SOURCE_SCHEMA = pa.schema([
+    ('job_date', pa.date32()),
+    ('job_number', pa.string()),
+    ('phase_number', pa.string()),
+    ('category_number', pa.string()),
+    ('unit_change', pa.decimal128(8, 2)),
+    (MISSING_FROM_BUDGET, pa.int8()),
+    ('timesheet_id', pa.int64()),
+    ('change_order_id', pa.int64()),
+    ('sub_report_id', pa.int64()),
+    ('vendor_name', pa.string()),
+    ('date_created', pa.timestamp('us')),
+])
+
+# Columns of an export table, the columns of UnitsCompleteExport.to_dict plus date_created
+EXPORT_TABLE_COLUMNS = ['job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                        MISSING_FROM_BUDGET, 'notes', 'cost_code', 'date_created']
+
+
+def record_batch_from_rows(rows, columns):
+    """
+    Converts a chunk of database rows to an Arrow record batch.
+
+    :param rows: Sequence of rows
+    :param columns: The names of the row columns, each a field of SOURCE_SCHEMA
+    :return: A pyarrow.RecordBatch
+    """
+    schema = pa.schema([SOURCE_SCHEMA.field(column) for column in columns])
+    values = zip(*rows) if rows else [[] for _ in columns]
+    return pa.record_batch([pa.array(column, field.type) for column, field in zip(values, schema)], schema=schema)
+
+
+def build_export_table(table):
+    """
+    Adds the notes and cost_code columns to a table of export source columns.
+    The values are identical to UnitsCompleteExport.get_notes and get_cost_code.
+
+    :param table: pyarrow.Table with the SOURCE_SCHEMA columns
+    :return: A pyarrow.Table with the EXPORT_TABLE_COLUMNS
+    """
+    # Every present note starts with a space, which is removed from the joined notes
+    parts = [
+        _note(table['timesheet_id'], " Timesheet ID: "),
+        _note(table['change_order_id'], " Change Order ID: "),
+        _note(table['sub_report_id'], " Sub Report ID: "),
+        _note(table['vendor_name'], " Vendor Name: "),
+    ]
+    notes = pc.utf8_slice_codeunits(pc.binary_join_element_wise(*parts, ""), 1)
+    cost_codes = pc.binary_join_element_wise(table['job_number'], table['phase_number'], table['category_number'], ".")
+    table = table.append_column('notes', notes).append_column('cost_code', cost_codes)
+    return table.select(EXPORT_TABLE_COLUMNS)
+
+
+def _note(values, label):
+    """
+    Returns the label and value of every present id or vendor name, an empty string for the others.
+    """
+    if pa.types.is_string(values.type):
+        present = pc.fill_null(pc.not_equal(values, ""), False)
+        text = values
+    else:
+        present = pc.fill_null(pc.not_equal(values, 0), False)
+        text = pc.cast(values, pa.string())
+    return pc.if_else(present, pc.binary_join_element_wise(label, text, ""), "")
+
+
+def partition_indices(table):
+    """
+    Selects the rows of every partition of an export table.
+    The job date partitions are consecutive slices of a single stable sort index, so each
+    partition keeps the row order of the table.
+
+    :param table: pyarrow.Table with job_date and missing_from_budget columns
+    :return: A list of tuples of the partition key, a job date or MISSING_FROM_BUDGET, and an
+        Arrow array of the row indices of the partition
+    """
+    partitions = []
+    if table.num_rows == 0:
+        # Compute functions do not all accept columns without chunks
+        return partitions
+    missing = pc.indices_nonzero(pc.fill_null(pc.equal(table[MISSING_FROM_BUDGET], 1), False))
+    if len(missing):
+        partitions.append((MISSING_FROM_BUDGET, missing))
+
+    job_dates = table['job_date']
+    order = pc.sort_indices(job_dates)
+    counts = pc.value_counts(job_dates)
+    offset = 0
+    for job_date, count in sorted(zip(counts.field('values').to_pylist(), counts.field('counts').to_pylist())):
+        partitions.append((job_date, order.slice(offset, count)))
+        offset += count
+    return partitions
+
+
+def table_rows(table, columns):
+    """
+    Returns the rows of a table as Python values with the text of UnitsCompleteExport.to_dict,
+    e.g. for the csv writers and partition fingerprints.
+
+    :param table: pyarrow.Table
+    :param columns: The columns of the rows, in order
+    :return: A list of row tuples
+    """
+    values = []
+    for column in columns:
+        array = table[column]
+        if pa.types.is_date(array.type) or pa.types.is_decimal(array.type):
+            array = pc.cast(array, pa.string())
+        values.append(array.to_pylist())
+    return list(zip(*values))
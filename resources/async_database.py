@@ -0,0 +1,114 @@
+"""
+Async database module to handle the database configuration and session with an AsyncEngine.
+The engine uses the aioodbc driver and is bound to the event loop it is first used on, so the
+shared instances must be disposed of with dispose_async_databases before that loop ends.
+"""
+import threading
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from .config import Config, get_target_schema
+from .database import schema_translate_map
+from .models import Base
+
+# Registry of AsyncDatabase instances keyed by connection URI, for the event loop of each thread,
+# e.g. of export targets running side by side. It is only changed between awaits, so it needs no lock.
+_registry = threading.local()
+
+
+def _async_databases():
+    """
+    Returns the AsyncDatabase registry of the current thread.
+    """
+    if not hasattr(_registry, 'databases'):
+        _registry.databases = {}
+    return _registry.databases
+
+
+class AsyncDatabase:
+    """
+    AsyncDatabase class to handle the database configuration and async sessions.
+    """
+    def __init__(self, config=None):
+        """
+        Initialize the database configuration and create an async engine and session factory.
+        :param config: Optional Config instance, a new one is created if not provided
+        """
+        self.config = config or Config()
+        self._engine = self._create_engine()
+        self.session_factory = async_sessionmaker(self._engine, expire_on_commit=False)
+        # Engines of export target schemas, sharing the connection pool of the engine
+        self._schema_engines = {}
+
+    @property
+    def engine(self):
+        """
+        The async engine for the current export target, see Database.engine.
+        :return: SQLAlchemy AsyncEngine
+        """
+        schema = get_target_schema()
+        if schema is None:
+            return self._engine
+        engine = self._schema_engines.get(schema)
+        if engine is None:
+            engine = self._schema_engines.setdefault(
+                schema, self._engine.execution_options(schema_translate_map=schema_translate_map(schema)))
+        return engine
+
+    def _create_engine(self):
+        """
+        Create and return the async database engine.
+        :return: SQLAlchemy AsyncEngine
+        """
+        return create_async_engine(self.config.async_sqlalchemy_database_uri, **self.config.engine_options)
+
+    async def create_tables(self):
+        """
+        Create all tables in the database if they do not exist.
+        """
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    def get_new_session(self):
+        """
+        Create a new session and return it.
+        Inside an export target the session is bound to the engine of the target schema.
+        :return: A new SQLAlchemy AsyncSession
+        """
+        if get_target_schema() is None:
+            return self.session_factory()
+        return self.session_factory(bind=self.engine)
+
+    async def close(self):
+        """
+        Dispose of the async database engine.
+        """
+        databases = _async_databases()
+        for key, db in list(databases.items()):
+            if db is self:
+                del databases[key]
+        await self._engine.dispose()
+
+
+def get_async_database():
+    """
+    Return the shared AsyncDatabase for the current configuration.
+    The engine and its connection pool are created on first use and reused afterwards.
+    :return: A shared AsyncDatabase instance
+    """
+    config = Config()
+    key = config.async_sqlalchemy_database_uri
+    databases = _async_databases()
+    db = databases.get(key)
+    if db is None:
+        db = AsyncDatabase(config)
+        databases[key] = db
+    return db
+
+
+async def dispose_async_databases():
+    """
+    Dispose of every shared AsyncDatabase of the current thread and its connection pool.
+    """
+    databases = list(_async_databases().values())
+    _async_databases().clear()
+    for db in databases:
+        await db.close()
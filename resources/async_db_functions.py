@@ -0,0 +1,112 @@
+"""
+Contains async functions to interact with the database.
+They mirror resources.db_functions and build the same statements, but run on the shared
+AsyncDatabase so other work can continue while a query is waiting on the server.
+"""
+import time
+from typing import AsyncIterator, List
+from sqlalchemy import select, text
+from resources.async_database import get_async_database
+from resources.db_functions import RECORD_COLUMNS, _date_window, _procedure_statement, latest_batch_condition
+from resources.metrics import get_metrics, increment, span
+from resources.models import UnitsCompleteExport
+from resources.records import RecordBatch
+
+
+async def run_stored_procedure(
+        schema: str = None,
+        procedure_name: str = None
+) -> int:
+    """
+    Calls the specified stored procedure using the async database engine.
+
+    :param schema: The name of the schema where the procedure is stored
+    :param procedure_name: The name of the stored procedure to call
+    :return: The number of affected rows
+    :raises ValueError: If the schema or procedure name is invalid
+    """
+    statement = _procedure_statement(schema, procedure_name)
+
+    db = get_async_database()
+    with span('procedure'):
+        async with db.get_new_session() as session:
+            result = await session.execute(text(statement))
+            row = result.fetchone()
+            await session.commit()
+    return row[0] if row else 0
+
+
+async def fetch_latest_batch() -> List[UnitsCompleteExport]:
+    """
+    Fetches every UnitsCompleteExport record of the most recent batch in a single query.
+
+    :return: The records of the latest batch, empty if the table is empty
+    """
+    return await _fetch_units(latest_batch_condition())
+
+
+async def fetch_units_by_date(date) -> List[UnitsCompleteExport]:
+    """
+    Fetches the UnitsCompleteExport records for a specific date.
+    """
+    start, end = _date_window(date)
+    return await _fetch_units(UnitsCompleteExport.date_created.between(start, end))
+
+
+async def _fetch_units(condition):
+    """
+    Fetches the UnitsCompleteExport records matching a condition.
+    """
+    db = get_async_database()
+    with span('fetch'):
+        async with db.get_new_session() as session:
+            result = await session.execute(select(UnitsCompleteExport).filter(condition))
+            units = list(result.scalars().all())
+    increment('rows_fetched', len(units))
+    return units
+
+
+def stream_units_by_date(date, chunk_size: int = 1000) -> AsyncIterator[RecordBatch]:
+    """
+    Streams the UnitsCompleteExport records for a specific date in chunks.
+
+    :param date: The date_created of the batch
+    :param chunk_size: The number of records per chunk
+    :return: An async iterator of RecordBatch chunks
+    """
+    start, end = _date_window(date)
+    return _stream_units(UnitsCompleteExport.date_created.between(start, end), chunk_size)
+
+
+def stream_latest_batch(chunk_size: int = 1000) -> AsyncIterator[RecordBatch]:
+    """
+    Streams the UnitsCompleteExport records of the most recent batch in chunks.
+    The batch is selected on the server in the same query, see db_functions.latest_batch_condition.
+
+    :param chunk_size: The number of records per chunk
+    :return: An async iterator of RecordBatch chunks
+    """
+    return _stream_units(latest_batch_condition(), chunk_size)
+
+
+def _stream_units(condition, chunk_size):
+    """
+    Streams the UnitsCompleteExport records matching a condition with a server-side cursor.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    async def chunks():
+        db = get_async_database()
+        metrics = get_metrics()
+        async with db.get_new_session() as session:
+            start = time.perf_counter()
+            result = await session.stream(
+                select(*RECORD_COLUMNS).where(condition).execution_options(yield_per=chunk_size)
+            )
+            async for rows in result.partitions():
+                metrics.add_span('fetch', time.perf_counter() - start)
+                metrics.increment('rows_fetched', len(rows))
+                yield RecordBatch.from_rows(rows)
+                start = time.perf_counter()
+    return chunks()
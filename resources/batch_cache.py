@@ -0,0 +1,350 @@
+"""
+This module keeps a local cache of exported batches, so a past export can be written again,
+e.g. in another output format or after the files were lost, without querying the database.
+Every batch is stored as an uncompressed Arrow IPC file named after its date_created, which is
+memory-mapped when it is read. The cache is limited by size and by age: batches cached longer
+than the maximum age are removed, then the oldest batches until the cache fits the maximum size.
+Requires pyarrow.
+"""
+import datetime
+import logging
+import os
+import re
+import time
+from decimal import Decimal
+from typing import NamedTuple
+from resources.config import CacheConfig
+from resources.models import UnitsCompleteExport
+from resources.records import to_cents
+from resources.writers import MISSING_FROM_BUDGET, get_base_name
+
+CACHE_EXTENSION = '.arrow'
+
+# Cache file names hold the full date_created, e.g. 20240105120000000000.arrow
+_FILE_NAME_FORMAT = '%Y%m%d%H%M%S%f'
+
+# Days between the proleptic Gregorian ordinal of a date and the Arrow date32 epoch, 1970-01-01
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class CacheEntry(NamedTuple):
+    """
+    A batch stored in the cache.
+    """
+    date_created: datetime.datetime
+    path: str
+    size: int
+    cached_at: float
+
+
+def get_batch_cache(cache_config=None):
+    """
+    Returns the batch cache of the current export target, if one is configured.
+    The cache is an optimisation, so without pyarrow it is disabled with a warning.
+
+    :param cache_config: CacheConfig, read from the environment if not provided
+    :return: A BatchCache, None if export_cache_path is not set or pyarrow is not installed
+    """
+    cache_config = cache_config or CacheConfig()
+    if not cache_config.path:
+        return None
+    try:
+        return BatchCache(cache_config.path, cache_config.max_mb * 1024 * 1024, cache_config.max_age_days)
+    except ImportError as e:
+        logging.warning("Batch cache disabled: %s", e)
+        return None
+
+
+class BatchCache:
+    """
+    A folder with one Arrow IPC file per exported batch.
+    """
+    def __init__(self, path, max_bytes=0, max_age_days=0):
+        """
+        :param path: The cache folder, created if it does not exist
+        :param max_bytes: The maximum total size of the cached batches, 0 for no limit
+        :param max_age_days: The number of days a batch is kept, 0 for no limit
+        """
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.compute  # pylint: disable=import-outside-toplevel
+            import pyarrow.ipc  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError("The batch cache requires the pyarrow package") from e
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._pa = pyarrow
+        # The columns of UnitsCompleteExport.to_dict, with unit_change in cents
+        self.schema = pyarrow.schema([
+            ('job_date', pyarrow.date32()),
+            ('job_number', pyarrow.string()),
+            ('phase_number', pyarrow.string()),
+            ('category_number', pyarrow.string()),
+            ('unit_change_cents', pyarrow.int64()),
+            (MISSING_FROM_BUDGET, pyarrow.int8()),
+            ('notes', pyarrow.string()),
+            ('cost_code', pyarrow.string()),
+        ])
+        os.makedirs(path, exist_ok=True)
+
+    def file_path(self, date_created):
+        """
+        Returns the path of the cache file of a batch.
+        """
+        return os.path.join(self.path, f'{date_created.strftime(_FILE_NAME_FORMAT)}{CACHE_EXTENSION}')
+
+    def entries(self):
+        """
+        Returns the cached batches, oldest date_created first.
+
+        :return: A list of CacheEntry
+        """
+        entries = []
+        for file_name in os.listdir(self.path):
+            stem, extension = os.path.splitext(file_name)
+            if extension != CACHE_EXTENSION:
+                continue
+            try:
+                date_created = datetime.datetime.strptime(stem, _FILE_NAME_FORMAT)
+                stat = os.stat(os.path.join(self.path, file_name))
+            except (ValueError, OSError):
+                continue
+            entries.append(CacheEntry(date_created, os.path.join(self.path, file_name), stat.st_size, stat.st_mtime))
+        return sorted(entries)
+
+    def find(self, name):
+        """
+        Finds a cached batch by its date_created or its export base name.
+
+        :param name: An ISO date_created, e.g. 2024-01-05T12:00:00, or a base name, e.g. UC_20240105120000
+        :return: The date_created of the cached batch
+        :raises ValueError: If the name is invalid or the batch is not cached
+        """
+        match = re.fullmatch(r'(?:UC_)?(\d{14})', name)
+        if match:
+            matches = [entry.date_created for entry in self.entries()
+                       if get_base_name(entry.date_created) == f'UC_{match.group(1)}']
+        else:
+            try:
+                date_created = datetime.datetime.fromisoformat(name)
+            except ValueError as e:
+                raise ValueError(f"Invalid batch: {name}") from e
+            matches = [entry.date_created for entry in self.entries() if entry.date_created == date_created]
+        if not matches:
+            raise ValueError(f"Batch {name} is not in the cache {self.path}")
+        return matches[-1]
+
+    def writer(self, date_created):
+        """
+        Returns a writer that stores a batch chunk by chunk.
+
+        :param date_created: The date_created of the batch
+        :return: A BatchCacheWriter
+        """
+        return BatchCacheWriter(self, date_created)
+
+    def store_frame(self, date_created, df):
+        """
+        Stores a batch and evicts old batches.
+        Failures are logged, the export does not depend on the cache.
+
+        :param date_created: The date_created of the batch
+        :param df: DataFrame with the columns of UnitsCompleteExport.to_dict
+        """
+        with self.writer(date_created) as writer:
+            writer.write_frame(df)
+
+    def store_table(self, date_created, table):
+        """
+        Stores a batch held in an Arrow table and evicts old batches.
+
+        :param date_created: The date_created of the batch
+        :param table: pyarrow.Table with the columns of arrow_tables.EXPORT_TABLE_COLUMNS
+        """
+        with self.writer(date_created) as writer:
+            writer.write_table(table)
+
+    def load_frame(self, date_created):
+        """
+        Reads a cached batch from its memory-mapped file.
+
+        :param date_created: The date_created of the batch
+        :return: A DataFrame with the columns of UnitsCompleteExport.to_dict
+        :raises ValueError: If the batch is not cached
+        """
+        file_path = self.file_path(date_created)
+        if not os.path.exists(file_path):
+            raise ValueError(f"Batch {date_created} is not in the cache {self.path}")
+        with self._pa.memory_map(file_path) as source:
+            df = self._pa.ipc.open_file(source).read_all().to_pandas(date_as_object=True)
+        df['unit_change'] = [Decimal(int(cents)).scaleb(-2) for cents in df.pop('unit_change_cents')]
+        return df[['job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                   MISSING_FROM_BUDGET, 'notes', 'cost_code']]
+
+    def evict(self, now=None):
+        """
+        Removes batches cached longer than max_age_days, then the oldest batches until the
+        cache fits max_bytes.
+
+        :param now: The current time as a timestamp, defaults to time.time()
+        :return: The list of removed CacheEntry
+        """
+        entries = self.entries()
+        removed = []
+        if self.max_age_days:
+            cutoff = (time.time() if now is None else now) - self.max_age_days * 86400
+            removed += [entry for entry in entries if entry.cached_at < cutoff]
+            entries = [entry for entry in entries if entry.cached_at >= cutoff]
+        if self.max_bytes:
+            total = sum(entry.size for entry in entries)
+            while entries and total > self.max_bytes:
+                entry = entries.pop(0)
+                removed.append(entry)
+                total -= entry.size
+        for entry in removed:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        if removed:
+            logging.info("Evicted %d batch(es) from the cache %s", len(removed), self.path)
+        return removed
+
+
+class BatchCacheWriter:
+    """
+    Stores a batch in the cache chunk by chunk.
+    The file is written under a temporary name and renamed into place by commit, so the cache
+    never holds a partial batch. A failure disables the writer with a warning instead of failing
+    the export. Used as a context manager it commits on success and aborts on an exception.
+    """
+    def __init__(self, cache, date_created):
+        """
+        :param cache: The BatchCache
+        :param date_created: The date_created of the batch
+        """
+        self.cache = cache
+        self.date_created = date_created
+        self.file_path = cache.file_path(date_created)
+        self._pa = cache._pa  # pylint: disable=protected-access
+        self._temp_path = f'{self.file_path}.tmp'
+        self._writer = None
+        self._failed = False
+
+    def write_frame(self, df):
+        """
+        Stores a DataFrame with the columns of UnitsCompleteExport.to_dict.
+        """
+        def columns():
+            return [
+                list(df['job_date']),
+                *([_text(value) for value in df[column]] for column in ('job_number', 'phase_number', 'category_number')),
+                [to_cents(value) for value in df['unit_change']],
+                [1 if value == 1 else 0 for value in df[MISSING_FROM_BUDGET]],
+                *([_text(value) for value in df[column]] for column in ('notes', 'cost_code')),
+            ]
+        self._write(columns)
+
+    def write_records(self, batch):
+        """
+        Stores a records.RecordBatch.
+        """
+        def columns():
+            format_notes = UnitsCompleteExport.format_notes
+            format_cost_code = UnitsCompleteExport.format_cost_code
+            days = self._pa.array([job_day - _EPOCH_ORDINAL for job_day in batch.job_days], self._pa.int32())
+            return [
+                days,
+                batch.job_numbers,
+                batch.phase_numbers,
+                batch.category_numbers,
+                batch.cents,
+                batch.missing_from_budget,
+                [format_notes(*ids) for ids in zip(
+                    batch.timesheet_ids, batch.change_order_ids, batch.sub_report_ids, batch.vendor_names)],
+                [format_cost_code(*numbers) for numbers in zip(
+                    batch.job_numbers, batch.phase_numbers, batch.category_numbers)],
+            ]
+        self._write(columns)
+
+    def write_table(self, table):
+        """
+        Stores a pyarrow Table with the columns of arrow_tables.EXPORT_TABLE_COLUMNS.
+        The columns are written as they are, apart from unit_change, which is converted to cents.
+        """
+        def columns():
+            compute = self._pa.compute
+            converted = {
+                'unit_change_cents': compute.multiply(table['unit_change'], self._pa.scalar(100, self._pa.decimal128(3, 0))),
+                MISSING_FROM_BUDGET: compute.fill_null(table[MISSING_FROM_BUDGET], 0),
+            }
+            return [converted[field.name] if field.name in converted else table[field.name] for field in self.cache.schema]
+        self._write(columns)
+
+    def _write(self, columns):
+        """
+        Write the columns built by a function, in the order of the cache schema, to the cache file.
+        The columns are Arrow arrays or sequences of values and are cast to the cache schema.
+        """
+        if self._failed:
+            return
+        try:
+            arrays = []
+            for values, field in zip(columns(), self.cache.schema):
+                if isinstance(values, (self._pa.Array, self._pa.ChunkedArray)):
+                    arrays.append(values.cast(field.type))
+                else:
+                    arrays.append(self._pa.array(values, field.type))
+            if self._writer is None:
+                self._writer = self._pa.ipc.new_file(self._temp_path, self.cache.schema)
+            self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.cache.schema))
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning("Failed to cache batch %s: %s", self.date_created, e)
+            self.abort()
+            self._failed = True
+
+    def commit(self):
+        """
+        Renames the cache file into place and evicts old batches.
+        """
+        if self._failed or self._writer is None:
+            return
+        try:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._temp_path, self.file_path)
+            self.cache.evict()
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning("Failed to cache batch %s: %s", self.date_created, e)
+            self.abort()
+
+    def abort(self):
+        """
+        Removes the partially written cache file.
+        """
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self._writer = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+def _text(value):
+    """
+    Convert a string column value, which may be a NumPy string, to str.
+    """
+    return None if value is None else str(value)
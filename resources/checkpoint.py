@@ -0,0 +1,74 @@
+"""
+This module keeps a checkpoint of an export run whose stored procedure finished but whose export
+did not, in a local state file. The next run finds the checkpoint and resumes with the export
+instead of running the procedure again, which would report no affected rows and export nothing.
+"""
+import datetime
+import json
+import os
+from resources.config import get_setting
+
+DEFAULT_CHECKPOINT_PATH = 'export_checkpoint.json'
+
+
+def get_checkpoint_path(path=None):
+    """
+    Returns the path of the checkpoint file.
+
+    :param path: Explicit path, falls back to the export_checkpoint_path setting, see config.get_setting
+    :return: The checkpoint file path
+    """
+    return path or get_setting('export_checkpoint_path') or DEFAULT_CHECKPOINT_PATH
+
+
+def load_checkpoint(path=None):
+    """
+    Loads the checkpoint of an unfinished export.
+
+    :param path: Checkpoint file path, see get_checkpoint_path
+    :return: A dictionary with the affected_rows of the procedure and the time it finished
+        (procedure_at), or None if no export is unfinished
+    :raises ValueError: If the checkpoint file cannot be parsed
+    """
+    path = get_checkpoint_path(path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as file:
+            checkpoint = json.load(file)
+        return {
+            'affected_rows': int(checkpoint['affected_rows']),
+            'procedure_at': datetime.datetime.fromisoformat(checkpoint['procedure_at']),
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid export checkpoint file: {path}") from e
+
+
+def save_checkpoint(affected_rows, path=None):
+    """
+    Records that the stored procedure finished and its rows still have to be exported.
+    The file is replaced atomically.
+
+    :param affected_rows: The number of rows the procedure affected
+    :param path: Checkpoint file path, see get_checkpoint_path
+    """
+    path = get_checkpoint_path(path)
+    checkpoint = {
+        'affected_rows': affected_rows,
+        'procedure_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def clear_checkpoint(path=None):
+    """
+    Removes the checkpoint once the export finished.
+
+    :param path: Checkpoint file path, see get_checkpoint_path
+    """
+    path = get_checkpoint_path(path)
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,8 +1,82 @@
 """
 This module contains the configuration class for the database connection.
 """
+import contextvars
 import os
 import urllib.parse
+from contextlib import contextmanager
+
+# How initialize_database verifies the schema, see resources.schema_cache
+SCHEMA_CHECK_MODES = ('cache', 'process', 'always')
+
+# Settings of the export target the current thread works on, see use_target_settings
+_target_settings = contextvars.ContextVar('target_settings', default=None)
+
+
+def get_setting(name, default=None):
+    """
+    Read a setting of the current export target, falling back to the environment variable.
+    :param name: The name of the setting, e.g. csv_folder_path
+    :param default: The value to use when the setting is not set
+    :return: The value of the setting
+    """
+    settings = _target_settings.get()
+    if settings is not None and name in settings:
+        return settings[name]
+    return os.environ.get(name, default)
+
+
+@contextmanager
+def use_target_settings(settings):
+    """
+    Override settings for the current thread or task, e.g. while exporting one of several targets.
+    Threads started inside the context do not see the overrides.
+    :param settings: Dictionary of setting name to value
+    """
+    token = _target_settings.set(dict(settings))
+    try:
+        yield
+    finally:
+        _target_settings.reset(token)
+
+
+def get_target_schema():
+    """
+    Returns the schema the current export target maps the models to.
+    :return: The schema name, None outside of a target
+    """
+    settings = _target_settings.get()
+    return settings.get('schema_name') if settings is not None else None
+
+
+def _env_int(name, default):
+    """
+    Read an integer environment variable.
+    :param name: The name of the environment variable
+    :param default: The value to use when the variable is not set
+    :return: The integer value of the variable
+    :raises ValueError: If the variable is set but is not an integer
+    """
+    value = get_setting(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ValueError(f"Configuration variable {name} must be an integer") from e
+
+
+def _env_bool(name, default):
+    """
+    Read a boolean environment variable.
+    :param name: The name of the environment variable
+    :param default: The value to use when the variable is not set
+    :return: The boolean value of the variable
+    """
+    value = get_setting(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
 
 class Config:
@@ -16,6 +90,19 @@ class Config:
         self.database = os.getenv('SQL_DATABASE')
         self.validate_config()
 
+        # Connection pool settings
+        self.pool_size = _env_int('SQL_POOL_SIZE', 5)
+        self.pool_max_overflow = _env_int('SQL_POOL_MAX_OVERFLOW', 5)
+        self.pool_recycle = _env_int('SQL_POOL_RECYCLE', 1800)
+        self.pool_pre_ping = _env_bool('SQL_POOL_PRE_PING', True)
+        self.validate_pool_config()
+
+        # Schema verification settings
+        self.schema_check = os.getenv('SQL_SCHEMA_CHECK') or 'cache'
+        self.schema_cache_path = os.getenv('SQL_SCHEMA_CACHE_PATH') or 'schema_cache.json'
+        if self.schema_check not in SCHEMA_CHECK_MODES:
+            raise ValueError(f"Invalid value for SQL_SCHEMA_CHECK: {self.schema_check}")
+
         self.connection_string = (
             f'DRIVER=ODBC Driver 17 for SQL Server;'
             f'SERVER={self.server};'
@@ -27,6 +114,8 @@ class Config:
 
         self.sqlalchemy_database_uri = ('mssql+pyodbc:///?odbc_connect=' +
                                         urllib.parse.quote_plus(self.connection_string))
+        self.async_sqlalchemy_database_uri = ('mssql+aioodbc:///?odbc_connect=' +
+                                              urllib.parse.quote_plus(self.connection_string))
 
     def validate_config(self):
         """
@@ -42,5 +131,170 @@ class Config:
         if not self.database:
             raise ValueError("Configuration variable SQL_DATABASE is not set")
 
+    def validate_pool_config(self):
+        """
+        Validate the connection pool configuration.
+        :raises ValueError: If any of the pool settings are out of range.
+        """
+        if self.pool_size < 1:
+            raise ValueError("Configuration variable SQL_POOL_SIZE must be at least 1")
+        if self.pool_max_overflow < 0:
+            raise ValueError("Configuration variable SQL_POOL_MAX_OVERFLOW must not be negative")
+
+    @property
+    def engine_options(self):
+        """
+        Keyword arguments for create_engine built from the pool settings.
+        :return: A dictionary of engine options
+        """
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.pool_max_overflow,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+        }
+
     def __str__(self):
         return f"{self.server}, {self.username}, {self.database}"
+
+
+# Ways of fetching and exporting a batch, see main.export_latest_batch
+EXPORT_MODES = ('pandas', 'stream', 'columnar', 'async', 'arrow', 'cursor')
+
+# Worker pools of the parallel export, see export.POOL_TYPES
+EXPORT_POOLS = ('process', 'thread')
+
+
+class ExportConfig:
+    """
+    Configuration class for the export.
+    Every setting can be passed as a keyword argument, otherwise it is read from the environment.
+    """
+    def __init__(self, mode=None, chunk_size=None, workers=None, pool=None, output_format=None,
+                 catch_up=None, procedure_rows=None, keyset=None):
+        self.mode = mode or get_setting('export_mode') or 'pandas'
+        self.chunk_size = _env_int('export_chunk_size', 5000) if chunk_size is None else chunk_size
+        self.workers = _env_int('export_workers', 1) if workers is None else workers
+        self.pool = pool or get_setting('export_pool') or 'process'
+        self.output_format = output_format or get_setting('export_format') or 'csv'
+        self.catch_up = _env_bool('export_catch_up', False) if catch_up is None else catch_up
+        self.procedure_rows = _env_bool('export_procedure_rows', False) if procedure_rows is None else procedure_rows
+        self.keyset = _env_bool('export_keyset', False) if keyset is None else keyset
+        self.validate_config()
+
+    def validate_config(self):
+        """
+        Validate the configuration.
+        :raises ValueError: If any of the settings are invalid.
+        """
+        if self.mode not in EXPORT_MODES:
+            raise ValueError(f"Invalid export mode: {self.mode}")
+        if self.chunk_size < 1:
+            raise ValueError("Configuration variable export_chunk_size must be at least 1")
+        if self.workers < 1:
+            raise ValueError("Configuration variable export_workers must be at least 1")
+
+    def __str__(self):
+        return (f"mode={self.mode}, format={self.output_format}, chunk_size={self.chunk_size}, "
+                f"workers={self.workers}, pool={self.pool}")
+
+
+class ServiceConfig:
+    """
+    Configuration class for the long-running export service.
+    Every setting can be passed as a keyword argument, otherwise it is read from the environment.
+    """
+    def __init__(self, schedule=None, poll_interval=None):
+        self.schedule = schedule or get_setting('export_schedule') or None
+        self.poll_interval = _env_int('export_poll_interval', 0) if poll_interval is None else poll_interval
+        self.validate_config()
+
+    def validate_config(self):
+        """
+        Validate the configuration.
+        :raises ValueError: If any of the settings are invalid.
+        """
+        if self.poll_interval < 0:
+            raise ValueError("Configuration variable export_poll_interval must not be negative")
+        if not self.schedule and not self.poll_interval:
+            raise ValueError("The export service needs export_schedule or export_poll_interval")
+
+    def __str__(self):
+        return f"schedule={self.schedule}, poll_interval={self.poll_interval}"
+
+
+class TargetsConfig:
+    """
+    Configuration class for exporting several targets in one process, see resources.targets.
+    Every setting can be passed as a keyword argument, otherwise it is read from the environment.
+    """
+    def __init__(self, path=None, concurrency=None):
+        self.path = path or get_setting('export_targets_path') or None
+        self.concurrency = _env_int('export_target_concurrency', 4) if concurrency is None else concurrency
+        self.validate_config()
+
+    def validate_config(self):
+        """
+        Validate the configuration.
+        :raises ValueError: If any of the settings are invalid.
+        """
+        if self.concurrency < 1:
+            raise ValueError("Configuration variable export_target_concurrency must be at least 1")
+
+    def __str__(self):
+        return f"path={self.path}, concurrency={self.concurrency}"
+
+
+class CacheConfig:
+    """
+    Configuration class for the local batch cache, see resources.batch_cache.
+    Every setting can be passed as a keyword argument, otherwise it is read from the environment.
+    """
+    def __init__(self, path=None, max_mb=None, max_age_days=None):
+        self.path = path or get_setting('export_cache_path') or None
+        self.max_mb = _env_int('export_cache_max_mb', 1024) if max_mb is None else max_mb
+        self.max_age_days = _env_int('export_cache_max_age_days', 90) if max_age_days is None else max_age_days
+        self.validate_config()
+
+    def validate_config(self):
+        """
+        Validate the configuration.
+        :raises ValueError: If any of the settings are invalid.
+        """
+        if self.max_mb < 0:
+            raise ValueError("Configuration variable export_cache_max_mb must not be negative")
+        if self.max_age_days < 0:
+            raise ValueError("Configuration variable export_cache_max_age_days must not be negative")
+
+    def __str__(self):
+        return f"path={self.path}, max_mb={self.max_mb}, max_age_days={self.max_age_days}"
+
+
+class RetryConfig:
+    """
+    Configuration class for retrying database work after transient errors, see resources.retry.
+    The settings apply to the shared connection, so they are read from SQL_ variables.
+    Every setting can be passed as a keyword argument, otherwise it is read from the environment.
+    """
+    def __init__(self, attempts=None, delay_ms=None, max_delay_ms=None, deadline=None):
+        self.attempts = _env_int('SQL_RETRY_ATTEMPTS', 4) if attempts is None else attempts
+        self.delay_ms = _env_int('SQL_RETRY_DELAY_MS', 1000) if delay_ms is None else delay_ms
+        self.max_delay_ms = _env_int('SQL_RETRY_MAX_DELAY_MS', 30000) if max_delay_ms is None else max_delay_ms
+        self.deadline = _env_int('SQL_RETRY_DEADLINE', 300) if deadline is None else deadline
+        self.validate_config()
+
+    def validate_config(self):
+        """
+        Validate the configuration.
+        :raises ValueError: If any of the settings are invalid.
+        """
+        if self.attempts < 1:
+            raise ValueError("Configuration variable SQL_RETRY_ATTEMPTS must be at least 1")
+        if self.delay_ms < 0 or self.max_delay_ms < 0:
+            raise ValueError("Configuration variables SQL_RETRY_DELAY_MS and SQL_RETRY_MAX_DELAY_MS must not be negative")
+        if self.deadline < 0:
+            raise ValueError("Configuration variable SQL_RETRY_DEADLINE must not be negative")
+
+    def __str__(self):
+        return (f"attempts={self.attempts}, delay_ms={self.delay_ms}, max_delay_ms={self.max_delay_ms}, "
+                f"deadline={self.deadline}")
@@ -1,55 +1,160 @@
 """
 Database module to handle the database configuration and session.
 """
+import atexit
+import logging
+import threading
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import create_engine
-from .config import Config
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from .config import Config, get_target_schema
+from .metrics import increment
 from .models import Base
+from .schema_cache import is_verified, mark_verified, metadata_fingerprint, target_key
+
+# Process-wide registry of Database instances keyed by connection URI
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_round_trip(*_args):
+    """
+    Count every statement sent to the database in the run metrics.
+    """
+    increment('db_round_trips')
+
+
+def schema_translate_map(schema):
+    """
+    Returns the schema_translate_map that points the models at another schema.
+    :param schema: The schema of an export target
+    :return: Dictionary of the model schema to the target schema
+    """
+    return {table.schema: schema for table in Base.metadata.tables.values()}
 
 
 class Database:
     """
     Database class to handle the database configuration and session.
     """
-    def __init__(self):
+    def __init__(self, config=None):
         """
         Initialize the database configuration and create an engine and session factory.
+        :param config: Optional Config instance, a new one is created if not provided
+        """
+        self.config = config or Config()
+        self._engine = self._create_engine()
+        self.session_factory = scoped_session(sessionmaker(bind=self._engine))
+        # Engines of export target schemas, sharing the connection pool of the engine
+        self._schema_engines = {}
+
+    @property
+    def engine(self):
+        """
+        The engine for the current export target.
+        Inside a target with another schema it is a view of the shared engine that maps the
+        tables to that schema, see config.use_target_settings.
+        :return: SQLAlchemy engine
         """
-        self.config = Config()
-        self.engine = self._create_engine()
-        self.session_factory = scoped_session(sessionmaker(bind=self.engine))
+        schema = get_target_schema()
+        if schema is None:
+            return self._engine
+        engine = self._schema_engines.get(schema)
+        if engine is None:
+            engine = self._schema_engines.setdefault(
+                schema, self._engine.execution_options(schema_translate_map=schema_translate_map(schema)))
+        return engine
 
     def _create_engine(self):
         """
         Create and return the database engine.
         :return: SQLAlchemy engine
         """
-        return create_engine(self.config.sqlalchemy_database_uri)
+        return create_engine(self.config.sqlalchemy_database_uri, **self.config.engine_options)
 
     def create_tables(self):
         """
         Create all tables in the database if they do not exist.
+        Indexes are only created with new tables, existing tables get them from the scripts in sql/.
         """
         Base.metadata.create_all(self.engine)
 
     def get_new_session(self):
         """
         Create a new session and return it.
+        Inside an export target the session is bound to the engine of the target schema.
         :return: A new SQLAlchemy session
         """
-        return self.session_factory()
+        if get_target_schema() is None:
+            return self.session_factory()
+        return self.session_factory.session_factory(bind=self.engine)
 
     def close(self):
         """
         Close the database engine and remove session.
         """
+        with _databases_lock:
+            for key, db in list(_databases.items()):
+                if db is self:
+                    del _databases[key]
         self.session_factory.remove()
-        self.engine.dispose()
+        self._engine.dispose()
+
+
+def get_database():
+    """
+    Return the process-wide Database for the current configuration.
+    The engine and its connection pool are created on first use and reused afterwards.
+    :return: A shared Database instance
+    """
+    config = Config()
+    key = config.sqlalchemy_database_uri
+    with _databases_lock:
+        db = _databases.get(key)
+        if db is None:
+            db = Database(config)
+            _databases[key] = db
+        return db
+
+
+def dispose_databases():
+    """
+    Close every shared Database and dispose of its connection pool.
+    """
+    with _databases_lock:
+        databases = list(_databases.values())
+        _databases.clear()
+    for db in databases:
+        db.session_factory.remove()
+        db.engine.dispose()
+
+
+atexit.register(dispose_databases)
 
 
 def initialize_database():
     """
     Initialize the database and create the tables.
+    The tables are only created when the schema was not verified before, see SQL_SCHEMA_CHECK:
+    'cache' remembers verified schemas in a file across runs, 'process' only within this process
+    and 'always' creates the tables on every call.
+    :return: The shared Database instance
     """
-    db = Database()
+    db = get_database()
+    config = db.config
+    if config.schema_check == 'always':
+        db.create_tables()
+        return db
+
+    schema = get_target_schema()
+    fingerprint = metadata_fingerprint(Base.metadata, config.server, config.database, schema)
+    key = target_key(config.server, config.database, schema)
+    path = config.schema_cache_path if config.schema_check == 'cache' else None
+    if is_verified(fingerprint, key, path):
+        logging.debug("Schema already verified, skipping table creation")
+        return db
+
     db.create_tables()
+    mark_verified(fingerprint, key, path)
+    return db
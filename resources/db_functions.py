@@ -1,12 +1,22 @@
 """
 Contains functions to interact with the database.
+pandas is only imported by the functions that return DataFrames, so the cursor export runs without it.
 """
-import os
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import List
-from sqlalchemy import text
-from resources.database import Database
+from typing import TYPE_CHECKING, Iterator, List
+from sqlalchemy import and_, func, or_, select, text
+from resources.config import get_setting
+from resources.database import get_database
+from resources.metrics import get_metrics, increment, span
 from resources.models import UnitsCompleteExport
+from resources.records import RECORD_FIELDS, RecordBatch
+
+# Columns of the RecordBatch chunks the streaming functions yield
+RECORD_COLUMNS = [getattr(UnitsCompleteExport, field) for field in RECORD_FIELDS]
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def run_stored_procedure(
@@ -21,20 +31,12 @@ def run_stored_procedure(
     :return: The number of affected rows
     :raises ValueError: If the schema or procedure name is invalid
     """
-    # Get schema and procedure name from environment variables if not provided
-    schema = schema or os.environ.get('schema_name')
-    procedure_name = procedure_name or os.environ.get('stored_procedure_name')
+    statement = _procedure_statement(schema, procedure_name)
 
-    # Validate schema and procedure_name
-    if not schema or not procedure_name:
-        raise ValueError("Schema and procedure name must be provided.")
-    if not schema.isidentifier() or not procedure_name.isidentifier():
-        raise ValueError("Invalid schema or procedure name")
-
-    db = Database()
-    with db.get_new_session() as session:
+    db = get_database()
+    with span('procedure'), db.get_new_session() as session:
         # Execute the stored procedure
-        result = session.execute(text(f"EXEC [{schema}].[{procedure_name}]"))
+        result = session.execute(text(statement))
 
         # Fetch only the first row
         row = result.fetchone()
@@ -50,13 +52,91 @@ def run_stored_procedure(
         return 0
 
 
+@contextmanager
+def run_stored_procedure_with_rows(
+        schema: str = None,
+        procedure_name: str = None,
+        chunk_size: int = 1000
+):
+    """
+    Calls the specified stored procedure and reads the rows it exported in the same call.
+    The procedure must return the number of affected rows as its first result set, followed by
+    a result set with the inserted UnitsCompleteExport rows (for example from an OUTPUT clause).
+    The transaction is committed when the context exits without an error.
+
+    :param schema: The name of the schema where the procedure is stored
+    :param procedure_name: The name of the stored procedure to call
+    :param chunk_size: The number of rows per chunk
+    :return: A context manager yielding the number of affected rows and an iterator of
+        (column names, list of rows) chunks of the second result set
+    :raises ValueError: If the schema or procedure name is invalid
+    """
+    statement = _procedure_statement(schema, procedure_name)
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    db = get_database()
+    connection = db.engine.raw_connection()
+    try:
+        with span('procedure'):
+            cursor = connection.cursor()
+            cursor.execute(statement)
+            # Raw DBAPI cursors bypass the engine events that count round trips
+            increment('db_round_trips')
+            row = cursor.fetchone()
+            affected_rows = row[0] if row else 0
+
+        def chunks():
+            # Skip row count results of statements inside the procedure
+            while cursor.nextset():
+                if cursor.description is not None:
+                    break
+            else:
+                return
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                increment('rows_fetched', len(rows))
+                yield columns, [tuple(row) for row in rows]
+
+        yield affected_rows, chunks()
+
+        # Drain any remaining results before committing
+        while cursor.nextset():
+            pass
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _procedure_statement(schema, procedure_name):
+    """
+    Returns the EXEC statement for a stored procedure after validating its name.
+    """
+    # Get schema and procedure name from environment variables if not provided
+    schema = schema or get_setting('schema_name')
+    procedure_name = procedure_name or get_setting('stored_procedure_name')
+
+    # Validate schema and procedure_name
+    if not schema or not procedure_name:
+        raise ValueError("Schema and procedure name must be provided.")
+    if not schema.isidentifier() or not procedure_name.isidentifier():
+        raise ValueError("Invalid schema or procedure name")
+    return f"EXEC [{schema}].[{procedure_name}]"
+
+
 def fetch_latest_units_export() -> UnitsCompleteExport:
     """
     Fetches the most recent UnitsCompleteExport record from the database.
 
     :return: The most recent UnitsCompleteExport record with truncated microseconds.
     """
-    db = Database()
+    db = get_database()
     with db.get_new_session() as session:
         latest_export = session.query(
             UnitsCompleteExport
@@ -66,19 +146,427 @@ def fetch_latest_units_export() -> UnitsCompleteExport:
         return latest_export
 
 
-def fetch_units_by_date(date) -> List[UnitsCompleteExport]:
+def latest_batch_condition():
     """
-    Fetches the UnitsCompleteExport record for a specific date.
+    Returns a filter matching the records of the most recent batch.
+    The latest date_created is looked up by a subquery and compared on the server, so the
+    batch is found in the same round trip and without DATETIME rounding in between.
+    """
+    latest = select(func.max(UnitsCompleteExport.date_created)).scalar_subquery()
+    return UnitsCompleteExport.date_created == latest
+
+
+def fetch_latest_batch() -> List[UnitsCompleteExport]:
+    """
+    Fetches every UnitsCompleteExport record of the most recent batch in a single query.
+
+    :return: The records of the latest batch, empty if the table is empty
+    """
+    db = get_database()
+    with span('fetch'), db.get_new_session() as session:
+        units = session.query(UnitsCompleteExport).filter(latest_batch_condition()).all()
+    increment('rows_fetched', len(units))
+    return units
+
+
+def fetch_latest_batch_date():
+    """
+    Fetches the date_created of the most recent batch, e.g. to check for a new batch.
+
+    :return: The latest date_created, None if the table is empty
+    """
+    db = get_database()
+    with db.get_new_session() as session:
+        return session.execute(select(func.max(UnitsCompleteExport.date_created))).scalar()
+
+
+def fetch_batch_dates_after(date):
+    """
+    Fetches the date_created of every batch created after a date, e.g. to export the batches
+    one at a time in catch-up mode.
+
+    :param date: The date_created of the last exported batch
+    :return: The batch dates in ascending order
+    """
+    # Skip past the whole DATETIME window of the last batch
+    _, end = _date_window(date)
+
+    db = get_database()
+    with db.get_new_session() as session:
+        return list(session.execute(
+            select(UnitsCompleteExport.date_created)
+            .where(UnitsCompleteExport.date_created > end)
+            .distinct()
+            .order_by(UnitsCompleteExport.date_created)
+        ).scalars())
+
+
+def _date_window(date):
+    """
+    Returns the (start, end) range matching a date_created value stored as DATETIME.
     """
     # Truncate the input date to milliseconds
     date = date.replace(microsecond=(date.microsecond // 1000) * 1000)
 
     start = date - timedelta(milliseconds=2)
     end = date + timedelta(milliseconds=2)
+    return start, end
 
-    db = Database()
-    with db.get_new_session() as session:
+
+def fetch_units_by_date(date) -> List[UnitsCompleteExport]:
+    """
+    Fetches the UnitsCompleteExport record for a specific date.
+    """
+    start, end = _date_window(date)
+
+    db = get_database()
+    with span('fetch'), db.get_new_session() as session:
         units_completed = session.query(UnitsCompleteExport).filter(
             UnitsCompleteExport.date_created.between(start, end)
         ).all()
-        return units_completed
+    increment('rows_fetched', len(units_completed))
+    return units_completed
+
+
+def stream_units_by_date(date, chunk_size: int = 1000) -> Iterator[RecordBatch]:
+    """
+    Streams the UnitsCompleteExport records for a specific date in chunks.
+    Rows are read with a server-side cursor, so only one chunk is held in memory at a time.
+
+    :param date: The date_created of the batch
+    :param chunk_size: The number of records per chunk
+    :return: An iterator of RecordBatch chunks
+    """
+    start, end = _date_window(date)
+    return _stream_units(UnitsCompleteExport.date_created.between(start, end), chunk_size)
+
+
+def stream_latest_batch(chunk_size: int = 1000) -> Iterator[RecordBatch]:
+    """
+    Streams the UnitsCompleteExport records of the most recent batch in chunks.
+    The batch is selected on the server in the same query, see latest_batch_condition.
+
+    :param chunk_size: The number of records per chunk
+    :return: An iterator of RecordBatch chunks
+    """
+    return _stream_units(latest_batch_condition(), chunk_size)
+
+
+def _stream_units(condition, chunk_size):
+    """
+    Streams the UnitsCompleteExport records matching a condition with a server-side cursor.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    def chunks():
+        db = get_database()
+        with db.engine.connect() as connection:
+            result = connection.execute(
+                select(*RECORD_COLUMNS).where(condition).execution_options(yield_per=chunk_size)
+            )
+            for rows in get_metrics().timed('fetch', result.partitions()):
+                increment('rows_fetched', len(rows))
+                yield RecordBatch.from_rows(rows)
+    return chunks()
+
+
+def page_units_by_date(date, chunk_size: int = 1000) -> Iterator[RecordBatch]:
+    """
+    Reads the UnitsCompleteExport records for a specific date in (job_date, export_id) order, one
+    bounded query per chunk. Each query continues after the last row of the previous chunk, so no
+    cursor is held open between chunks and every chunk is a range seek on the (date_created,
+    job_date) index that needs no sort.
+
+    :param date: The date_created of the batch
+    :param chunk_size: The number of records per chunk
+    :return: An iterator of RecordBatch chunks
+    """
+    return _page_units(_batch_condition(date), chunk_size)
+
+
+def page_latest_batch(chunk_size: int = 1000) -> Iterator[RecordBatch]:
+    """
+    Reads the UnitsCompleteExport records of the most recent batch in (job_date, export_id) order,
+    one bounded query per chunk, see page_units_by_date. The chunks after the first one stay on its
+    batch, even if a newer batch is created during the export.
+
+    :param chunk_size: The number of records per chunk
+    :return: An iterator of RecordBatch chunks
+    """
+    return _page_units(latest_batch_condition(), chunk_size)
+
+
+def _batch_condition(date):
+    """
+    Returns a filter matching the records of the batch created at a date.
+    The stored value is looked up in the DATETIME window and compared for equality, so the
+    batch is an equality seek on the leading column of the (date_created, job_date) index.
+    """
+    start, end = _date_window(date)
+    batch_date = select(func.max(UnitsCompleteExport.date_created)).where(
+        UnitsCompleteExport.date_created.between(start, end)
+    ).scalar_subquery()
+    return UnitsCompleteExport.date_created == batch_date
+
+
+def _page_units(condition, chunk_size):
+    """
+    Reads the UnitsCompleteExport records matching a condition with keyset pagination on
+    (job_date, export_id), the order of the (date_created, job_date) index within a batch, as a
+    nonclustered index on SQL Server carries the clustered primary key.
+    The chunks after the first one are read from the batch of the first chunk.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    def chunks():
+        db = get_database()
+        batch_condition = condition
+        last_key = None
+        while True:
+            statement = select(*RECORD_COLUMNS).where(batch_condition)
+            if last_key is not None:
+                last_job_date, last_id = last_key
+                statement = statement.where(or_(
+                    UnitsCompleteExport.job_date > last_job_date,
+                    and_(UnitsCompleteExport.job_date == last_job_date, UnitsCompleteExport.export_id > last_id),
+                ))
+            statement = statement.order_by(UnitsCompleteExport.job_date, UnitsCompleteExport.export_id)
+            statement = statement.limit(chunk_size)
+            with span('fetch'), db.engine.connect() as connection:
+                chunk = RecordBatch.from_rows(connection.execute(statement).fetchall())
+            if not chunk:
+                return
+            increment('rows_fetched', len(chunk))
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            if last_key is None:
+                batch_condition = _batch_condition(chunk.dates_created[0])
+            last_key = (chunk[-1].job_date, chunk[-1].export_id)
+    return chunks()
+
+
+def read_latest_batch_rows(chunk_size: int = 1000) -> Iterator[list]:
+    """
+    Reads the rows of the most recent batch with fetchmany on a plain DBAPI cursor.
+    The statement is compiled once and executed on the driver connection, so no SQLAlchemy Row,
+    ORM object or DataFrame is built. Values the driver does not return as the Python type of
+    their column, e.g. dates stored as text by SQLite, are converted by the result processors of
+    the dialect, looked up once per query.
+
+    :param chunk_size: The number of rows per fetchmany call
+    :return: An iterator of lists of rows with the RECORD_FIELDS columns in order
+    """
+    return _read_rows(latest_batch_condition(), chunk_size)
+
+
+def read_batch_rows(date, chunk_size: int = 1000) -> Iterator[list]:
+    """
+    Reads the rows of the batch created at a date with fetchmany on a plain DBAPI cursor,
+    see read_latest_batch_rows.
+
+    :param date: The date_created of the batch
+    :param chunk_size: The number of rows per fetchmany call
+    :return: An iterator of lists of rows with the RECORD_FIELDS columns in order
+    """
+    start, end = _date_window(date)
+    return _read_rows(UnitsCompleteExport.date_created.between(start, end), chunk_size)
+
+
+def _read_rows(condition, chunk_size):
+    """
+    Reads the RECORD_COLUMNS of the records matching a condition on a plain DBAPI cursor.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+
+    def chunks():
+        db = get_database()
+        with db.engine.connect() as connection:
+            dialect = connection.dialect
+            compiled = select(*RECORD_COLUMNS).where(condition).compile(
+                dialect=dialect,
+                schema_translate_map=connection.get_execution_options().get('schema_translate_map'),
+                render_schema_translate=True,
+            )
+            convert = _row_converter([column.type.dialect_impl(dialect).result_processor(dialect, None)
+                                      for column in RECORD_COLUMNS])
+            cursor = connection.connection.cursor()
+            try:
+                cursor.execute(str(compiled), _driver_parameters(compiled, dialect))
+                # The statement bypasses the engine events, see database._count_round_trip
+                increment('db_round_trips')
+                for rows in get_metrics().timed('fetch', _fetch_many(cursor, chunk_size)):
+                    increment('rows_fetched', len(rows))
+                    yield rows if convert is None else [convert(row) for row in rows]
+            finally:
+                cursor.close()
+    return chunks()
+
+
+def _driver_parameters(compiled, dialect):
+    """
+    Returns the parameters of a compiled statement as the driver expects them, converted by the
+    bind processors of the dialect, e.g. dates to the text SQLite stores.
+    """
+    parameters = {}
+    for name, value in compiled.construct_params().items():
+        processor = compiled.binds[name].type.dialect_impl(dialect).bind_processor(dialect)
+        parameters[name] = value if processor is None else processor(value)
+    if compiled.positional:
+        return tuple(parameters[name] for name in compiled.positiontup)
+    return parameters
+
+
+def _fetch_many(cursor, chunk_size):
+    """
+    Yields the rows of a DBAPI cursor in lists of up to chunk_size rows.
+    """
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _row_converter(processors):
+    """
+    Returns a function that applies the result processors to a raw DBAPI row, or None if no
+    column needs one.
+    """
+    processors = [(index, processor) for index, processor in enumerate(processors) if processor is not None]
+    if not processors:
+        return None
+
+    def convert(row):
+        row = list(row)
+        for index, processor in processors:
+            row[index] = processor(row[index])
+        return row
+    return convert
+
+
+# Columns read by the export, the notes and cost_code columns are derived from them
+EXPORT_SOURCE_COLUMNS = [
+    UnitsCompleteExport.job_date,
+    UnitsCompleteExport.job_number,
+    UnitsCompleteExport.phase_number,
+    UnitsCompleteExport.category_number,
+    UnitsCompleteExport.unit_change,
+    UnitsCompleteExport.missing_from_budget,
+    UnitsCompleteExport.timesheet_id,
+    UnitsCompleteExport.change_order_id,
+    UnitsCompleteExport.sub_report_id,
+    UnitsCompleteExport.vendor_name,
+]
+
+
+def fetch_units_frame(date) -> 'pd.DataFrame':
+    """
+    Fetches the export columns of a batch into a DataFrame with a Core select.
+    No ORM objects are built, and notes and cost_code are computed over whole columns.
+
+    :param date: The date_created of the batch
+    :return: A DataFrame with the same columns as UnitsCompleteExport.to_dict
+    """
+    start, end = _date_window(date)
+    return _fetch_frame(UnitsCompleteExport.date_created.between(start, end))
+
+
+def fetch_latest_units_frame() -> 'pd.DataFrame':
+    """
+    Fetches the export columns of the most recent batch into a DataFrame in a single query.
+
+    :return: A DataFrame with the columns of UnitsCompleteExport.to_dict plus date_created
+    """
+    return _fetch_frame(latest_batch_condition(), [UnitsCompleteExport.date_created])
+
+
+def _fetch_frame(condition, extra_columns=()):
+    """
+    Fetches the export columns of the records matching a condition into a DataFrame.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    db = get_database()
+    with span('fetch'), db.engine.connect() as connection:
+        result = connection.execute(
+            select(*EXPORT_SOURCE_COLUMNS, *extra_columns).where(condition)
+        )
+        columns = list(result.keys())
+        df = pd.DataFrame.from_records(result.fetchall(), columns=columns, coerce_float=False)
+    increment('rows_fetched', len(df))
+    with span('transform'):
+        return build_export_frame(df, [column.key for column in extra_columns])
+
+
+def fetch_latest_units_table(chunk_size: int = 5000):
+    """
+    Fetches the export columns of the most recent batch into an Arrow table in a single query.
+    The rows are read in chunks of chunk_size and every chunk is converted into a record batch
+    of the table right away, so the batch is held once, in Arrow buffers, rather than as Python
+    objects. Requires pyarrow.
+
+    :param chunk_size: The number of rows read per round trip
+    :return: A pyarrow.Table with the arrow_tables.EXPORT_TABLE_COLUMNS, empty if there are no records
+    """
+    return _fetch_units_table(latest_batch_condition(), chunk_size)
+
+
+def fetch_units_table(date, chunk_size: int = 5000):
+    """
+    Fetches the export columns of the batch created at a date into an Arrow table, see
+    fetch_latest_units_table. Requires pyarrow.
+
+    :param date: The date_created of the batch
+    :param chunk_size: The number of rows read per round trip
+    :return: A pyarrow.Table with the arrow_tables.EXPORT_TABLE_COLUMNS, empty if there are no records
+    """
+    start, end = _date_window(date)
+    return _fetch_units_table(UnitsCompleteExport.date_created.between(start, end), chunk_size)
+
+
+def _fetch_units_table(condition, chunk_size):
+    """
+    Fetches the export columns of the records matching a condition into an Arrow table.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa
+    from resources.arrow_tables import SOURCE_SCHEMA, build_export_table, record_batch_from_rows
+
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    db = get_database()
+    batches = []
+    with db.engine.connect() as connection:
+        result = connection.execute(
+            select(*EXPORT_SOURCE_COLUMNS, UnitsCompleteExport.date_created)
+            .where(condition)
+            .execution_options(yield_per=chunk_size)
+        )
+        columns = list(result.keys())
+        for rows in get_metrics().timed('fetch', result.partitions()):
+            batches.append(record_batch_from_rows(rows, columns))
+    schema = pa.schema([SOURCE_SCHEMA.field(column) for column in columns])
+    table = pa.Table.from_batches(batches, schema=schema)
+    increment('rows_fetched', table.num_rows)
+    with span('transform'):
+        return build_export_table(table)
+
+
+def build_export_frame(df, extra_columns=()):
+    """
+    Adds the notes and cost_code columns to a DataFrame of export source columns.
+
+    :param df: DataFrame with the EXPORT_SOURCE_COLUMNS
+    :param extra_columns: Names of additional columns to keep
+    :return: A DataFrame with the columns of UnitsCompleteExport.to_dict plus the extra columns
+    """
+    df['notes'] = UnitsCompleteExport.batch_notes(
+        df['timesheet_id'], df['change_order_id'], df['sub_report_id'], df['vendor_name'])
+    df['cost_code'] = UnitsCompleteExport.batch_cost_codes(
+        df['job_number'], df['phase_number'], df['category_number'])
+    return df[['job_date', 'job_number', 'phase_number', 'category_number',
+               'unit_change', 'missing_from_budget', 'notes', 'cost_code']
+              + list(extra_columns)]
@@ -0,0 +1,460 @@
+"""
+This module contains the export pipelines that turn a UnitsCompleteExport batch into output files.
+Every pipeline writes its files through an OutputCommit, so the files of a batch appear together
+with their manifest once the batch is complete.
+pandas is only imported by the pipelines that build DataFrames.
+"""
+import asyncio
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from resources.db_functions import (
+    build_export_frame,
+    fetch_latest_units_table,
+    fetch_units_table,
+    page_latest_batch,
+    page_units_by_date,
+    read_batch_rows,
+    read_latest_batch_rows,
+    run_stored_procedure_with_rows,
+    stream_latest_batch,
+    stream_units_by_date
+)
+from resources.metrics import get_metrics, span
+from resources.output import OutputCommit
+from resources.records import RecordBatch, partition_rows
+from resources.writers import (
+    MISSING_FROM_BUDGET,
+    OUTPUT_FORMATS,
+    create_partition_writer,
+    get_base_name,
+    partition_file_name,
+    record_partitions
+)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Worker pools available to the parallel export
+POOL_TYPES = {
+    'process': ProcessPoolExecutor,
+    'thread': ThreadPoolExecutor,
+}
+
+
+def export_streaming(batch_date, base_name, csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv',
+                     keyset=False, cache=None):
+    """
+    Exports a batch chunk by chunk without loading the whole result set.
+    Each row goes straight to its job date file and, if flagged, to the missing budget file.
+
+    :param batch_date: The date_created of the batch to export
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param keyset: Read one bounded query per chunk instead of holding a server-side cursor open
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: The number of exported records
+    """
+    chunks = page_units_by_date(batch_date, chunk_size) if keyset else stream_units_by_date(batch_date, chunk_size)
+    return _export_chunks(batch_date, base_name, chunks, _write_chunks, csv_folder_path, output_format, cache)
+
+
+def export_latest_streaming(csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv', keyset=False,
+                            cache=None):
+    """
+    Exports the most recent batch chunk by chunk, finding the batch in the same query.
+
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param keyset: Read one bounded query per chunk instead of holding a server-side cursor open
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    chunks = page_latest_batch(chunk_size) if keyset else stream_latest_batch(chunk_size)
+    first_chunk = next(chunks, None)
+    if not first_chunk:
+        return None, 0
+
+    batch_date = first_chunk[0].date_created
+    return batch_date, _export_chunks(batch_date, get_base_name(batch_date), itertools.chain([first_chunk], chunks),
+                                      _write_chunks, csv_folder_path, output_format, cache)
+
+
+def export_cursor(batch_date, base_name, csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv',
+                  cache=None):
+    """
+    Exports a batch from the rows of a plain DBAPI cursor, without pandas, see export_latest_cursor.
+
+    :param batch_date: The date_created of the batch to export
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of rows read per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: The number of exported records
+    """
+    return _export_chunks(batch_date, base_name, read_batch_rows(batch_date, chunk_size), _write_row_chunks,
+                          csv_folder_path, output_format, cache)
+
+
+def export_latest_cursor(csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv', cache=None):
+    """
+    Exports the most recent batch from the rows of a plain DBAPI cursor, without pandas.
+    Every chunk read with fetchmany is formatted row by row and goes straight to its job date
+    file and, if flagged, to the missing budget file.
+
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of rows read per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    chunks = read_latest_batch_rows(chunk_size)
+    first_chunk = next(chunks, None)
+    if not first_chunk:
+        return None, 0
+
+    # date_created is the last of the RECORD_FIELDS
+    batch_date = first_chunk[0][-1]
+    return batch_date, _export_chunks(batch_date, get_base_name(batch_date), itertools.chain([first_chunk], chunks),
+                                      _write_row_chunks, csv_folder_path, output_format, cache)
+
+
+def _export_chunks(batch_date, base_name, chunks, write_chunks, csv_folder_path, output_format, cache):
+    """
+    Writes the chunks of a batch with write_chunks, _write_chunks or _write_row_chunks, and commits
+    the files and, with a cache, the cached batch.
+
+    :return: The number of exported records
+    """
+    # The cache file is committed after the output files, so a failed export is not cached
+    with (cache.writer(batch_date) if cache is not None else nullcontext()) as cache_writer, \
+            OutputCommit(csv_folder_path, base_name) as output, \
+            create_partition_writer(csv_folder_path, base_name, output_format, output=output) as writer:
+        return write_chunks(writer, chunks, cache_writer)
+
+
+def export_latest_arrow(csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv', cache=None):
+    """
+    Exports the most recent batch from a single Arrow table.
+    The fetched rows are held once, in the Arrow buffers of the table; every partition is
+    selected with an index array over the table and gathered only while it is written.
+    Requires pyarrow.
+
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    table = fetch_latest_units_table(chunk_size)
+    if table.num_rows == 0:
+        return None, 0
+    logging.info("Fetched %d completed units", table.num_rows)
+
+    batch_date = table['date_created'][0].as_py()
+    return batch_date, _export_table(batch_date, get_base_name(batch_date), table, csv_folder_path, output_format,
+                                     cache)
+
+
+def export_arrow(batch_date, base_name, csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv',
+                 cache=None):
+    """
+    Exports a batch from a single Arrow table, see export_latest_arrow. Requires pyarrow.
+
+    :param batch_date: The date_created of the batch to export
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: The number of exported records
+    """
+    table = fetch_units_table(batch_date, chunk_size)
+    if table.num_rows == 0:
+        return 0
+    return _export_table(batch_date, base_name, table, csv_folder_path, output_format, cache)
+
+
+def _export_table(batch_date, base_name, table, csv_folder_path, output_format, cache):
+    """
+    Writes and commits the files of a batch held in an Arrow table, then stores it in the cache.
+
+    :return: The number of exported records
+    """
+    with OutputCommit(csv_folder_path, base_name) as output, \
+            create_partition_writer(csv_folder_path, base_name, output_format, output=output) as writer:
+        writer.write_table(table)
+    if cache is not None:
+        cache.store_table(batch_date, table)
+    return table.num_rows
+
+
+async def export_latest_async(csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv', cache=None):
+    """
+    Exports the most recent batch chunk by chunk on the async database engine.
+    While a chunk is formatted and written in a worker thread, the next chunk is already
+    being fetched, so waiting on the database overlaps with writing the files.
+    The shared async engines are disposed of before returning.
+
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    from resources.async_db_functions import stream_latest_batch  # pylint: disable=import-outside-toplevel
+    return await _export_async(stream_latest_batch(chunk_size), csv_folder_path, output_format, cache)
+
+
+async def export_async(batch_date, csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv', cache=None):
+    """
+    Exports a batch chunk by chunk on the async database engine, see export_latest_async.
+
+    :param batch_date: The date_created of the batch to export
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of records fetched per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :return: The number of exported records
+    """
+    from resources.async_db_functions import stream_units_by_date  # pylint: disable=import-outside-toplevel
+    _, total = await _export_async(stream_units_by_date(batch_date, chunk_size), csv_folder_path,
+                                   output_format, cache)
+    return total
+
+
+async def _export_async(chunks, csv_folder_path, output_format, cache):
+    """
+    Writes the RecordBatch chunks of an async iterator while the next chunk is fetched, and
+    disposes of the shared async engines before returning.
+
+    :return: A tuple of the batch date_created, None if there are no records, and the number of exported records
+    """
+    from resources.async_database import dispose_async_databases  # pylint: disable=import-outside-toplevel
+
+    batch_date = None
+    total = 0
+    output = None
+    writer = None
+    cache_writer = None
+    pending = None
+    try:
+        async for chunk in chunks:
+            if writer is None:
+                batch_date = chunk[0].date_created
+                base_name = get_base_name(batch_date)
+                output = OutputCommit(csv_folder_path, base_name)
+                writer = create_partition_writer(csv_folder_path, base_name, output_format, output=output)
+                cache_writer = cache.writer(batch_date) if cache is not None else None
+            # Chunks are written one at a time and in order by a single worker thread
+            if pending is not None:
+                total += await pending
+            pending = asyncio.ensure_future(asyncio.to_thread(_write_chunks, writer, [chunk], cache_writer))
+        if pending is not None:
+            total += await pending
+            pending = None
+        if writer is not None:
+            writer.close()
+            writer = None
+            output.commit()
+            if cache_writer is not None:
+                cache_writer.commit()
+    except BaseException:
+        if pending is not None:
+            # A write that is still running cannot be cancelled, wait for it before closing the files
+            await asyncio.gather(pending, return_exceptions=True)
+        if writer is not None:
+            writer.close()
+        if output is not None:
+            output.abort()
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+    finally:
+        await dispose_async_databases()
+    return batch_date, total
+
+
+def export_procedure_rows(csv_folder_path, chunk_size=DEFAULT_CHUNK_SIZE, output_format='csv',
+                          schema=None, procedure_name=None, cache=None, on_commit=None):
+    """
+    Runs the stored procedure and exports the rows it returns, without reading the table again.
+    See run_stored_procedure_with_rows for the result sets the procedure must return; the rows
+    need the export source columns and date_created.
+    The files are written while the rows are read, but only committed once the transaction of the
+    procedure is, so a rolled back batch never leaves files behind.
+
+    :param csv_folder_path: Output directory
+    :param chunk_size: The number of rows read per round trip
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param schema: The name of the schema where the procedure is stored
+    :param procedure_name: The name of the stored procedure to call
+    :param cache: Optional batch_cache.BatchCache the batch is stored in once it is exported
+    :param on_commit: Optional function called with the number of affected rows once the
+        procedure returned rows and its transaction is committed, before the files are committed
+    :return: A tuple of the number of affected rows, the batch date_created (None if no rows
+        were returned) and the number of exported records
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    batch_date = None
+    total = 0
+    output = None
+    writer = None
+    cache_writer = None
+    try:
+        with run_stored_procedure_with_rows(schema, procedure_name, chunk_size) as (affected_rows, chunks):
+            for columns, rows in get_metrics().timed('fetch', chunks):
+                with span('transform'):
+                    df = build_export_frame(
+                        pd.DataFrame.from_records(rows, columns=columns, coerce_float=False),
+                        ['date_created'])
+                if writer is None:
+                    batch_date = pd.Timestamp(df['date_created'].iloc[0]).to_pydatetime()
+                    base_name = get_base_name(batch_date)
+                    output = OutputCommit(csv_folder_path, base_name)
+                    writer = create_partition_writer(csv_folder_path, base_name, output_format, output=output)
+                    cache_writer = cache.writer(batch_date) if cache is not None else None
+                writer.write_frame(df, complete=False)
+                if cache_writer is not None:
+                    cache_writer.write_frame(df)
+                total += len(df)
+            if writer is not None:
+                writer.close()
+                writer = None
+        if output is not None:
+            if on_commit is not None:
+                on_commit(affected_rows)
+            output.commit()
+            if cache_writer is not None:
+                cache_writer.commit()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if output is not None:
+            output.abort()
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+    return affected_rows, batch_date, total
+
+
+def _write_chunks(writer, chunks, cache_writer=None):
+    """
+    Writes RecordBatch chunks to their partitions.
+    The rows of each chunk are grouped by partition and written with one call per partition.
+    With a batch_cache.BatchCacheWriter every chunk is also stored in the cache.
+
+    :return: The number of written records
+    """
+    total = 0
+    for chunk in chunks:
+        with span('transform'):
+            partitions = chunk.partitions()
+        for key, rows in partitions.items():
+            writer.write_rows(key, rows)
+        if cache_writer is not None:
+            cache_writer.write_records(chunk)
+        total += len(chunk)
+    return total
+
+
+def _write_row_chunks(writer, chunks, cache_writer=None):
+    """
+    Writes chunks of database rows to their partitions, see records.partition_rows.
+    The cache needs the typed columns of a RecordBatch, which is only built when caching.
+
+    :return: The number of written records
+    """
+    total = 0
+    for rows in chunks:
+        with span('transform'):
+            partitions = partition_rows(rows)
+        for key, partition in partitions.items():
+            writer.write_rows(key, partition)
+        if cache_writer is not None:
+            cache_writer.write_records(RecordBatch.from_rows(rows))
+        total += len(rows)
+    return total
+
+
+class PartitionExportError(Exception):
+    """
+    Raised when one or more partitions of a parallel export fail.
+    """
+    def __init__(self, failures):
+        """
+        :param failures: Dictionary of file name to the exception raised while writing it
+        """
+        self.failures = failures
+        details = "; ".join(f"{file_name}: {error}" for file_name, error in failures.items())
+        super().__init__(f"Failed to export {len(failures)} partition(s): {details}")
+
+
+def _write_partition(df, key, base_name, csv_folder_path, output_format, output):
+    """
+    Writes one partition to its temporary file. Runs inside a worker of the export pool, so the
+    partition is recorded and added to the output commit by the caller.
+
+    :return: The partition stats of the writer
+    """
+    writer = create_partition_writer(csv_folder_path, base_name, output_format, output=output)
+    writer.record_partitions = False
+    with writer:
+        writer.write_partition(key, df)
+    return writer.partition_stats()
+
+
+def export_frame_parallel(df, base_name, csv_folder_path, workers, pool='process', output_format='csv',
+                          dedup=None):
+    """
+    Exports a DataFrame of export rows with one task per partition on a worker pool.
+    Every partition is written even if others fail, the failures are raised together afterwards
+    and none of the files are committed.
+
+    :param df: DataFrame with the columns of UnitsCompleteExport.to_dict
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param csv_folder_path: Output directory
+    :param workers: Number of workers
+    :param pool: 'process' for a process pool or 'thread' for a thread pool
+    :param output_format: One of writers.OUTPUT_FORMATS
+    :param dedup: Whether to skip unchanged partitions, falls back to the export_dedup setting
+    :return: The number of exported records
+    :raises PartitionExportError: If any partition could not be written
+    """
+    if workers < 1:
+        raise ValueError("Number of workers must be at least 1")
+    if pool not in POOL_TYPES:
+        raise ValueError(f"Invalid pool type: {pool}")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format: {output_format}")
+
+    partitions = [(MISSING_FROM_BUDGET, df[df[MISSING_FROM_BUDGET] == 1])]
+    partitions += list(df.groupby('job_date'))
+
+    failures = {}
+    # The pool is shut down before the output is committed, or aborted on any error
+    with OutputCommit(csv_folder_path, base_name, dedup=dedup) as output, \
+            POOL_TYPES[pool](max_workers=workers) as executor:
+        futures = {}
+        for key, partition_df in partitions:
+            if partition_df.empty:
+                continue
+            file_name = partition_file_name(base_name, key, output_format)
+            futures[file_name] = executor.submit(
+                _write_partition, partition_df, key, base_name, csv_folder_path, output_format, output)
+
+        for file_name, future in futures.items():
+            try:
+                record_partitions(future.result(), output)
+            except Exception as e:
+                logging.error("Failed to export %s: %s", file_name, e)
+                failures[file_name] = e
+
+        if failures:
+            raise PartitionExportError(failures)
+    return len(df)
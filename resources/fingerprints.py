@@ -0,0 +1,132 @@
+"""
+This module fingerprints the contents of export partitions, so partitions that did not change since
+the last export are not written and shipped again.
+A partition is identified by its file name without the batch prefix, e.g. 20240101.csv, and its
+fingerprint is a hash of its rows that does not depend on their order.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+from resources.config import get_setting
+
+DEFAULT_FINGERPRINT_PATH = 'export_fingerprints.json'
+
+# Row hashes are added up modulo this value, so the fingerprint does not depend on the row order
+_MODULUS = 1 << 128
+
+
+def get_fingerprint_path(path=None):
+    """
+    Returns the path of the fingerprint index.
+
+    :param path: Explicit path, falls back to the export_fingerprint_path setting, see config.get_setting
+    :return: The index file path
+    """
+    return path or get_setting('export_fingerprint_path') or DEFAULT_FINGERPRINT_PATH
+
+
+def partition_name(file_name, base_name):
+    """
+    Returns the name a partition is stored under in the index, e.g. 20240101.csv for
+    UC_20240105120000_20240101.csv.
+    """
+    return file_name[len(base_name) + 1:] if file_name.startswith(f'{base_name}_') else file_name
+
+
+class PartitionFingerprint:
+    """
+    Order independent hash of the rows of a partition.
+    Every row is hashed as it is written to the file, with None as an empty value.
+    """
+    def __init__(self):
+        self.rows = 0
+        self._total = 0
+
+    def update(self, rows):
+        """
+        Add rows to the fingerprint.
+
+        :param rows: Sequence of rows in column order
+        """
+        total = self._total
+        for row in rows:
+            text = '\x1f'.join('' if value is None else str(value) for value in row)
+            digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+            total += int.from_bytes(digest, 'big')
+        self._total = total % _MODULUS
+        self.rows += len(rows)
+
+    def hexdigest(self):
+        """
+        Returns the fingerprint as a hex string.
+        """
+        return f'{self.rows:x}-{self._total:032x}'
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of the last exported version of every partition, stored in a JSON file.
+    Changes are kept in memory until save is called.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: Index file path, see get_fingerprint_path
+        """
+        self.path = get_fingerprint_path(path)
+        self.entries = self._load()
+
+    def _load(self):
+        """
+        Loads the index. A missing or unreadable file is treated as empty, so every partition is exported.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                entries = json.load(file)
+            if not isinstance(entries, dict):
+                raise ValueError("Expected an object")
+            return entries
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring invalid fingerprint index %s: %s", self.path, e)
+            return {}
+
+    def lookup(self, name, fingerprint):
+        """
+        Returns the index entry of a partition if it was last exported with the same fingerprint.
+
+        :param name: Partition name, see partition_name
+        :param fingerprint: Fingerprint of the partition rows
+        :return: The entry with the file the rows were exported to, None if the partition changed
+        """
+        entry = self.entries.get(name)
+        if entry is not None and entry.get('fingerprint') == fingerprint:
+            return entry
+        return None
+
+    def update(self, name, fingerprint, file_name, rows):
+        """
+        Stores the fingerprint of an exported partition.
+
+        :param name: Partition name, see partition_name
+        :param fingerprint: Fingerprint of the partition rows
+        :param file_name: Name of the exported file
+        :param rows: Number of rows in the file
+        """
+        self.entries[name] = {
+            'fingerprint': fingerprint,
+            'file': file_name,
+            'rows': rows,
+            'exported_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def save(self):
+        """
+        Writes the index. The file is replaced atomically, so an interrupted save keeps the previous index.
+        """
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,276 @@
+"""
+This module collects the timing and volume metrics of an export run.
+Stages are timed with span, volumes are counted with increment, and at the end of the run the
+metrics are written to a JSON report and optionally to a Prometheus textfile.
+"""
+import contextvars
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from resources.config import get_setting
+
+DEFAULT_REPORT_PATH = 'export_report.json'
+
+# Prefix of every metric in the Prometheus textfile
+PROMETHEUS_PREFIX = 'uc_export'
+
+
+def peak_memory_bytes():
+    """
+    Returns the peak resident memory of the current process in bytes, None if it is not available.
+    """
+    if sys.platform == 'win32':
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):  # pylint: disable=too-few-public-methods
+            """
+            PROCESS_MEMORY_COUNTERS from psapi.h.
+            """
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+
+    import resource  # pylint: disable=import-outside-toplevel
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunMetrics:
+    """
+    Metrics of one export run. Safe to update from several threads.
+    """
+    def __init__(self):
+        self.started_at = datetime.datetime.now()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.partitions = []
+        self.counters = {}
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time a stage. Stages that run several times are added up.
+
+        :param name: Stage name, e.g. 'fetch'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name, seconds, calls=1):
+        """
+        Add time spent in a stage.
+
+        :param name: Stage name
+        :param seconds: Time spent in the stage
+        :param calls: Number of times the stage ran
+        """
+        with self._lock:
+            span = self.spans.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            span['seconds'] += seconds
+            span['calls'] += calls
+
+    def timed(self, name, iterable):
+        """
+        Iterate over an iterable, adding the time spent waiting for each item to a stage.
+
+        :param name: Stage name
+        :param iterable: Any iterable, e.g. chunks read from the database
+        :return: A generator of the items of the iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_span(name, time.perf_counter() - start, 0)
+                return
+            self.add_span(name, time.perf_counter() - start)
+            yield item
+
+    def increment(self, name, value=1):
+        """
+        Increase a counter.
+
+        :param name: Counter name, e.g. 'rows_fetched'
+        :param value: Amount to add
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_partition(self, partition, file_path, rows, seconds, size):
+        """
+        Record a written partition file and count its rows and bytes.
+
+        :param partition: Partition key
+        :param file_path: Path of the file
+        :param rows: Number of rows in the file
+        :param seconds: Time spent writing the file
+        :param size: Size of the file in bytes
+        """
+        with self._lock:
+            self.partitions.append({
+                'partition': str(partition),
+                'file': file_path,
+                'rows': rows,
+                'bytes': size,
+                'seconds': seconds,
+            })
+        self.add_span('write', seconds)
+        self.increment('rows_written', rows)
+        self.increment('bytes_written', size)
+
+    def report(self, status='success', error=None):
+        """
+        Build the run report.
+
+        :param status: 'success' or 'failed'
+        :param error: The error that ended the run, if any
+        :return: A JSON serializable dictionary
+        """
+        with self._lock:
+            report = {
+                'status': status,
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration_seconds': round(time.perf_counter() - self._start, 6),
+                'peak_memory_bytes': peak_memory_bytes(),
+                'spans': [{'name': name, 'seconds': round(span['seconds'], 6), 'calls': span['calls']}
+                          for name, span in self.spans.items()],
+                'counters': dict(self.counters),
+                'partitions': [{**partition, 'seconds': round(partition['seconds'], 6)}
+                               for partition in self.partitions],
+            }
+        if error is not None:
+            report['error'] = str(error)
+        return report
+
+
+_metrics = RunMetrics()
+
+# Metrics of the run started in the current thread or task, so runs of several export targets
+# in one process are measured separately. Threads without a run use the last started one.
+_run_metrics = contextvars.ContextVar('run_metrics', default=None)
+
+
+def get_metrics():
+    """
+    Returns the metrics of the current run.
+    """
+    metrics = _run_metrics.get()
+    return _metrics if metrics is None else metrics
+
+
+def reset_metrics():
+    """
+    Starts collecting the metrics of a new run.
+
+    :return: The new RunMetrics
+    """
+    global _metrics  # pylint: disable=global-statement
+    _metrics = RunMetrics()
+    _run_metrics.set(_metrics)
+    return _metrics
+
+
+def span(name):
+    """
+    Time a stage of the current run, see RunMetrics.span.
+    """
+    return get_metrics().span(name)
+
+
+def increment(name, value=1):
+    """
+    Increase a counter of the current run, see RunMetrics.increment.
+    """
+    get_metrics().increment(name, value)
+
+
+def get_report_path(path=None):
+    """
+    Returns the path of the JSON run report.
+
+    :param path: Explicit path, falls back to the export_report_path setting, see config.get_setting
+    :return: The report path
+    """
+    return path or get_setting('export_report_path') or DEFAULT_REPORT_PATH
+
+
+def write_report(report, path=None, prometheus_path=None):
+    """
+    Writes a run report to its JSON file and, if configured, to a Prometheus textfile.
+    Both files are replaced atomically, so readers never see a partial report.
+
+    :param report: The report built by RunMetrics.report
+    :param path: JSON report path, see get_report_path
+    :param prometheus_path: Textfile path, falls back to the export_prometheus_path setting, see config.get_setting
+    """
+    _replace_file(get_report_path(path), json.dumps(report, indent=2, default=str) + '\n')
+    prometheus_path = prometheus_path or get_setting('export_prometheus_path')
+    if prometheus_path:
+        _replace_file(prometheus_path, format_prometheus(report))
+
+
+def format_prometheus(report):
+    """
+    Formats a run report in the Prometheus text exposition format.
+
+    :param report: The report built by RunMetrics.report
+    :return: The textfile contents
+    """
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {metric_type}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {value}' if label_text
+                         else f'{PROMETHEUS_PREFIX}_{name} {value}')
+
+    started_at = datetime.datetime.fromisoformat(report['started_at'])
+    metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last export run.',
+           [({}, int(started_at.timestamp()))])
+    metric('last_run_success', 'gauge', 'Whether the last export run succeeded.',
+           [({}, int(report['status'] == 'success'))])
+    metric('duration_seconds', 'gauge', 'Duration of the last export run.',
+           [({}, report['duration_seconds'])])
+    metric('stage_seconds', 'gauge', 'Time spent in each stage of the last export run.',
+           [({'stage': span['name']}, span['seconds']) for span in report['spans']])
+    metric('count', 'gauge', 'Rows, bytes and database round trips of the last export run.',
+           [({'counter': name}, value) for name, value in report['counters'].items()])
+    if report['peak_memory_bytes'] is not None:
+        metric('peak_memory_bytes', 'gauge', 'Peak resident memory of the last export run.',
+               [({}, report['peak_memory_bytes'])])
+    return '\n'.join(lines) + '\n'
+
+
+def _replace_file(path, content):
+    """
+    Writes a file through a temporary file and renames it into place.
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(temp_path, path)
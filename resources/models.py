@@ -1,9 +1,10 @@
 """
 This module contains the models for the database.
+NumPy and pandas are only imported by the batch derivation, so importing the models stays light.
 """
 import os
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, VARCHAR, DATE, NVARCHAR, NUMERIC, DATETIME
+from sqlalchemy import Column, Index, Integer, VARCHAR, DATE, NVARCHAR, NUMERIC, DATETIME
 
 Base = declarative_base()
 
@@ -13,7 +14,13 @@ class UnitsCompleteExport(Base):
     A class that represents the UnitsCompleteExport table in the database.
     """
     __tablename__ = 'UnitsCompleteExport'
-    __table_args__ = {'schema': os.environ.get('schema_name', 'dbo')}
+    __table_args__ = (
+        # Finds a batch and reads it by job_date, the partition key of the export files. On SQL Server
+        # it also carries the clustered export_id, so keyset pages on (job_date, export_id) need no sort.
+        # Existing tables get it from sql/001_units_complete_export_indexes.sql
+        Index('ix_UnitsCompleteExport_date_created_job_date', 'date_created', 'job_date'),
+        {'schema': os.environ.get('schema_name', 'dbo')},
+    )
 
     export_id = Column(Integer, primary_key=True)
     job_number = Column(VARCHAR(10), nullable=False)
@@ -45,22 +52,79 @@ class UnitsCompleteExport(Base):
         """
         Returns the notes for the UnitsCompleteExport object.
         """
-        notes = []
-        if self.timesheet_id:
-            notes.append(f"Timesheet ID: {self.timesheet_id}")
-        if self.change_order_id:
-            notes.append(f"Change Order ID: {self.change_order_id}")
-        if self.sub_report_id:
-            notes.append(f"Sub Report ID: {self.sub_report_id}")
-        if self.vendor_name:
-            notes.append(f"Vendor Name: {self.vendor_name}")
-        return " ".join(notes)
+        return self.format_notes(self.timesheet_id, self.change_order_id, self.sub_report_id, self.vendor_name)
 
     def get_cost_code(self):
         """
         Returns the cost code for the UnitsCompleteExport object.
         """
-        return f"{self.job_number}.{self.phase_number}.{self.category_number}"
+        return self.format_cost_code(self.job_number, self.phase_number, self.category_number)
+
+    @staticmethod
+    def format_notes(timesheet_id, change_order_id, sub_report_id, vendor_name):
+        """
+        Returns the notes for the values of one record, see get_notes.
+        Ids that are None or 0 and empty vendor names are left out.
+        """
+        notes = []
+        if timesheet_id:
+            notes.append(f"Timesheet ID: {timesheet_id}")
+        if change_order_id:
+            notes.append(f"Change Order ID: {change_order_id}")
+        if sub_report_id:
+            notes.append(f"Sub Report ID: {sub_report_id}")
+        if vendor_name:
+            notes.append(f"Vendor Name: {vendor_name}")
+        return " ".join(notes)
+
+    @staticmethod
+    def format_cost_code(job_number, phase_number, category_number):
+        """
+        Returns the cost code for the values of one record, see get_cost_code.
+        """
+        return f"{job_number}.{phase_number}.{category_number}"
+
+    @staticmethod
+    def batch_notes(timesheet_id, change_order_id, sub_report_id, vendor_name):
+        """
+        Returns the notes for whole columns of UnitsCompleteExport values.
+        The result is identical to calling get_notes on every row.
+
+        :param timesheet_id: Array-like of timesheet ids, None or NaN where missing
+        :param change_order_id: Array-like of change order ids, None or NaN where missing
+        :param sub_report_id: Array-like of sub report ids, None or NaN where missing
+        :param vendor_name: Array-like of vendor names, None where missing
+        :return: A NumPy string array of notes
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        import pandas as pd
+        vendor = np.asarray(vendor_name, dtype=object)
+        notes = np.zeros(len(vendor), dtype=_text_dtype())
+        _append_notes(notes, *_id_notes(timesheet_id, "Timesheet ID: "))
+        _append_notes(notes, *_id_notes(change_order_id, "Change Order ID: "))
+        _append_notes(notes, *_id_notes(sub_report_id, "Sub Report ID: "))
+
+        present = pd.notna(vendor) & (vendor != "")
+        _append_notes(notes, present, np.strings.add("Vendor Name: ", vendor[present].astype(_text_dtype())))
+        return notes
+
+    @staticmethod
+    def batch_cost_codes(job_number, phase_number, category_number):
+        """
+        Returns the cost codes for whole columns of UnitsCompleteExport values.
+        The result is identical to calling get_cost_code on every row.
+
+        :param job_number: Array-like of job numbers
+        :param phase_number: Array-like of phase numbers
+        :param category_number: Array-like of category numbers
+        :return: A NumPy string array of cost codes
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
+        cost_codes = np.strings.add(_as_text(job_number), ".")
+        cost_codes = np.strings.add(cost_codes, _as_text(phase_number))
+        cost_codes = np.strings.add(cost_codes, ".")
+        return np.strings.add(cost_codes, _as_text(category_number))
 
     def __repr__(self):
         """
@@ -78,3 +142,39 @@ class UnitsCompleteExport(Base):
                 f"sub_report_id={self.sub_report_id}, "
                 f"vendor_name={self.vendor_name}, "
                 f"date_created={self.date_created})>")
+
+
+def _text_dtype():
+    """
+    Returns the variable-width NumPy string dtype used by the batch derivation.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    return np.dtypes.StringDType()
+
+
+def _as_text(values):
+    """
+    Returns values as a NumPy string array of str(value).
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    return np.asarray(values, dtype=object).astype(_text_dtype())
+
+
+def _id_notes(values, label):
+    """
+    Returns a mask of the ids that are set and non-zero and the '<label><id>' notes for them.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    ids = np.asarray(values, dtype=float)
+    present = (ids != 0) & ~np.isnan(ids)
+    return present, np.strings.add(label, ids[present].astype(np.int64).astype(_text_dtype()))
+
+
+def _append_notes(notes, present, text):
+    """
+    Appends text to the masked notes in place, separating it from existing notes with a space.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    current = notes[present]
+    separator = np.where(current == "", "", " ").astype(_text_dtype())
+    notes[present] = np.strings.add(np.strings.add(current, separator), text)
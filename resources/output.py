@@ -0,0 +1,334 @@
+"""
+This module commits export files atomically.
+Files are written to hidden temporary files in the output folder and only renamed to their final
+names once every file of the export is complete, followed by a manifest listing the files.
+Readers that wait for the manifest, or only pick up the final names, never see partial files.
+With deduplication enabled, partitions whose rows did not change since they were last exported are
+dropped from the commit and only listed in the manifest, see resources.fingerprints.
+"""
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+from resources.config import _env_bool, get_setting
+from resources.fingerprints import FingerprintIndex, partition_name
+
+# How written files are flushed to disk before they are renamed:
+# 'file' syncs each file as soon as it is complete, 'batch' syncs the files of the export together at commit
+# and 'none' leaves it to the operating system
+DURABILITY_MODES = ('file', 'batch', 'none')
+
+TEMP_PREFIX = '.'
+TEMP_SUFFIX = '.tmp'
+
+
+def get_durability(durability=None):
+    """
+    Returns the durability mode.
+
+    :param durability: Explicit mode, falls back to the export_durability setting, see config.get_setting
+    :return: One of DURABILITY_MODES
+    :raises ValueError: If the mode is unknown
+    """
+    durability = durability or get_setting('export_durability') or 'file'
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Invalid durability mode: {durability}")
+    return durability
+
+
+def get_dedup(dedup=None):
+    """
+    Returns whether unchanged partitions are skipped.
+
+    :param dedup: Explicit setting, falls back to the export_dedup setting, see config.get_setting
+    :return: True to skip partitions that did not change since the last export
+    """
+    return _env_bool('export_dedup', False) if dedup is None else dedup
+
+
+def temp_path(file_path):
+    """
+    Returns the temporary path a file is written to before it is committed.
+    The temporary file is hidden and does not keep the file extension, so pollers ignore it.
+    """
+    folder, file_name = os.path.split(file_path)
+    return os.path.join(folder, f'{TEMP_PREFIX}{file_name}{TEMP_SUFFIX}')
+
+
+def manifest_file_name(base_name):
+    """
+    Returns the manifest file name of an export, e.g. UC_20240101120000_manifest.json.
+    """
+    return f'{base_name}_manifest.json'
+
+
+def remove_stale_temp_files(csv_folder_path):
+    """
+    Removes temporary export files left behind by an interrupted run.
+
+    :param csv_folder_path: Output directory
+    :return: The number of removed files
+    """
+    removed = 0
+    for file_name in os.listdir(csv_folder_path):
+        if file_name.startswith(TEMP_PREFIX + 'UC_') and file_name.endswith(TEMP_SUFFIX):
+            os.remove(os.path.join(csv_folder_path, file_name))
+            logging.warning("Removed incomplete file %s", file_name)
+            removed += 1
+    return removed
+
+
+def file_checksum(file_path):
+    """
+    Returns the SHA-256 checksum of a file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileChecksum:
+    """
+    Size and SHA-256 checksum of a file, computed from the bytes written to it.
+    """
+    def __init__(self):
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def update(self, data):
+        """
+        Adds written bytes to the checksum.
+        """
+        self.size += len(data)
+        self._digest.update(data)
+
+    def hexdigest(self):
+        """
+        Returns the SHA-256 checksum of the bytes written so far.
+        """
+        return self._digest.hexdigest()
+
+
+class ChecksumFile(io.RawIOBase):
+    """
+    A binary file opened for writing that adds every written byte to a FileChecksum, so the
+    checksum of the complete file is known without reading it back. A file reopened for appending
+    continues the checksum of the earlier writes.
+    """
+    def __init__(self, file_path, mode, checksum):
+        """
+        :param file_path: Path of the file
+        :param mode: 'wb' or 'ab'
+        :param checksum: FileChecksum of the file
+        """
+        super().__init__()
+        self.name = file_path
+        self.checksum = checksum
+        self._file = open(file_path, mode, buffering=0)  # pylint: disable=consider-using-with
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        written = self._file.write(data)
+        self.checksum.update(memoryview(data).cast('B')[:written])
+        return written
+
+    def tell(self):
+        return self._file.tell()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def _fsync_file(file_path):
+    """
+    Flushes a file to disk.
+    """
+    with open(file_path, 'rb+') as file:
+        os.fsync(file.fileno())
+
+
+def _fsync_directory(folder):
+    """
+    Flushes a directory entry to disk, so renames survive a crash. Not supported on Windows.
+    """
+    if os.name == 'nt':
+        return
+    descriptor = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class OutputCommit:
+    """
+    Collects the files of one export and commits them together.
+    Writers write each file to temp_path(file_path) and add it once it is complete. commit syncs
+    the files according to the durability mode, renames them to their final names and writes the
+    manifest. abort removes the temporary files. Used as a context manager it commits on success
+    and aborts on an error.
+    With deduplication, files added with the same fingerprint as their last export are not committed,
+    and the fingerprint index is updated once the commit is complete.
+    """
+    def __init__(self, csv_folder_path, base_name=None, durability=None, dedup=None):
+        """
+        :param csv_folder_path: Output directory
+        :param base_name: Export base name used for the manifest, None to commit without a manifest
+        :param durability: One of DURABILITY_MODES, see get_durability
+        :param dedup: Whether to skip unchanged partitions, see get_dedup. Requires a base name.
+        """
+        self.csv_folder_path = csv_folder_path
+        self.base_name = base_name
+        self.durability = get_durability(durability)
+        self.fingerprints = FingerprintIndex() if base_name is not None and get_dedup(dedup) else None
+        self.files = {}
+        self.unchanged = {}
+        self._checksums = {}
+        self._new_fingerprints = {}
+
+    def previous_export(self, file_path, fingerprint):
+        """
+        Returns the name of the file a partition was last exported to if its rows are unchanged.
+
+        :param file_path: Final path of the file
+        :param fingerprint: Fingerprint of the rows, see fingerprints.PartitionFingerprint
+        :return: The previous file name, None if the partition changed or deduplication is disabled
+        """
+        if self.fingerprints is None or fingerprint is None:
+            return None
+        entry = self.fingerprints.lookup(partition_name(os.path.basename(file_path), self.base_name), fingerprint)
+        return entry['file'] if entry is not None else None
+
+    def add(self, file_path, rows, fingerprint=None, checksum=None):
+        """
+        Adds a complete file written to temp_path(file_path).
+        An unchanged partition is not committed and its temporary file, if any, is removed.
+
+        :param file_path: Final path of the file
+        :param rows: Number of rows in the file
+        :param fingerprint: Fingerprint of the rows, used for deduplication
+        :param checksum: Size and SHA-256 checksum of the file computed while it was written,
+            see ChecksumFile. None to read the file back at commit.
+        :return: False if the partition is unchanged, True otherwise
+        """
+        previous_file = self.previous_export(file_path, fingerprint)
+        if previous_file is not None:
+            if os.path.isfile(temp_path(file_path)):
+                os.remove(temp_path(file_path))
+            logging.info("Skipped %s, unchanged since %s", file_path, previous_file)
+            self.unchanged[file_path] = (rows, previous_file)
+            return False
+
+        if self.durability == 'file':
+            _fsync_file(temp_path(file_path))
+        self.files[file_path] = rows
+        if checksum is not None:
+            self._checksums[file_path] = checksum
+        if self.fingerprints is not None and fingerprint is not None:
+            self._new_fingerprints[file_path] = fingerprint
+        return True
+
+    def commit(self):
+        """
+        Renames every added file to its final name, writes the manifest and updates the
+        fingerprint index. No manifest is written for an export without files.
+
+        :return: The manifest, None if the commit has no base name or no files
+        """
+        if self.durability == 'batch':
+            for file_path in self.files:
+                _fsync_file(temp_path(file_path))
+
+        entries = []
+        for file_path, rows in sorted(self.files.items()):
+            written_path = temp_path(file_path)
+            size, sha256 = self._checksums.get(file_path) or (os.path.getsize(written_path),
+                                                              file_checksum(written_path))
+            entries.append({
+                'file': os.path.basename(file_path),
+                'rows': rows,
+                'bytes': size,
+                'sha256': sha256,
+            })
+            os.replace(written_path, file_path)
+        if self.durability != 'none':
+            _fsync_directory(self.csv_folder_path)
+
+        manifest = None
+        if self.base_name is not None and (entries or self.unchanged):
+            manifest = {
+                'base_name': self.base_name,
+                'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'files': entries,
+            }
+            if self.fingerprints is not None:
+                manifest['unchanged'] = [
+                    {'file': os.path.basename(file_path), 'rows': rows, 'exported_as': previous_file}
+                    for file_path, (rows, previous_file) in sorted(self.unchanged.items())
+                ]
+            manifest_path = os.path.join(self.csv_folder_path, manifest_file_name(self.base_name))
+            with open(temp_path(manifest_path), 'w', encoding='utf-8') as file:
+                json.dump(manifest, file, indent=2)
+                if self.durability != 'none':
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temp_path(manifest_path), manifest_path)
+            if self.durability != 'none':
+                _fsync_directory(self.csv_folder_path)
+
+        if self._new_fingerprints:
+            for file_path, fingerprint in self._new_fingerprints.items():
+                file_name = os.path.basename(file_path)
+                self.fingerprints.update(partition_name(file_name, self.base_name), fingerprint,
+                                         file_name, self.files[file_path])
+            try:
+                self.fingerprints.save()
+            except OSError as e:
+                logging.warning("Failed to save the fingerprint index: %s", e)
+        self._reset()
+        return manifest
+
+    def abort(self):
+        """
+        Removes the temporary files of every added file and, with a base name, every other
+        temporary file of the export, e.g. from a writer that failed before it was added.
+        """
+        written_paths = {temp_path(file_path) for file_path in self.files}
+        if self.base_name is not None:
+            prefix = f'{TEMP_PREFIX}{self.base_name}_'
+            written_paths.update(os.path.join(self.csv_folder_path, file_name)
+                                 for file_name in os.listdir(self.csv_folder_path)
+                                 if file_name.startswith(prefix) and file_name.endswith(TEMP_SUFFIX))
+        for written_path in written_paths:
+            if os.path.isfile(written_path):
+                os.remove(written_path)
+        self._reset()
+
+    def _reset(self):
+        """
+        Forgets the added files after a commit or an abort.
+        """
+        self.files = {}
+        self.unchanged = {}
+        self._checksums = {}
+        self._new_fingerprints = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -0,0 +1,188 @@
+"""
+This module contains the compact record batches the streaming fetch functions yield.
+A RecordBatch stores the columns of UnitsCompleteExport rows in typed arrays instead of one ORM
+object per row: unit_change as integer cents, job_date as a date ordinal and the ids as integers,
+while repeated strings and dates share a single object per batch. A row takes well under a hundred
+bytes instead of the kilobytes of an ORM instance and its state.
+"""
+import datetime
+from array import array
+from decimal import Decimal
+from typing import NamedTuple, Optional
+from resources.models import UnitsCompleteExport
+from resources.writers import MISSING_FROM_BUDGET
+
+# Columns a RecordBatch is built from, in the order of the rows passed to RecordBatch.from_rows
+RECORD_FIELDS = ('export_id', 'job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                 'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name', 'missing_from_budget',
+                 'date_created')
+
+
+class ExportRecord(NamedTuple):
+    """
+    A single record of a RecordBatch with the values as they were read from the database.
+    """
+    export_id: int
+    job_date: datetime.date
+    job_number: str
+    phase_number: str
+    category_number: str
+    unit_change: Decimal
+    timesheet_id: Optional[int]
+    change_order_id: Optional[int]
+    sub_report_id: Optional[int]
+    vendor_name: Optional[str]
+    missing_from_budget: int
+    date_created: Optional[datetime.datetime]
+
+
+def to_cents(value):
+    """
+    Converts a NUMERIC(8, 2) value to integer cents.
+
+    :param value: A Decimal, int or str amount
+    :return: The amount in cents
+    :raises ValueError: If the amount has more than two decimal places
+    """
+    cents = Decimal(value).scaleb(2)
+    if cents != cents.to_integral_value():
+        raise ValueError(f"Invalid unit_change, more than two decimal places: {value}")
+    return int(cents)
+
+
+def format_cents(cents):
+    """
+    Formats integer cents with two decimal places, the text str() gives for the NUMERIC(8, 2)
+    Decimal the database returns, e.g. -5.00 or 0.05.
+    """
+    whole, fraction = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{whole}.{fraction:02d}"
+
+
+class RecordBatch:
+    """
+    A chunk of UnitsCompleteExport records stored column by column.
+    Missing ids are stored as 0, which the notes treat the same as None.
+    """
+    __slots__ = ('export_ids', 'job_days', 'job_numbers', 'phase_numbers', 'category_numbers', 'cents',
+                 'timesheet_ids', 'change_order_ids', 'sub_report_ids', 'vendor_names', 'missing_from_budget',
+                 'dates_created')
+
+    def __init__(self):
+        self.export_ids = array('q')
+        self.job_days = array('i')
+        self.job_numbers = []
+        self.phase_numbers = []
+        self.category_numbers = []
+        self.cents = array('q')
+        self.timesheet_ids = array('q')
+        self.change_order_ids = array('q')
+        self.sub_report_ids = array('q')
+        self.vendor_names = []
+        self.missing_from_budget = array('b')
+        self.dates_created = []
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a batch from database rows.
+
+        :param rows: Sequence of rows with the RECORD_FIELDS columns in order
+        :return: A RecordBatch
+        """
+        batch = cls()
+        # Equal strings and dates are stored as one shared object
+        shared = {}
+
+        def share(value):
+            return value if value is None else shared.setdefault(value, value)
+
+        for (export_id, job_date, job_number, phase_number, category_number, unit_change, timesheet_id,
+             change_order_id, sub_report_id, vendor_name, missing_from_budget, date_created) in rows:
+            batch.export_ids.append(export_id)
+            batch.job_days.append(job_date.toordinal())
+            batch.job_numbers.append(share(job_number))
+            batch.phase_numbers.append(share(phase_number))
+            batch.category_numbers.append(share(category_number))
+            batch.cents.append(to_cents(unit_change))
+            batch.timesheet_ids.append(timesheet_id or 0)
+            batch.change_order_ids.append(change_order_id or 0)
+            batch.sub_report_ids.append(sub_report_id or 0)
+            batch.vendor_names.append(share(vendor_name))
+            batch.missing_from_budget.append(1 if missing_from_budget == 1 else 0)
+            batch.dates_created.append(share(date_created))
+        return batch
+
+    def __len__(self):
+        return len(self.export_ids)
+
+    def __getitem__(self, index):
+        """
+        Returns the record at an index as an ExportRecord.
+        """
+        return ExportRecord(
+            self.export_ids[index],
+            datetime.date.fromordinal(self.job_days[index]),
+            self.job_numbers[index],
+            self.phase_numbers[index],
+            self.category_numbers[index],
+            Decimal(self.cents[index]).scaleb(-2),
+            self.timesheet_ids[index] or None,
+            self.change_order_ids[index] or None,
+            self.sub_report_ids[index] or None,
+            self.vendor_names[index],
+            self.missing_from_budget[index],
+            self.dates_created[index],
+        )
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def partitions(self):
+        """
+        Groups the records by partition as export rows.
+        The rows produce exactly the text of UnitsCompleteExport.to_dict in every output format.
+
+        :return: Dictionary of job date or MISSING_FROM_BUDGET to lists of rows in writers.EXPORT_COLUMNS order
+        """
+        partitions = {}
+        job_dates = {}
+        format_notes = UnitsCompleteExport.format_notes
+        format_cost_code = UnitsCompleteExport.format_cost_code
+        for (job_day, job_number, phase_number, category_number, cents, timesheet_id, change_order_id,
+             sub_report_id, vendor_name, missing) in zip(
+                self.job_days, self.job_numbers, self.phase_numbers, self.category_numbers, self.cents,
+                self.timesheet_ids, self.change_order_ids, self.sub_report_ids, self.vendor_names,
+                self.missing_from_budget):
+            job_date = job_dates.get(job_day)
+            if job_date is None:
+                job_date = job_dates[job_day] = datetime.date.fromordinal(job_day)
+            row = (job_date, job_number, phase_number, category_number, format_cents(cents),
+                   format_notes(timesheet_id, change_order_id, sub_report_id, vendor_name),
+                   format_cost_code(job_number, phase_number, category_number))
+            if missing:
+                partitions.setdefault(MISSING_FROM_BUDGET, []).append(row)
+            partitions.setdefault(job_date, []).append(row)
+        return partitions
+
+
+def partition_rows(rows):
+    """
+    Groups database rows by partition as export rows, without building a RecordBatch.
+    The rows produce exactly the text of UnitsCompleteExport.to_dict in every output format.
+
+    :param rows: Sequence of rows with the RECORD_FIELDS columns in order, as read from the database
+    :return: Dictionary of job date or MISSING_FROM_BUDGET to lists of rows in writers.EXPORT_COLUMNS order
+    """
+    partitions = {}
+    format_notes = UnitsCompleteExport.format_notes
+    format_cost_code = UnitsCompleteExport.format_cost_code
+    for (_, job_date, job_number, phase_number, category_number, unit_change, timesheet_id, change_order_id,
+         sub_report_id, vendor_name, missing, _) in rows:
+        row = (job_date, job_number, phase_number, category_number, str(unit_change),
+               format_notes(timesheet_id, change_order_id, sub_report_id, vendor_name),
+               format_cost_code(job_number, phase_number, category_number))
+        if missing == 1:
+            partitions.setdefault(MISSING_FROM_BUDGET, []).append(row)
+        partitions.setdefault(job_date, []).append(row)
+    return partitions
@@ -0,0 +1,111 @@
+"""
+This module retries database work that failed with a transient error, e.g. a dropped connection,
+a login or query timeout or a deadlock. Every retry waits with exponential backoff and jitter,
+and retrying stops when the attempts or the deadline run out. Errors that are not transient,
+e.g. a missing table or invalid data, are raised right away.
+"""
+import logging
+import random
+import re
+import time
+from sqlalchemy import exc
+from resources.config import RetryConfig
+from resources.metrics import increment
+
+# ODBC SQLSTATE classes of transient errors: connection failures, timeouts and deadlocks
+TRANSIENT_SQLSTATES = {'08001', '08003', '08004', '08007', '08S01', 'HYT00', 'HYT01', '40001'}
+
+# SQL Server error numbers of transient errors, e.g. 1205 for a deadlock victim and the Azure SQL
+# errors for a database that is moving or busy
+TRANSIENT_ERROR_NUMBERS = {233, 1205, 4060, 10053, 10054, 10060, 10928, 10929, 40197, 40501, 40613,
+                           49918, 49919, 49920}
+
+
+def is_transient(error):
+    """
+    Decides whether an error is worth retrying.
+
+    :param error: The raised exception
+    :return: True if the same work may succeed when it is tried again
+    """
+    if isinstance(error, (exc.TimeoutError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, exc.DBAPIError):
+        if error.connection_invalidated:
+            return True
+        error = error.orig
+    if error is None:
+        return False
+    # pyodbc errors carry the SQLSTATE as their first argument and the message, which holds the
+    # SQL Server error number in parentheses, as their second
+    args = [str(arg) for arg in getattr(error, 'args', ())]
+    if args and args[0] in TRANSIENT_SQLSTATES:
+        return True
+    numbers = {int(number) for number in re.findall(r'\((\d+)\)', ' '.join(args[1:]))}
+    return bool(numbers & TRANSIENT_ERROR_NUMBERS)
+
+
+class RetryPolicy:
+    """
+    Retries a function after transient errors with exponential backoff and jitter.
+    The n-th retry waits between half and all of delay * 2 ** (n - 1), at most max_delay.
+    """
+    def __init__(self, attempts=4, delay=1.0, max_delay=30.0, deadline=300.0, sleep=time.sleep):
+        """
+        :param attempts: The maximum number of attempts, 1 to never retry
+        :param delay: The base delay in seconds
+        :param max_delay: The maximum delay between two attempts in seconds
+        :param deadline: Seconds after the first attempt after which no retry starts
+        :param sleep: Function used to wait, replaced in tests
+        """
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.sleep = sleep
+
+    @classmethod
+    def from_config(cls, retry_config=None):
+        """
+        Builds the policy from a RetryConfig, read from the environment if not provided.
+        """
+        retry_config = retry_config or RetryConfig()
+        return cls(retry_config.attempts, retry_config.delay_ms / 1000, retry_config.max_delay_ms / 1000,
+                   retry_config.deadline)
+
+    def backoff(self, retry):
+        """
+        Returns the time to wait before a retry.
+
+        :param retry: The number of the retry, starting at 1
+        :return: The delay in seconds
+        """
+        delay = min(self.max_delay, self.delay * 2 ** (retry - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def call(self, func, *args, description='database call', **kwargs):
+        """
+        Calls a function, retrying it after transient errors.
+        The function must be safe to run again, e.g. because it commits nothing until it succeeds.
+
+        :param func: The function to call
+        :param description: What the function does, for log messages
+        :return: The result of the function
+        :raises Exception: The last error, once it is not transient or no attempt is left
+        """
+        start = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.attempts:
+                    raise
+                delay = self.backoff(attempt)
+                if time.monotonic() - start + delay > self.deadline:
+                    raise
+                logging.warning("Transient error in %s (attempt %d of %d), retrying in %.1fs: %s",
+                                description, attempt, self.attempts, delay, e)
+                increment('db_retries')
+                self.sleep(delay)
+                attempt += 1
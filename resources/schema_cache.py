@@ -0,0 +1,129 @@
+"""
+This module remembers which database schemas were already verified, so the table DDL and the
+catalog queries behind it only run when the models or the target database change.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Fingerprints verified by this process
+_verified = set()
+_verified_lock = threading.Lock()
+
+
+def metadata_fingerprint(metadata, server, database, schema=None):
+    """
+    Returns a fingerprint of the table definitions in a MetaData and the database they target.
+
+    :param metadata: SQLAlchemy MetaData, e.g. Base.metadata
+    :param server: The database server
+    :param database: The database name
+    :param schema: The schema the tables are mapped to, None for the schema of the models
+    :return: A hex digest that changes whenever a table, column, index or the target changes
+    """
+    tables = []
+    for table in sorted(metadata.tables.values(), key=lambda table: table.fullname):
+        tables.append({
+            'name': table.fullname,
+            'columns': [[column.name, str(column.type), column.nullable, column.primary_key]
+                        for column in table.columns],
+            'indexes': sorted([index.name, [column.name for column in index.columns], bool(index.unique)]
+                              for index in table.indexes),
+        })
+    target = {'server': server, 'database': database}
+    if schema is not None:
+        target['schema'] = schema
+    description = json.dumps({**target, 'tables': tables}, sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def target_key(server, database, schema=None):
+    """
+    Returns the key a target database, or a schema mapped by an export target, is stored under
+    in the cache file.
+    """
+    return f'{server}/{database}' if schema is None else f'{server}/{database}/{schema}'
+
+
+def load_schema_cache(path):
+    """
+    Loads the verified fingerprints from the cache file.
+    A missing or unreadable file is treated as empty, so the schema is verified again.
+
+    :param path: Cache file path
+    :return: Dictionary of target key to fingerprint
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as file:
+            cache = json.load(file)
+        if not isinstance(cache, dict):
+            raise ValueError("Expected an object")
+        return cache
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring invalid schema cache file %s: %s", path, e)
+        return {}
+
+
+def save_schema_cache(path, key, fingerprint):
+    """
+    Stores the fingerprint of a target in the cache file.
+    The file is replaced atomically, so an interrupted save keeps the previous cache.
+
+    :param path: Cache file path
+    :param key: Target key, see target_key
+    :param fingerprint: Fingerprint of the verified schema
+    """
+    cache = load_schema_cache(path)
+    cache[key] = fingerprint
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def is_verified(fingerprint, key=None, path=None):
+    """
+    Checks whether a schema was verified by this process or, with a cache file, by an earlier run.
+
+    :param fingerprint: Fingerprint of the schema
+    :param key: Target key, required with a cache file
+    :param path: Cache file path, None to only check this process
+    :return: True if the schema does not need to be verified again
+    """
+    with _verified_lock:
+        if fingerprint in _verified:
+            return True
+    if path is not None and load_schema_cache(path).get(key) == fingerprint:
+        mark_verified(fingerprint)
+        return True
+    return False
+
+
+def mark_verified(fingerprint, key=None, path=None):
+    """
+    Records a verified schema for this process and, with a cache file, for later runs.
+
+    :param fingerprint: Fingerprint of the schema
+    :param key: Target key, required with a cache file
+    :param path: Cache file path, None to only record it for this process
+    """
+    with _verified_lock:
+        _verified.add(fingerprint)
+        if path is not None:
+            # Saved under the lock, so targets verified at the same time do not lose each other's entry
+            try:
+                save_schema_cache(path, key, fingerprint)
+            except OSError as e:
+                logging.warning("Failed to save the schema cache file %s: %s", path, e)
+
+
+def reset_schema_checks():
+    """
+    Forgets the schemas verified by this process.
+    """
+    with _verified_lock:
+        _verified.clear()
@@ -0,0 +1,260 @@
+"""
+This module runs the export as a long-running service.
+Exports are started on a schedule, a cron expression or a fixed interval, and optionally whenever
+a new UnitsCompleteExport batch appears. The process stays up between runs, so the imported modules,
+the database engine and the verified schema are reused by every run.
+"""
+import datetime
+import logging
+import re
+import threading
+
+# Longest time the service sleeps at once, so wall clock changes are noticed
+MAX_WAIT_SECONDS = 60
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Name, lowest and highest value of every cron field
+_CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+]
+
+
+def parse_interval(text):
+    """
+    Parses an interval such as 90, 90s, 15m, 2h or 1d.
+
+    :param text: The interval, a number of seconds with an optional unit
+    :return: The interval in seconds
+    :raises ValueError: If the interval is invalid or not positive
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd]?)\s*', str(text).lower())
+    if not match:
+        raise ValueError(f"Invalid interval: {text}")
+    seconds = int(match.group(1)) * _INTERVAL_UNITS[match.group(2) or 's']
+    if seconds < 1:
+        raise ValueError(f"Invalid interval: {text}")
+    return seconds
+
+
+def _parse_cron_field(text, name, low, high):
+    """
+    Parses one field of a cron expression into the set of values it matches.
+    Supports *, single values, ranges, lists and steps, e.g. */15 or 1-5,10.
+    """
+    values = set()
+    for part in text.split(','):
+        range_text, _, step_text = part.partition('/')
+        try:
+            step = int(step_text) if step_text else 1
+            if range_text == '*':
+                start, end = low, high
+            elif '-' in range_text:
+                start, end = (int(value) for value in range_text.split('-', 1))
+            else:
+                start = int(range_text)
+                end = high if step_text else start
+        except ValueError as e:
+            raise ValueError(f"Invalid cron {name} field: {text}") from e
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"Invalid cron {name} field: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class IntervalSchedule:
+    """
+    Runs every fixed number of seconds.
+    """
+    def __init__(self, seconds):
+        """
+        :param seconds: The interval between runs
+        """
+        self.seconds = seconds
+
+    def next_run(self, after):
+        """
+        Returns the time of the next run after a given time.
+        """
+        return after + datetime.timedelta(seconds=self.seconds)
+
+    def __str__(self):
+        return f"every {self.seconds}s"
+
+
+class CronSchedule:
+    """
+    Runs at the times matched by a five field cron expression: minute, hour, day of month,
+    month and day of week (0 or 7 is Sunday). As in cron, when both day fields are restricted
+    a day matches if either of them matches.
+    """
+    def __init__(self, expression):
+        """
+        :param expression: The cron expression, e.g. '*/15 6-18 * * 1-5'
+        :raises ValueError: If the expression is invalid
+        """
+        fields = expression.split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError(f"Invalid cron expression: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(field, name, low, high) for field, (name, low, high) in zip(fields, _CRON_FIELDS))
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, date):
+        """
+        Returns whether a date matches the day of month and day of week fields.
+        """
+        day_matches = date.day in self.days
+        weekday_matches = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_run(self, after):
+        """
+        Returns the first matching minute after a given time.
+
+        :raises ValueError: If the expression never matches, e.g. on February 30
+        """
+        time = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = time + datetime.timedelta(days=366 * 5)
+        while time < limit:
+            if time.month not in self.months:
+                time = (time.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(time):
+                time = time.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif time.hour not in self.hours:
+                time = time.replace(minute=0) + datetime.timedelta(hours=1)
+            elif time.minute not in self.minutes:
+                time += datetime.timedelta(minutes=1)
+            else:
+                return time
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+    def __str__(self):
+        return f"cron '{self.expression}'"
+
+
+def parse_schedule(text):
+    """
+    Parses a schedule, either a cron expression or an interval.
+
+    :param text: A five field cron expression, e.g. '0 6 * * *', or an interval, e.g. '15m'
+    :return: A CronSchedule or an IntervalSchedule
+    :raises ValueError: If the schedule is invalid
+    """
+    if len(text.split()) > 1:
+        return CronSchedule(text)
+    return IntervalSchedule(parse_interval(text))
+
+
+class ExportService:
+    """
+    Starts export runs on a schedule and, with polling, whenever a new batch appears.
+    Scheduled runs call the stored procedure first; runs started by polling export the new batch
+    without it. A failed run is logged and the service continues with the next one.
+    """
+    def __init__(self, run, schedule=None, poll_interval=0, latest_batch_date=None, exported_batch_date=None):
+        """
+        :param run: Called with run_procedure=True for scheduled runs and False for polled runs
+        :param schedule: Optional CronSchedule or IntervalSchedule
+        :param poll_interval: Seconds between checks for a new batch, 0 to disable polling
+        :param latest_batch_date: Returns the date_created of the newest batch, required for polling
+        :param exported_batch_date: Returns the date_created of the last exported batch, e.g. load_watermark
+        :raises ValueError: If there is neither a schedule nor polling
+        """
+        if schedule is None and not poll_interval:
+            raise ValueError("The export service needs a schedule or a poll interval")
+        if poll_interval < 0:
+            raise ValueError("The poll interval must not be negative")
+        if poll_interval and latest_batch_date is None:
+            raise ValueError("Polling needs a latest batch date lookup")
+        self.run = run
+        self.schedule = schedule
+        self.poll_interval = poll_interval
+        self.latest_batch_date = latest_batch_date
+        self.exported_batch_date = exported_batch_date
+        self.last_batch_date = exported_batch_date() if exported_batch_date is not None else None
+        self.next_run = None
+        self.next_poll = None
+        self._stopped = threading.Event()
+
+    def tick(self, now):
+        """
+        Starts the runs that are due at a given time.
+
+        :param now: The current time
+        :return: The time of the next scheduled run or poll
+        """
+        if self.schedule is not None:
+            if self.next_run is None:
+                self.next_run = self.schedule.next_run(now)
+            elif now >= self.next_run:
+                self._start_run(True)
+                self.next_run = self.schedule.next_run(now)
+
+        if self.poll_interval:
+            if self.next_poll is None or now >= self.next_poll:
+                self._poll()
+                self.next_poll = now + datetime.timedelta(seconds=self.poll_interval)
+
+        return min(time for time in (self.next_run, self.next_poll) if time is not None)
+
+    def _poll(self):
+        """
+        Starts a run if a batch newer than the last exported one exists.
+        """
+        try:
+            latest = self.latest_batch_date()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Failed to check for a new batch: %s", e)
+            return
+        if latest is None or (self.last_batch_date is not None and latest <= self.last_batch_date):
+            return
+        logging.info("New batch found: %s", latest)
+        if self._start_run(False):
+            self.last_batch_date = max(latest, self.last_batch_date or latest)
+
+    def _start_run(self, run_procedure):
+        """
+        Runs an export and logs its failure.
+        After a successful run the last exported batch is read again.
+
+        :return: True if the run succeeded
+        """
+        try:
+            self.run(run_procedure=run_procedure)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error("Export run failed, continuing with the next run: %s", e)
+            return False
+        if self.exported_batch_date is not None:
+            exported = self.exported_batch_date()
+            if exported is not None and (self.last_batch_date is None or exported > self.last_batch_date):
+                self.last_batch_date = exported
+        return True
+
+    def run_forever(self):
+        """
+        Runs until stop is called.
+        """
+        logging.info("Export service started (%s)", ", ".join(
+            part for part in (self.schedule and str(self.schedule),
+                              self.poll_interval and f"polling every {self.poll_interval}s") if part))
+        while not self._stopped.is_set():
+            next_time = self.tick(datetime.datetime.now())
+            wait = (next_time - datetime.datetime.now()).total_seconds()
+            self._stopped.wait(min(max(wait, 0), MAX_WAIT_SECONDS))
+        logging.info("Export service stopped")
+
+    def stop(self):
+        """
+        Stops the service after the current run.
+        """
+        self._stopped.set()
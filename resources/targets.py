@@ -0,0 +1,130 @@
+"""
+This module defines export targets, so one process exports the batches of several schemas.
+A target is a named set of settings, e.g. schema_name, stored_procedure_name and csv_folder_path,
+that replace the environment variables of the same name while the target is exported, see
+config.use_target_settings. Every target uses the shared database engine and its connection pool,
+with the tables mapped to the schema of the target at runtime.
+"""
+import json
+import os
+import re
+from resources.checkpoint import DEFAULT_CHECKPOINT_PATH
+from resources.config import get_setting
+from resources.fingerprints import DEFAULT_FINGERPRINT_PATH
+from resources.metrics import DEFAULT_REPORT_PATH
+from resources.watermark import DEFAULT_STATE_PATH
+
+# Settings every target must define
+REQUIRED_SETTINGS = ('schema_name', 'csv_folder_path')
+
+# Files and folders that targets must not share, with their default paths. A target that does not set one
+# uses the configured path with its name appended, e.g. export_state_east.json.
+TARGET_FILE_SETTINGS = {
+    'export_state_path': DEFAULT_STATE_PATH,
+    'export_checkpoint_path': DEFAULT_CHECKPOINT_PATH,
+    'export_fingerprint_path': DEFAULT_FINGERPRINT_PATH,
+    'export_report_path': DEFAULT_REPORT_PATH,
+    'export_prometheus_path': None,
+    'export_cache_path': None,
+}
+
+
+def target_file_path(path, name):
+    """
+    Returns the path of a file for one target, e.g. export_state_east.json for export_state.json.
+
+    :param path: The configured path
+    :param name: The target name
+    :return: The path with the target name appended to the file name
+    """
+    root, extension = os.path.splitext(path.rstrip('/\\'))
+    return f'{root}_{name}{extension}'
+
+
+class ExportTarget:
+    """
+    A named set of settings exported as one unit, e.g. the schema of a division.
+    """
+    def __init__(self, name, settings):
+        """
+        :param name: Target name, used in log messages and file names
+        :param settings: Dictionary of setting name to value, e.g. schema_name and csv_folder_path
+        :raises ValueError: If the name or a setting is invalid
+        """
+        if not isinstance(name, str) or not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"Invalid target name: {name}")
+        missing = [setting for setting in REQUIRED_SETTINGS if not settings.get(setting)]
+        if missing:
+            raise ValueError(f"Target {name} is missing {', '.join(missing)}")
+        shared = [setting for setting in settings if setting.upper().startswith('SQL_')]
+        if shared:
+            raise ValueError(f"Target {name} cannot override the database connection settings: {', '.join(shared)}")
+        if not str(settings['schema_name']).isidentifier():
+            raise ValueError(f"Invalid schema name for target {name}: {settings['schema_name']}")
+
+        self.name = name
+        self.settings = {setting: str(value) for setting, value in settings.items()}
+        for setting, default in TARGET_FILE_SETTINGS.items():
+            path = get_setting(setting) or default
+            if setting not in self.settings and path:
+                self.settings[setting] = target_file_path(path, name)
+
+    @property
+    def schema(self):
+        """
+        The schema the tables of the target are in.
+        """
+        return self.settings['schema_name']
+
+    @property
+    def csv_folder_path(self):
+        """
+        The output directory of the target.
+        """
+        return self.settings['csv_folder_path']
+
+    def __str__(self):
+        return f"{self.name} (schema {self.schema})"
+
+
+def load_targets(path):
+    """
+    Loads the export targets from a JSON file holding a list of objects with a name and the
+    settings of the target, e.g.
+    [{"name": "east", "schema_name": "east", "stored_procedure_name": "export_units",
+      "csv_folder_path": "./csv_files/east"}]
+
+    :param path: The targets file path
+    :return: A list of ExportTarget
+    :raises ValueError: If the file cannot be read or a target is invalid
+    """
+    try:
+        with open(path, encoding='utf-8') as file:
+            entries = json.load(file)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Invalid targets file {path}: {e}") from e
+    if not isinstance(entries, list) or not entries or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError(f"Invalid targets file {path}: expected a list of targets")
+
+    targets = [ExportTarget(entry.get('name'), {key: value for key, value in entry.items() if key != 'name'})
+               for entry in entries]
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Invalid targets file {path}: target names must be unique")
+    folders = [os.path.abspath(target.csv_folder_path) for target in targets]
+    if len(set(folders)) != len(folders):
+        raise ValueError(f"Invalid targets file {path}: every target needs its own csv_folder_path")
+    return targets
+
+
+class TargetExportError(Exception):
+    """
+    Raised when one or more targets of a multi-target run fail.
+    """
+    def __init__(self, failures):
+        """
+        :param failures: Dictionary of target name to the exception raised while exporting it
+        """
+        self.failures = failures
+        details = "; ".join(f"{name}: {error}" for name, error in failures.items())
+        super().__init__(f"Failed to export {len(failures)} target(s): {details}")
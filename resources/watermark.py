@@ -0,0 +1,59 @@
+"""
+This module keeps track of the last exported UnitsCompleteExport batch in a local state file.
+"""
+import datetime
+import json
+import os
+from resources.config import get_setting
+
+DEFAULT_STATE_PATH = 'export_state.json'
+
+
+def get_state_path(path=None):
+    """
+    Returns the path of the export state file.
+
+    :param path: Explicit path, falls back to the export_state_path setting, see config.get_setting
+    :return: The state file path
+    """
+    return path or get_setting('export_state_path') or DEFAULT_STATE_PATH
+
+
+def load_watermark(path=None):
+    """
+    Loads the date_created of the last exported batch.
+
+    :param path: State file path, see get_state_path
+    :return: The date_created of the last exported batch, or None if nothing was exported yet
+    :raises ValueError: If the state file cannot be parsed
+    """
+    path = get_state_path(path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as file:
+            state = json.load(file)
+        return datetime.datetime.fromisoformat(state['date_created'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid export state file: {path}") from e
+
+
+def save_watermark(date_created, record_count, path=None):
+    """
+    Saves the date_created of the last exported batch.
+    The file is replaced atomically, so an interrupted save keeps the previous watermark.
+
+    :param date_created: The date_created of the exported batch
+    :param record_count: The number of exported records, kept for reference
+    :param path: State file path, see get_state_path
+    """
+    path = get_state_path(path)
+    state = {
+        'date_created': date_created.isoformat(),
+        'record_count': record_count,
+        'exported_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, path)
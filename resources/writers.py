@@ -0,0 +1,570 @@
+"""
+This module contains writers that stream export rows to per-partition output files.
+"""
+import csv
+import datetime
+import gzip
+import io
+import logging
+import os
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from resources.fingerprints import PartitionFingerprint
+from resources.metrics import get_metrics
+from resources.output import ChecksumFile, FileChecksum, temp_path
+
+# Columns written to every export file, in output order
+EXPORT_COLUMNS = ['job_date', 'job_number', 'phase_number', 'category_number',
+                  'unit_change', 'notes', 'cost_code']
+
+# Partition key for rows that are missing from the budget
+MISSING_FROM_BUDGET = 'missing_from_budget'
+
+DEFAULT_MAX_OPEN_FILES = 32
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_ROW_GROUP_SIZE = 64 * 1024
+
+
+def get_base_name(date_created):
+    """
+    Build the export base name for a batch, e.g. UC_20240101120000.
+
+    :param date_created: The date_created of the batch
+    :return: The base name shared by every file of the batch
+    """
+    return f'UC_{date_created.strftime("%Y%m%d%H%M%S")}'
+
+
+def partition_file_name(base_name, key, extension='csv'):
+    """
+    Build the export file name for a partition.
+
+    :param base_name: Export base name, e.g. UC_20240101120000
+    :param key: A job date or MISSING_FROM_BUDGET
+    :param extension: File extension of the output format
+    :return: The file name for the partition
+    """
+    if key == MISSING_FROM_BUDGET:
+        return f'{base_name}_{MISSING_FROM_BUDGET}.{extension}'
+    if not hasattr(key, 'strftime'):
+        key = datetime.date.fromisoformat(str(key)[:10])
+    return f'{base_name}_{key.strftime("%Y%m%d")}.{extension}'
+
+
+class PartitionWriter:
+    """
+    Base class for writers that send rows to one output file per partition key in a single pass.
+    Subclasses implement _write_rows and _close_files and open their files with _open_checksum_file,
+    so the size and checksum of every file are computed while it is written.
+    With an OutputCommit, files are written to temporary paths and added to the commit on close.
+    On close every partition is also recorded in the run metrics. When record_partitions is False,
+    e.g. in a worker process, the caller does both from partition_stats instead.
+    When the commit deduplicates, every partition is fingerprinted. Partitions that are written from a
+    DataFrame are fingerprinted first and not written at all when they are unchanged.
+    """
+    extension = None
+    record_partitions = True
+
+    def __init__(self, csv_folder_path, base_name, columns=None, output=None):
+        """
+        :param csv_folder_path: Output directory
+        :param base_name: Export base name used to build file names
+        :param columns: Output columns, defaults to EXPORT_COLUMNS
+        :param output: Optional OutputCommit the files are committed with
+        """
+        self.csv_folder_path = csv_folder_path
+        self.base_name = base_name
+        self.columns = columns or EXPORT_COLUMNS
+        self.output = output
+        self.dedup = output is not None and output.fingerprints is not None
+        self.row_counts = {}
+        self.file_paths = {}
+        self.write_paths = {}
+        self.write_seconds = {}
+        self.fingerprints = {}
+        self.checksums = {}
+        self.skipped = set()
+        # Partitions fingerprinted before they were written
+        self._fingerprinted = set()
+
+    def _file_path(self, key):
+        """
+        Return the path a partition is written to, registering the partition on first use.
+        :return: A tuple of the path and whether the partition is new
+        """
+        created = key not in self.file_paths
+        if created:
+            file_name = partition_file_name(self.base_name, key, self.extension)
+            file_path = os.path.join(self.csv_folder_path, file_name)
+            self.file_paths[key] = file_path
+            self.write_paths[key] = temp_path(file_path) if self.output is not None else file_path
+            self.row_counts[key] = 0
+            self.write_seconds[key] = 0.0
+        return self.write_paths[key], created
+
+    def _open_checksum_file(self, key):
+        """
+        Open the file of a partition for writing in binary mode, creating it when it is first opened
+        and appending to it otherwise. Every byte written to it is added to the checksum of the partition.
+        :return: A tuple of the ChecksumFile and whether the file is new
+        """
+        file_path, _ = self._file_path(key)
+        created = key not in self.checksums
+        if created:
+            self.checksums[key] = FileChecksum()
+        return ChecksumFile(file_path, 'wb' if created else 'ab', self.checksums[key]), created
+
+    def _write_rows(self, key, rows):
+        """
+        Append rows to the partition file.
+        """
+        raise NotImplementedError
+
+    def _close_files(self):
+        """
+        Flush and close every open partition file.
+        """
+        raise NotImplementedError
+
+    def write(self, key, row):
+        """
+        Append a row to the partition file.
+
+        :param key: Partition key
+        :param row: Sequence of values in column order
+        """
+        self.write_rows(key, [row])
+
+    def write_rows(self, key, rows):
+        """
+        Append several rows to the partition file.
+
+        :param key: Partition key
+        :param rows: Sequence of rows in column order
+        """
+        start = time.perf_counter()
+        self._write_rows(key, rows)
+        self.write_seconds[key] += time.perf_counter() - start
+        self.row_counts[key] += len(rows)
+        if self.dedup and key not in self._fingerprinted:
+            self.fingerprints.setdefault(key, PartitionFingerprint()).update(rows)
+
+    def _fingerprint_first(self, key, fingerprint):
+        """
+        Use the fingerprint of a complete partition before it is written.
+        An unchanged partition is registered without writing its file.
+
+        :return: True if the partition must be written
+        """
+        self.fingerprints[key] = fingerprint
+        self._fingerprinted.add(key)
+        file_name = partition_file_name(self.base_name, key, self.extension)
+        if self.output.previous_export(os.path.join(self.csv_folder_path, file_name), fingerprint.hexdigest()):
+            self._file_path(key)
+            self.row_counts[key] = fingerprint.rows
+            self.skipped.add(key)
+            return False
+        return True
+
+    def write_frame(self, df, complete=True):
+        """
+        Write a DataFrame of export rows one partition at a time, without copying the DataFrame.
+        Every row goes to its job date partition and, when flagged, to the missing budget partition.
+        Each partition is written with a single write_rows call, reading its rows from the columns.
+
+        :param df: DataFrame with the output columns plus job_date and missing_from_budget
+        :param complete: Whether df holds every row of its partitions, so unchanged partitions
+            can be skipped before they are written. False when a batch is written in chunks.
+        """
+        columns = [_csv_values(df[column]) for column in self.columns]
+        partitions = {MISSING_FROM_BUDGET: (df[MISSING_FROM_BUDGET] == 1).to_numpy().nonzero()[0]}
+        partitions.update(df.groupby('job_date', sort=False).indices)
+        for key, positions in partitions.items():
+            if len(positions) == 0:
+                continue
+            rows = _FrameRows(columns, positions)
+            if self.dedup and complete:
+                fingerprint = PartitionFingerprint()
+                fingerprint.update(rows)
+                if not self._fingerprint_first(key, fingerprint):
+                    continue
+            self.write_rows(key, rows)
+
+    def write_table(self, table, complete=True):
+        """
+        Write a pyarrow Table of export rows, see arrow_tables.
+        The rows of every partition are selected with an index array and gathered one partition at a
+        time, so the table itself is never copied.
+
+        :param table: pyarrow.Table with the output columns plus job_date and missing_from_budget
+        :param complete: Whether table holds every row of its partitions, see write_frame
+        """
+        from resources.arrow_tables import partition_indices  # pylint: disable=import-outside-toplevel
+        for key, indices in partition_indices(table):
+            self.write_table_partition(key, table.take(indices), complete)
+
+    def write_table_partition(self, key, table, complete=True):
+        """
+        Write every row of a pyarrow Table to a single partition.
+
+        :param key: Partition key
+        :param table: pyarrow.Table with the output columns
+        :param complete: Whether table holds every row of the partition, see write_frame
+        """
+        from resources.arrow_tables import table_rows  # pylint: disable=import-outside-toplevel
+        rows = table_rows(table, self.columns) if self.dedup else None
+        if rows is not None and complete:
+            fingerprint = PartitionFingerprint()
+            fingerprint.update(rows)
+            if not self._fingerprint_first(key, fingerprint):
+                return
+        start = time.perf_counter()
+        self._write_table(key, table, rows)
+        self.write_seconds[key] += time.perf_counter() - start
+        self.row_counts[key] += table.num_rows
+        if rows is not None and key not in self._fingerprinted:
+            self.fingerprints.setdefault(key, PartitionFingerprint()).update(rows)
+
+    def _write_table(self, key, table, rows=None):
+        """
+        Append the rows of a pyarrow Table to the partition file.
+
+        :param rows: The rows of the table as returned by arrow_tables.table_rows, if already built
+        """
+        from resources.arrow_tables import table_rows  # pylint: disable=import-outside-toplevel
+        self._write_rows(key, rows if rows is not None else table_rows(table, self.columns))
+
+    def write_partition(self, key, df):
+        """
+        Write every row of a DataFrame to a single partition.
+
+        :param key: Partition key
+        :param df: DataFrame with the output columns
+        """
+        rows = list(zip(*(_csv_values(df[column]) for column in self.columns)))
+        if self.dedup:
+            fingerprint = PartitionFingerprint()
+            fingerprint.update(rows)
+            if not self._fingerprint_first(key, fingerprint):
+                return
+        self.write_rows(key, rows)
+
+    def partition_stats(self):
+        """
+        Return the key, final file path, row count, write time, size, fingerprint and checksum of every
+        written or skipped partition. The checksum is a tuple of the size and SHA-256 checksum of the
+        file, see OutputCommit.add. Skipped partitions have a size of 0 and no checksum.
+        """
+        stats = []
+        for key, file_path in self.file_paths.items():
+            written = os.path.exists(self.write_paths[key])
+            if written or key in self.skipped:
+                fingerprint = self.fingerprints.get(key)
+                checksum = self.checksums.get(key) if written else None
+                stats.append((key, file_path, self.row_counts[key], self.write_seconds[key],
+                              checksum.size if checksum is not None else 0,
+                              fingerprint.hexdigest() if fingerprint is not None else None,
+                              (checksum.size, checksum.hexdigest()) if checksum is not None else None))
+        return stats
+
+    def close(self):
+        """
+        Close every open partition file, log what was written, add it to the output commit
+        and record it in the run metrics.
+        """
+        start = time.perf_counter()
+        self._close_files()
+        close_seconds = time.perf_counter() - start
+        for key, file_path in self.file_paths.items():
+            if key not in self.skipped:
+                logging.info("Created %s (%d records)", file_path, self.row_counts[key])
+        if self.record_partitions:
+            record_partitions(self.partition_stats(), self.output)
+            get_metrics().add_span('write', close_seconds, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvPartitionWriter(PartitionWriter):
+    """
+    Writes rows to one CSV file per partition key in a single pass.
+    Files are opened on first use and produce the same text as DataFrame.to_csv(index=False).
+    At most max_open_files files are open at once, the least recently used one is closed
+    and reopened for appending when it receives rows again.
+    """
+    extension = 'csv'
+
+    def __init__(self, csv_folder_path, base_name, columns=None, output=None,
+                 max_open_files=DEFAULT_MAX_OPEN_FILES, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param csv_folder_path: Output directory
+        :param base_name: Export base name used to build file names
+        :param columns: Header columns, defaults to EXPORT_COLUMNS
+        :param output: Optional OutputCommit the files are committed with
+        :param max_open_files: Maximum number of files kept open at the same time
+        :param buffer_size: Write buffer size per open file in bytes
+        """
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        super().__init__(csv_folder_path, base_name, columns, output)
+        self.max_open_files = max_open_files
+        self.buffer_size = buffer_size
+        self._open = OrderedDict()
+
+    def _open_file(self, raw):
+        """
+        Open an output file in text mode on top of its ChecksumFile.
+        """
+        return io.TextIOWrapper(io.BufferedWriter(raw, self.buffer_size), newline='', encoding='utf-8')
+
+    def _get_writer(self, key):
+        """
+        Return the csv writer for a partition, opening or creating the file if needed.
+        """
+        entry = self._open.get(key)
+        if entry is not None:
+            self._open.move_to_end(key)
+            return entry[1]
+
+        if len(self._open) >= self.max_open_files:
+            _, (oldest_file, _, oldest_raw) = self._open.popitem(last=False)
+            oldest_file.close()
+            oldest_raw.close()
+
+        raw, created = self._open_checksum_file(key)
+        file = self._open_file(raw)
+        writer = csv.writer(file, lineterminator=os.linesep)
+        if created:
+            writer.writerow(self.columns)
+        self._open[key] = (file, writer, raw)
+        return writer
+
+    def _write_rows(self, key, rows):
+        self._get_writer(key).writerows(rows)
+
+    def _close_files(self):
+        # Compressed files do not close the underlying file, so the ChecksumFile is closed as well
+        for file, _, raw in self._open.values():
+            file.close()
+            raw.close()
+        self._open.clear()
+
+
+class GzipCsvPartitionWriter(CsvPartitionWriter):
+    """
+    Writes gzip compressed CSV files. Reopened files get a new gzip member, which every
+    gzip reader concatenates transparently.
+    """
+    extension = 'csv.gz'
+
+    def _open_file(self, raw):
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb'), newline='', encoding='utf-8')
+
+
+class ZstdCsvPartitionWriter(CsvPartitionWriter):
+    """
+    Writes zstd compressed CSV files. Requires the zstandard package.
+    """
+    extension = 'csv.zst'
+
+    def __init__(self, *args, **kwargs):
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError("The csv.zst output format requires the zstandard package") from e
+        self._zstandard = zstandard
+        super().__init__(*args, **kwargs)
+
+    def _open_file(self, raw):
+        return self._zstandard.open(raw, 'w', newline='', encoding='utf-8', closefd=False)
+
+
+class ArrowPartitionWriter(PartitionWriter):
+    """
+    Writes typed columnar files, Parquet or Arrow IPC, with one file per partition.
+    job_date is stored as DATE and unit_change as DECIMAL(8, 2). Rows are buffered per partition
+    and written as a row group or record batch every row_group_size rows. Requires pyarrow.
+    """
+    def __init__(self, csv_folder_path, base_name, columns=None, output=None, file_format='parquet',
+                 row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        """
+        :param csv_folder_path: Output directory
+        :param base_name: Export base name used to build file names
+        :param columns: Output columns, defaults to EXPORT_COLUMNS
+        :param output: Optional OutputCommit the files are committed with
+        :param file_format: 'parquet' or 'arrow'
+        :param row_group_size: Number of rows buffered per partition before they are written
+        """
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.ipc  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError(f"The {file_format} output format requires the pyarrow package") from e
+        if file_format not in ('parquet', 'arrow'):
+            raise ValueError(f"Invalid columnar file format: {file_format}")
+        super().__init__(csv_folder_path, base_name, columns, output)
+        self.extension = file_format
+        self.row_group_size = row_group_size
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(column, _arrow_type(pyarrow, column)) for column in self.columns])
+        self._buffers = {}
+        self._writers = {}
+        self._files = {}
+
+    def _write_rows(self, key, rows):
+        self._file_path(key)
+        buffer = self._buffers.setdefault(key, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.row_group_size:
+            self._flush(key)
+
+    def _write_table(self, key, table, rows=None):
+        # The columns already have their output types, so they are written without conversion
+        self._flush(key)
+        self._write_arrow(key, table.select(self.columns).cast(self._schema))
+
+    def _flush(self, key):
+        """
+        Write the buffered rows of a partition.
+        """
+        rows = self._buffers.pop(key, [])
+        if not rows:
+            self._get_writer(key)
+            return
+        arrays = [
+            self._pa.array(_arrow_values(column, values), type=field.type)
+            for column, field, values in zip(self.columns, self._schema, zip(*rows))
+        ]
+        self._write_arrow(key, self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def _get_writer(self, key):
+        """
+        Return the Parquet or Arrow IPC writer of a partition, creating the file if needed.
+        """
+        writer = self._writers.get(key)
+        if writer is None:
+            file, _ = self._open_checksum_file(key)
+            if self.extension == 'parquet':
+                writer = self._pa.parquet.ParquetWriter(file, self._schema)
+            else:
+                writer = self._pa.ipc.new_file(file, self._schema)
+            self._writers[key] = writer
+            self._files[key] = file
+        return writer
+
+    def _write_arrow(self, key, table):
+        """
+        Write a table with the output schema to the partition file.
+        """
+        writer = self._get_writer(key)
+        if self.extension == 'parquet':
+            writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            writer.write_table(table, max_chunksize=self.row_group_size)
+
+    def _close_files(self):
+        for key in list(self._buffers):
+            self._flush(key)
+        for writer in self._writers.values():
+            writer.close()
+        for file in self._files.values():
+            file.close()
+        self._writers.clear()
+        self._files.clear()
+
+
+# Writer class and constructor arguments for every output format
+OUTPUT_FORMATS = {
+    'csv': (CsvPartitionWriter, {}),
+    'csv.gz': (GzipCsvPartitionWriter, {}),
+    'csv.zst': (ZstdCsvPartitionWriter, {}),
+    'parquet': (ArrowPartitionWriter, {'file_format': 'parquet'}),
+    'arrow': (ArrowPartitionWriter, {'file_format': 'arrow'}),
+}
+
+
+def create_partition_writer(csv_folder_path, base_name, output_format='csv', **kwargs):
+    """
+    Create the partition writer for an output format.
+
+    :param csv_folder_path: Output directory
+    :param base_name: Export base name used to build file names
+    :param output_format: One of OUTPUT_FORMATS
+    :param kwargs: Additional arguments for the writer
+    :return: A PartitionWriter
+    :raises ValueError: If the output format is unknown
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format: {output_format}")
+    writer_class, options = OUTPUT_FORMATS[output_format]
+    return writer_class(csv_folder_path, base_name, **options, **kwargs)
+
+
+def record_partitions(partition_stats, output=None):
+    """
+    Record written partitions in the run metrics and add them to an output commit.
+    Partitions the commit skips as unchanged are only counted.
+
+    :param partition_stats: Partitions as returned by PartitionWriter.partition_stats
+    :param output: Optional OutputCommit the partitions were written for
+    """
+    metrics = get_metrics()
+    for key, file_path, rows, seconds, size, fingerprint, checksum in partition_stats:
+        if output is not None and not output.add(file_path, rows, fingerprint, checksum):
+            metrics.increment('partitions_unchanged')
+            continue
+        metrics.record_partition(key, file_path, rows, seconds, size)
+
+
+def _arrow_type(pa, column):
+    """
+    Return the Arrow type of an export column.
+    """
+    if column == 'job_date':
+        return pa.date32()
+    if column == 'unit_change':
+        return pa.decimal128(8, 2)
+    return pa.string()
+
+
+def _arrow_values(column, values):
+    """
+    Prepare the values of a column for conversion to its Arrow type.
+    """
+    if column == 'unit_change':
+        return [value if value is None or isinstance(value, Decimal) else Decimal(str(value))
+                for value in values]
+    if column == 'job_date':
+        return [datetime.date.fromisoformat(value[:10]) if isinstance(value, str) else value
+                for value in values]
+    return values
+
+
+class _FrameRows:
+    """
+    The rows of a DataFrame partition, read from the columns at its positions whenever iterated.
+    """
+    def __init__(self, columns, positions):
+        self.columns = columns
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return zip(*(column.iloc[self.positions] for column in self.columns))
+
+
+def _csv_values(series):
+    """
+    Return the values of a column as DataFrame.to_csv writes them, with missing floats left empty.
+    """
+    if series.dtype.kind == 'f':
+        return series.astype(object).where(series.notna(), None)
+    return series
@@ -0,0 +1,14 @@
+-- Adds the index used to find and read a batch to an existing UnitsCompleteExport table.
+-- create_tables only creates it together with a new table. Run it once per target schema,
+-- replacing dbo with the schema_name of the target. Running it again does nothing.
+-- On editions with online index operations, add WITH (ONLINE = ON) to keep the table writable
+-- while the index is built.
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = 'ix_UnitsCompleteExport_date_created_job_date'
+      AND object_id = OBJECT_ID('dbo.UnitsCompleteExport')
+)
+    CREATE NONCLUSTERED INDEX ix_UnitsCompleteExport_date_created_job_date
+        ON dbo.UnitsCompleteExport (date_created, job_date);
+GO
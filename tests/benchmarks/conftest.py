@@ -0,0 +1,73 @@
+"""
+This module contains fixtures for the benchmarks.
+"""
+import datetime
+import os
+from unittest.mock import patch
+import pytest
+from sqlalchemy import create_engine
+from resources.models import Base, UnitsCompleteExport
+from tests.benchmarks.harness import load_baselines, save_baselines
+from tests.utils import generate_units_rows, insert_units_rows
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+def pytest_addoption(parser):
+    """
+    Add the benchmark command line options.
+    """
+    parser.addoption('--update-baselines', action='store_true', default=False,
+                     help="Store the benchmark results as the new baselines instead of comparing against them")
+
+
+@pytest.fixture(autouse=True, scope='session')
+def mock_env_variables():
+    """
+    Fixture to provide the database settings the Config class requires.
+    Scenario processes inherit the environment when they are spawned.
+    """
+    with patch.dict(os.environ, {
+        'SQL_SERVER': 'localhost',
+        'SQL_DATABASE': 'benchmark_db',
+        'SQL_USERNAME': 'benchmark_user',
+        'SQL_PASSWORD': 'benchmark_password',
+    }):
+        yield
+
+
+@pytest.fixture(name='benchmark_rows', scope='session')
+def benchmark_rows_fixture():
+    """
+    Fixture for the number of rows in the benchmark batch, set with BENCHMARK_ROWS.
+    """
+    return int(os.getenv('BENCHMARK_ROWS', '100000'))
+
+
+@pytest.fixture(name='benchmark_database', scope='session')
+def benchmark_database_fixture(tmp_path_factory, benchmark_rows):
+    """
+    Fixture to create a SQLite database file with a synthetic latest batch and an older batch.
+    """
+    database_path = str(tmp_path_factory.mktemp('benchmark') / 'benchmark.db')
+    engine = create_engine(
+        f'sqlite:///{database_path}',
+        execution_options={'schema_translate_map': {UnitsCompleteExport.__table__.schema: None}},
+    )
+    Base.metadata.create_all(engine)
+    insert_units_rows(engine, generate_units_rows(1000, BATCH_DATE - datetime.timedelta(days=1), seed=1))
+    insert_units_rows(engine, generate_units_rows(benchmark_rows, BATCH_DATE, start_id=1001))
+    engine.dispose()
+    return database_path
+
+
+@pytest.fixture(name='baselines', scope='session')
+def baselines_fixture(request):
+    """
+    Fixture to load the stored baselines, and store them again at the end of the session
+    when --update-baselines is given.
+    """
+    baselines = load_baselines()
+    yield baselines
+    if request.config.getoption('--update-baselines'):
+        save_baselines(baselines)
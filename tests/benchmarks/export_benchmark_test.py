@@ -0,0 +1,44 @@
+"""
+This module contains benchmarks for the export pipeline.
+Run with: pytest tests/benchmarks -s
+Record new baselines with: pytest tests/benchmarks -s --update-baselines
+"""
+import os
+import pytest
+from tests.benchmarks.harness import (
+    DEFAULT_REPEATS,
+    DEFAULT_TOLERANCE,
+    find_regressions,
+    format_report,
+    run_scenario_process,
+    summarize
+)
+
+# 'stages' times each stage of the pandas export separately, the others time a mode end to end
+SCENARIOS = ['stages', 'mode_pandas', 'mode_columnar', 'mode_stream', 'mode_async', 'mode_arrow',
+             'mode_cursor']
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_export_benchmark(scenario, benchmark_database, benchmark_rows, baselines, request, tmp_path):
+    """
+    Benchmark a scenario and fail if it regressed against its stored baseline.
+    """
+    repeats = int(os.getenv('BENCHMARK_REPEATS', str(DEFAULT_REPEATS)))
+    stages = run_scenario_process(benchmark_database, scenario, str(tmp_path), repeats)
+    print('\n' + format_report(scenario, benchmark_rows, stages))
+
+    key = f'{scenario}@{benchmark_rows}'
+    if request.config.getoption('--update-baselines'):
+        baselines[key] = summarize(stages)
+        return
+    if key not in baselines:
+        pytest.skip(f'No baseline for {key}, record one with --update-baselines')
+
+    tolerance = float(os.getenv('BENCHMARK_TOLERANCE', str(DEFAULT_TOLERANCE)))
+    regressions = find_regressions(stages, baselines[key], tolerance)
+    if regressions:
+        # Confirm the regression with another round of repeats, other load only slows some runs down
+        stages = run_scenario_process(benchmark_database, scenario, str(tmp_path), repeats, stages)
+        regressions = find_regressions(stages, baselines[key], tolerance)
+    assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,222 @@
+"""
+This module contains the harness for the export benchmarks.
+Each scenario runs in a fresh process so its peak RSS is not affected by the other scenarios.
+"""
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import multiprocessing
+from unittest.mock import patch
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from main import export_frame, export_latest_batch
+from resources.config import ExportConfig
+from resources.database import dispose_databases, get_database
+from resources.db_functions import fetch_latest_batch
+from resources.models import UnitsCompleteExport
+from resources.writers import EXPORT_COLUMNS, get_base_name, partition_file_name
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Allowed relative drop in throughput or growth in peak RSS before a run counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Number of runs of a scenario, each stage keeps its fastest run
+DEFAULT_REPEATS = 5
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of the current process in MiB, None if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageRecorder:
+    """
+    Records the duration, throughput and peak RSS of each stage of a run.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time a stage. When the number of rows is only known inside the stage, set it on the
+        yielded dictionary.
+
+        :param name: Stage name
+        :param rows: Number of rows processed by the stage
+        """
+        measurements = {'rows': rows}
+        start = time.perf_counter()
+        yield measurements
+        measurements['seconds'] = time.perf_counter() - start
+        measurements['rows_per_second'] = measurements['rows'] / measurements['seconds']
+        measurements['peak_rss_mb'] = peak_rss_mb()
+        self.stages[name] = measurements
+
+
+def run_stages(recorder, csv_folder_path):
+    """
+    Export the latest batch the way main() does in pandas mode, timing every stage separately.
+    The groupby and group_csv_write stages time the earlier export, which wrote one DataFrame copy
+    per partition, so it can still be compared with the single-pass csv_write.
+    """
+    with recorder.stage('fetch') as measurements:
+        units = fetch_latest_batch()
+        measurements['rows'] = rows = len(units)
+
+    with recorder.stage('to_dict', rows):
+        records = [unit.to_dict() for unit in units]
+    with recorder.stage('dataframe', rows):
+        df = pd.DataFrame(records)
+    base_name = get_base_name(units[0].date_created)
+    with recorder.stage('groupby', rows):
+        groups = [('missing_from_budget', df[df['missing_from_budget'] == 1])]
+        groups += list(df.groupby('job_date'))
+    group_folder_path = os.path.join(csv_folder_path, 'groupby')
+    os.makedirs(group_folder_path, exist_ok=True)
+    with recorder.stage('group_csv_write', rows):
+        for key, group_df in groups:
+            group_df.to_csv(os.path.join(group_folder_path, partition_file_name(base_name, key)),
+                            index=False, columns=EXPORT_COLUMNS)
+    with recorder.stage('csv_write', rows):
+        export_frame(df, base_name, csv_folder_path)
+
+
+def run_mode(recorder, csv_folder_path, mode):
+    """
+    Export the latest batch end to end with an export mode.
+    """
+    with recorder.stage('export') as measurements:
+        _, measurements['rows'] = export_latest_batch(csv_folder_path, ExportConfig(mode=mode))
+
+
+def run_scenario(database_path, scenario, csv_folder_path):
+    """
+    Run a scenario against a SQLite database file. Runs inside the scenario process.
+
+    :param database_path: Path of the SQLite database with the benchmark data
+    :param scenario: 'stages' or 'mode_<export mode>'
+    :param csv_folder_path: Output directory
+    :return: Dictionary of stage name to its measurements
+    """
+    execution_options = {'schema_translate_map': {UnitsCompleteExport.__table__.schema: None}}
+    engine = create_engine(f'sqlite:///{database_path}', execution_options=execution_options)
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{database_path}', execution_options=execution_options)
+    recorder = StageRecorder()
+    with patch('resources.database.Database._create_engine', return_value=engine), \
+            patch('resources.async_database.AsyncDatabase._create_engine', return_value=async_engine):
+        get_database()
+        if scenario == 'stages':
+            run_stages(recorder, csv_folder_path)
+        else:
+            run_mode(recorder, csv_folder_path, scenario[len('mode_'):])
+        dispose_databases()
+    return recorder.stages
+
+
+def run_scenario_process(database_path, scenario, csv_folder_path, repeats=1, best=None):
+    """
+    Run a scenario in freshly spawned processes, once per repeat.
+    Each stage keeps its fastest repeat, which filters out noise from other load on the machine.
+
+    :param repeats: Number of times the scenario runs
+    :param best: Measurements of earlier repeats to keep the fastest of, e.g. to confirm a regression
+    :return: Dictionary of stage name to its measurements
+    """
+    context = multiprocessing.get_context('spawn')
+    best = dict(best or {})
+    for _ in range(repeats):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            stages = executor.submit(run_scenario, database_path, scenario, csv_folder_path).result()
+        for name, measurements in stages.items():
+            if name not in best or measurements['seconds'] < best[name]['seconds']:
+                best[name] = measurements
+    return best
+
+
+def load_baselines(path=BASELINES_PATH):
+    """
+    Load the stored baselines, an empty dictionary if there are none.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baselines(baselines, path=BASELINES_PATH):
+    """
+    Store the baselines.
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def summarize(stages):
+    """
+    Reduce the measurements of a run to the values stored as its baseline.
+    """
+    summary = {}
+    for name, measurements in stages.items():
+        summary[name] = {'rows_per_second': round(measurements['rows_per_second'])}
+        if measurements['peak_rss_mb'] is not None:
+            summary[name]['peak_rss_mb'] = round(measurements['peak_rss_mb'], 1)
+    summary['recorded'] = datetime.date.today().isoformat()
+    return summary
+
+
+def find_regressions(stages, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the measurements of a run with its baseline.
+
+    :param stages: Dictionary of stage name to its measurements
+    :param baseline: The stored baseline of the scenario
+    :param tolerance: Allowed relative drop in throughput or growth in peak RSS
+    :return: A list of regression messages, empty if there are none
+    """
+    regressions = []
+    for name, measurements in stages.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        minimum = expected['rows_per_second'] * (1 - tolerance)
+        if measurements['rows_per_second'] < minimum:
+            regressions.append(f"{name}: {measurements['rows_per_second']:,.0f} rows/s is below "
+                               f"the baseline of {expected['rows_per_second']:,} rows/s")
+        if measurements['peak_rss_mb'] is not None and 'peak_rss_mb' in expected:
+            maximum = expected['peak_rss_mb'] * (1 + tolerance)
+            if measurements['peak_rss_mb'] > maximum:
+                regressions.append(f"{name}: peak RSS of {measurements['peak_rss_mb']:.1f} MiB is above "
+                                   f"the baseline of {expected['peak_rss_mb']} MiB")
+    return regressions
+
+
+def format_report(scenario, rows, stages):
+    """
+    Format the measurements of a run as a table.
+    """
+    lines = [f"{scenario} ({rows:,} rows)",
+             f"  {'stage':<12}{'seconds':>10}{'rows/s':>14}{'peak RSS MiB':>14}"]
+    for name, measurements in stages.items():
+        rss = measurements['peak_rss_mb']
+        lines.append(f"  {name:<12}{measurements['seconds']:>10.3f}{measurements['rows_per_second']:>14,.0f}"
+                     f"{'n/a' if rss is None else f'{rss:.1f}':>14}")
+    return "\n".join(lines)
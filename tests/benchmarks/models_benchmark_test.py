@@ -0,0 +1,108 @@
+"""
+This module contains benchmarks for the batch notes and cost code derivation.
+Run with: pytest tests/benchmarks -s
+The batch derivation is compared against its stored baseline, see export_benchmark_test.
+"""
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import pytest
+from resources.models import UnitsCompleteExport
+from tests.benchmarks.harness import DEFAULT_REPEATS, DEFAULT_TOLERANCE, find_regressions, summarize
+
+ROW_COUNT = 1_000_000
+
+# Building model instances is slow, so the per-row baseline on them is timed on a sample
+MODEL_SAMPLE_COUNT = 100_000
+
+Row = namedtuple("Row", ["timesheet_id", "change_order_id", "sub_report_id", "vendor_name",
+                         "job_number", "phase_number", "category_number"])
+
+
+@pytest.fixture(name="columns", scope="module")
+def columns_fixture():
+    """
+    Fixture to generate one million rows of source columns with realistic null ratios.
+    """
+    rng = np.random.default_rng(42)
+    ids = rng.integers(1, 10_000_000, size=ROW_COUNT).astype(object)
+
+    def with_nulls(values, ratio):
+        values = values.copy()
+        values[rng.random(ROW_COUNT) < ratio] = None
+        return values
+
+    vendors = np.array([f"Vendor {i}" for i in range(500)], dtype=object)[rng.integers(0, 500, ROW_COUNT)]
+    return {
+        "timesheet_id": with_nulls(ids, 0.3),
+        "change_order_id": with_nulls(ids, 0.8),
+        "sub_report_id": with_nulls(ids, 0.9),
+        "vendor_name": with_nulls(vendors, 0.7),
+        "job_number": np.array([f"{i:06d}" for i in range(ROW_COUNT)], dtype=object),
+        "phase_number": np.array(["001", "002", "010"], dtype=object)[rng.integers(0, 3, ROW_COUNT)],
+        "category_number": np.array(["L", "M", "E", "S"], dtype=object)[rng.integers(0, 4, ROW_COUNT)],
+    }
+
+
+def run_batch(columns):
+    """
+    Derive notes and cost codes for whole columns.
+    """
+    notes = UnitsCompleteExport.batch_notes(
+        columns["timesheet_id"], columns["change_order_id"],
+        columns["sub_report_id"], columns["vendor_name"])
+    cost_codes = UnitsCompleteExport.batch_cost_codes(
+        columns["job_number"], columns["phase_number"], columns["category_number"])
+    return notes, cost_codes
+
+
+def test_batch_derivation_one_million_rows(columns, baselines, request):
+    """
+    Benchmark the batch derivation against the per-row methods, check the outputs are identical
+    and fail if the batch derivation regressed against its stored baseline.
+    """
+    # The batch derivation keeps its fastest run, like the export stages
+    batch_seconds = None
+    for _ in range(int(os.getenv('BENCHMARK_REPEATS', str(DEFAULT_REPEATS)))):
+        start = time.perf_counter()
+        notes, cost_codes = run_batch(columns)
+        seconds = time.perf_counter() - start
+        batch_seconds = seconds if batch_seconds is None else min(batch_seconds, seconds)
+
+    # Per-row methods on plain tuples: the parity reference and the fastest possible per-row loop
+    rows = [Row(*values) for values in zip(*(columns[field] for field in Row._fields))]
+    start = time.perf_counter()
+    expected_notes = [UnitsCompleteExport.format_notes(row.timesheet_id, row.change_order_id, row.sub_report_id,
+                                                       row.vendor_name) for row in rows]
+    expected_cost_codes = [UnitsCompleteExport.format_cost_code(row.job_number, row.phase_number, row.category_number)
+                           for row in rows]
+    tuple_seconds = time.perf_counter() - start
+
+    # Per-row methods on model instances, as the ORM export path calls them
+    models = [UnitsCompleteExport(**row._asdict()) for row in rows[:MODEL_SAMPLE_COUNT]]
+    start = time.perf_counter()
+    for model in models:
+        model.get_notes()
+        model.get_cost_code()
+    model_seconds = (time.perf_counter() - start) * ROW_COUNT / MODEL_SAMPLE_COUNT
+
+    print(f"\n{ROW_COUNT} rows: batch {batch_seconds:.2f}s, "
+          f"per-row on tuples {tuple_seconds:.2f}s, "
+          f"per-row on models {model_seconds:.2f}s (extrapolated from {MODEL_SAMPLE_COUNT})")
+
+    assert list(notes) == expected_notes
+    assert list(cost_codes) == expected_cost_codes
+
+    # Only throughput is compared, the peak RSS of the test process includes the other benchmarks
+    stages = {'batch': {'rows_per_second': ROW_COUNT / batch_seconds, 'peak_rss_mb': None}}
+    key = f'batch_derivation@{ROW_COUNT}'
+    if request.config.getoption('--update-baselines'):
+        baselines[key] = summarize(stages)
+        return
+    if key not in baselines:
+        pytest.skip(f'No baseline for {key}, record one with --update-baselines')
+
+    tolerance = float(os.getenv('BENCHMARK_TOLERANCE', str(DEFAULT_TOLERANCE)))
+    regressions = find_regressions(stages, baselines[key], tolerance)
+    assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,99 @@
+"""
+This module contains unit tests for the arrow_tables module.
+"""
+import datetime
+import pytest
+from resources.models import UnitsCompleteExport
+from resources.writers import EXPORT_COLUMNS, MISSING_FROM_BUDGET
+from tests.utils import create_units_complete_exports
+
+pa = pytest.importorskip('pyarrow')
+
+# pylint: disable=wrong-import-position
+from resources.arrow_tables import (  # noqa: E402
+    EXPORT_TABLE_COLUMNS,
+    build_export_table,
+    partition_indices,
+    record_batch_from_rows,
+    table_rows
+)
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+SOURCE_COLUMNS = ['job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                  'missing_from_budget', 'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name',
+                  'date_created']
+
+
+def export_table(units, chunk_size=7):
+    """
+    Return the export table of UnitsCompleteExport instances, built from record batches of chunk_size rows.
+    """
+    rows = [tuple(getattr(unit, column) for column in SOURCE_COLUMNS) for unit in units]
+    batches = [record_batch_from_rows(rows[start:start + chunk_size], SOURCE_COLUMNS)
+               for start in range(0, len(rows), chunk_size)]
+    schema = record_batch_from_rows([], SOURCE_COLUMNS).schema
+    return build_export_table(pa.Table.from_batches(batches, schema=schema))
+
+
+class TestBuildExportTable:
+    """
+    Container for the unit tests for build_export_table.
+    """
+
+    def test_matches_to_dict(self):
+        """
+        Test that the rows of the table have the text of UnitsCompleteExport.to_dict.
+        """
+        units = create_units_complete_exports(40, BATCH_DATE)
+        table = export_table(units)
+
+        assert table.column_names == EXPORT_TABLE_COLUMNS
+        # Unsaved units hold unit_change without the two decimal places the database returns
+        expected = [tuple(f'{value:.2f}' if column == 'unit_change' else str(value)
+                          for column, value in ((column, unit.to_dict()[column]) for column in EXPORT_COLUMNS))
+                    for unit in units]
+        assert [tuple(str(value) for value in row) for row in table_rows(table, EXPORT_COLUMNS)] == expected
+
+    @pytest.mark.parametrize("ids, vendor_name", [
+        ((None, None, None), None),
+        ((0, 0, 0), ""),
+        ((1, None, 3), None),
+        ((None, None, None), "Vendor, \"1\""),
+        ((5, 6, 7), " padded "),
+    ])
+    def test_notes(self, ids, vendor_name):
+        """
+        Test the notes of records with missing, zero and present values.
+        """
+        unit = create_units_complete_exports(1, BATCH_DATE)[0]
+        unit.timesheet_id, unit.change_order_id, unit.sub_report_id = ids
+        unit.vendor_name = vendor_name
+        notes = export_table([unit])['notes'].to_pylist()
+        assert notes == [UnitsCompleteExport.format_notes(*ids, vendor_name)]
+
+
+class TestPartitionIndices:
+    """
+    Container for the unit tests for partition_indices.
+    """
+
+    def test_partitions_keep_row_order(self):
+        """
+        Test that every partition selects its rows in table order.
+        """
+        units = create_units_complete_exports(30, BATCH_DATE)
+        table = export_table(units)
+
+        partitions = {key: indices.to_pylist() for key, indices in partition_indices(table)}
+        expected = {}
+        for index, unit in enumerate(units):
+            if unit.missing_from_budget == 1:
+                expected.setdefault(MISSING_FROM_BUDGET, []).append(index)
+            expected.setdefault(unit.job_date, []).append(index)
+        assert partitions == expected
+
+    def test_empty_table(self):
+        """
+        Test that an empty table has no partitions.
+        """
+        assert not partition_indices(export_table([]))
@@ -0,0 +1,191 @@
+"""
+This module contains unit tests for the async database functions and the async export.
+"""
+import asyncio
+import datetime
+import os
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from main import export_catch_up, export_latest_batch, export_units
+from resources import async_db_functions
+from resources.async_database import AsyncDatabase, dispose_async_databases, get_async_database
+from resources.config import ExportConfig
+from resources.db_functions import fetch_latest_batch
+from resources.export import export_latest_async
+from tests.utils import create_units_complete_exports
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+def run_async(coroutine):
+    """
+    Run a coroutine in a new event loop and dispose of the async engines before the loop ends.
+    """
+    async def runner():
+        try:
+            return await coroutine
+        finally:
+            await dispose_async_databases()
+    return asyncio.run(runner())
+
+
+@pytest.fixture(name='batches')
+def batches_fixture(async_sqlite_database):
+    """
+    Fixture to store an older and a latest batch of UnitsCompleteExport records.
+    """
+    with async_sqlite_database.get_new_session() as session:
+        session.add_all(create_units_complete_exports(5, BATCH_DATE - datetime.timedelta(days=1), start_id=1000))
+        session.add_all(create_units_complete_exports(50, BATCH_DATE))
+        session.commit()
+
+
+class TestAsyncDatabase:
+    """
+    Container for the unit tests for the AsyncDatabase class.
+    """
+
+    @patch('resources.async_database.create_async_engine')
+    def test_engine_uses_aioodbc(self, mock_create_async_engine):
+        """
+        Test that the async engine connects with the aioodbc driver and the pool settings.
+        """
+        db = AsyncDatabase()
+        args, kwargs = mock_create_async_engine.call_args
+        assert args[0].startswith('mssql+aioodbc:///?odbc_connect=')
+        assert kwargs == db.config.engine_options
+
+    @patch('resources.async_database.create_async_engine', return_value=MagicMock(dispose=AsyncMock()))
+    def test_get_async_database_reuses_instance(self, mock_create_async_engine):
+        """
+        Test that get_async_database returns the same instance until it is disposed of.
+        """
+        first = get_async_database()
+        assert get_async_database() is first
+        mock_create_async_engine.assert_called_once()
+        run_async(dispose_async_databases())
+        assert get_async_database() is not first
+        run_async(dispose_async_databases())
+
+
+@pytest.mark.usefixtures('batches')
+class TestAsyncDbFunctions:
+    """
+    Container for the unit tests for the async database functions.
+    """
+
+    def test_fetch_latest_batch(self):
+        """
+        Test that the async fetch returns the same records as the sync fetch.
+        """
+        units = run_async(async_db_functions.fetch_latest_batch())
+        expected = fetch_latest_batch()
+        assert [unit.to_dict() for unit in units] == [unit.to_dict() for unit in expected]
+
+    def test_fetch_units_by_date(self):
+        """
+        Test that the async fetch by date only returns that batch.
+        """
+        units = run_async(async_db_functions.fetch_units_by_date(BATCH_DATE - datetime.timedelta(days=1)))
+        assert sorted(unit.export_id for unit in units) == list(range(1000, 1005))
+
+    def test_stream_latest_batch(self):
+        """
+        Test that the async stream yields the latest batch in chunks of the requested size.
+        """
+        async def collect():
+            return [chunk async for chunk in async_db_functions.stream_latest_batch(chunk_size=20)]
+
+        chunks = run_async(collect())
+        assert [len(chunk) for chunk in chunks] == [20, 20, 10]
+        assert {unit.date_created for chunk in chunks for unit in chunk} == {BATCH_DATE}
+
+    def test_invalid_chunk_size(self):
+        """
+        Test that an invalid chunk size is rejected when the stream is created.
+        """
+        with pytest.raises(ValueError, match="Chunk size must be at least 1"):
+            async_db_functions.stream_latest_batch(chunk_size=0)
+
+    def test_run_stored_procedure_validates_names(self):
+        """
+        Test that the async procedure call validates the names like the sync one.
+        """
+        with pytest.raises(ValueError, match="Invalid schema or procedure name"):
+            run_async(async_db_functions.run_stored_procedure("bad schema", "proc"))
+
+
+class TestExportLatestAsync:
+    """
+    Container for the unit tests for export_latest_async.
+    """
+
+    @pytest.mark.usefixtures('batches')
+    def test_matches_pandas_export(self, tmp_path):
+        """
+        Test that the async mode writes the same files as the pandas export.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+        export_units(fetch_latest_batch(), 'UC_20240105120000', str(expected_path))
+
+        latest_date, total = export_latest_batch(str(actual_path), ExportConfig(mode='async', chunk_size=7))
+
+        assert (latest_date, total) == (BATCH_DATE, 50)
+        assert sorted(os.listdir(actual_path)) == sorted(os.listdir(expected_path))
+        for name in os.listdir(expected_path):
+            if not name.endswith('_manifest.json'):
+                assert (actual_path / name).read_bytes() == (expected_path / name).read_bytes()
+
+    @pytest.mark.usefixtures('batches')
+    def test_catch_up(self, tmp_path, monkeypatch):
+        """
+        Test that catch-up in async mode exports the batches after the watermark.
+        """
+        monkeypatch.setenv('export_state_path', str(tmp_path / 'state.json'))
+        output_path = tmp_path / 'output'
+        output_path.mkdir()
+
+        assert export_catch_up(BATCH_DATE - datetime.timedelta(days=2), str(output_path),
+                               ExportConfig(mode='async', chunk_size=7)) == 55
+        assert 'UC_20240104120000_manifest.json' in os.listdir(output_path)
+        assert 'UC_20240105120000_manifest.json' in os.listdir(output_path)
+
+    @pytest.mark.usefixtures('async_sqlite_database')
+    def test_empty_table(self, tmp_path):
+        """
+        Test that no batch is reported when the table is empty.
+        """
+        assert export_latest_batch(str(tmp_path), ExportConfig(mode='async')) == (None, 0)
+        assert not os.listdir(tmp_path)
+
+    def test_fetch_overlaps_write(self, tmp_path):
+        """
+        Test that the next chunk is fetched while the previous chunk is being written.
+        """
+        units = create_units_complete_exports(6, BATCH_DATE)
+        events = []
+        writing = threading.Event()
+
+        async def chunks(_chunk_size):
+            for index in range(3):
+                if index:
+                    events.append(('fetch', index, writing.is_set()))
+                yield units[index * 2:index * 2 + 2]
+                await asyncio.sleep(0.01)
+
+        def slow_write(_writer, written_chunks, _cache_writer=None):
+            writing.set()
+            time.sleep(0.05)
+            writing.clear()
+            return sum(len(chunk) for chunk in written_chunks)
+
+        with patch('resources.async_db_functions.stream_latest_batch', chunks), \
+                patch('resources.export._write_chunks', slow_write):
+            assert asyncio.run(export_latest_async(str(tmp_path), 2)) == (BATCH_DATE, 6)
+
+        assert events == [('fetch', 1, True), ('fetch', 2, True)]
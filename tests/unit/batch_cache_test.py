@@ -0,0 +1,225 @@
+"""
+This module contains unit tests for the batch_cache module and regenerating exports from the cache.
+"""
+import datetime
+import os
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+import pandas as pd
+import pytest
+from main import export_latest_batch, export_units, regenerate_batches
+from resources.batch_cache import BatchCache, get_batch_cache
+from resources.config import CacheConfig, ExportConfig
+from resources.export import export_procedure_rows
+from tests.utils import create_units_complete_exports
+
+pytest.importorskip('pyarrow')
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+BASE_NAME = 'UC_20240105120000'
+
+
+def read_folder(path):
+    """
+    Read every export file in a folder, without the manifests, into a dictionary of file name to bytes.
+    """
+    return {name: (path / name).read_bytes() for name in sorted(os.listdir(path))
+            if not name.endswith('_manifest.json')}
+
+
+@pytest.fixture(name='batch')
+def batch_fixture(sqlite_database):
+    """
+    Fixture to store a batch of UnitsCompleteExport records and return them as the database returns them.
+    """
+    units = create_units_complete_exports(50, BATCH_DATE)
+    with sqlite_database.get_new_session() as session:
+        session.add_all(units)
+        session.commit()
+        session.expire_all()
+        return session.query(type(units[0])).order_by('export_id').all()
+
+
+@pytest.fixture(name='cache_path')
+def cache_path_fixture(tmp_path, monkeypatch):
+    """
+    Fixture to enable the batch cache in the test folder.
+    """
+    monkeypatch.setenv('export_cache_path', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+def store_batches(cache, count, size=10):
+    """
+    Store count batches an hour apart and return their dates.
+    """
+    dates = [BATCH_DATE + datetime.timedelta(hours=hour) for hour in range(count)]
+    for date_created in dates:
+        cache.store_frame(date_created, pd.DataFrame(
+            [unit.to_dict() for unit in create_units_complete_exports(size, date_created)]))
+    return dates
+
+
+class TestBatchCache:
+    """
+    Container for the unit tests for the BatchCache class.
+    """
+
+    @pytest.mark.parametrize("export_mode", ["pandas", "columnar", "stream", "arrow", "cursor"])
+    def test_every_mode_caches_the_batch(self, batch, cache_path, tmp_path, export_mode):
+        """
+        Test that every export mode caches the rows of UnitsCompleteExport.to_dict.
+        """
+        output_path = tmp_path / 'output'
+        output_path.mkdir()
+        export_latest_batch(str(output_path), ExportConfig(mode=export_mode, chunk_size=7))
+
+        cache = BatchCache(str(cache_path))
+        assert [entry.date_created for entry in cache.entries()] == [BATCH_DATE]
+        expected = pd.DataFrame([unit.to_dict() for unit in batch])
+        actual = cache.load_frame(BATCH_DATE)
+        assert list(actual.columns) == list(expected.columns)
+        assert sorted(actual.astype(str).values.tolist()) == sorted(expected.astype(str).values.tolist())
+
+    def test_procedure_rows_are_cached(self, batch, cache_path, tmp_path):
+        """
+        Test that the rows returned by the stored procedure are cached chunk by chunk.
+        """
+        columns = ['export_id', 'job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                   'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name', 'date_created',
+                   'missing_from_budget']
+        rows = [tuple(getattr(unit, column) for column in columns) for unit in batch]
+
+        @contextmanager
+        def procedure(*_args):
+            yield 99, iter([(columns, rows[:20]), (columns, rows[20:])])
+
+        with patch('resources.export.run_stored_procedure_with_rows', procedure):
+            export_procedure_rows(str(tmp_path), cache=get_batch_cache())
+
+        assert len(BatchCache(str(cache_path)).load_frame(BATCH_DATE)) == len(batch)
+
+    def test_failed_export_is_not_cached(self, batch, cache_path, tmp_path):
+        """
+        Test that a batch is only cached once its files are committed.
+        """
+        with patch('resources.output.OutputCommit.commit', side_effect=OSError("disk full")):
+            with pytest.raises(OSError, match="disk full"):
+                export_latest_batch(str(tmp_path), ExportConfig(mode='stream'))
+        assert not os.listdir(cache_path)
+
+    def test_find(self, tmp_path):
+        """
+        Test that a batch is found by its base name or its date_created.
+        """
+        cache = BatchCache(str(tmp_path))
+        store_batches(cache, 2)
+        assert cache.find(BASE_NAME) == BATCH_DATE
+        assert cache.find('20240105130000') == BATCH_DATE + datetime.timedelta(hours=1)
+        assert cache.find('2024-01-05T12:00:00') == BATCH_DATE
+        with pytest.raises(ValueError, match="is not in the cache"):
+            cache.find('UC_20240106120000')
+        with pytest.raises(ValueError, match="Invalid batch"):
+            cache.find('yesterday')
+
+    def test_evicts_old_batches(self, tmp_path):
+        """
+        Test that batches cached longer than the maximum age are evicted.
+        """
+        cache = BatchCache(str(tmp_path), max_age_days=7)
+        dates = store_batches(cache, 3)
+        old = time.time() - 8 * 86400
+        os.utime(cache.file_path(dates[0]), (old, old))
+
+        removed = cache.evict()
+        assert [entry.date_created for entry in removed] == dates[:1]
+        assert [entry.date_created for entry in cache.entries()] == dates[1:]
+
+    def test_evicts_oldest_batches_over_size(self, tmp_path):
+        """
+        Test that the oldest batches are evicted once the cache is larger than its maximum size.
+        """
+        cache = BatchCache(str(tmp_path))
+        dates = store_batches(cache, 4)
+        cache.max_bytes = sum(entry.size for entry in cache.entries()[-2:])
+
+        cache.evict()
+        assert [entry.date_created for entry in cache.entries()] == dates[-2:]
+
+    def test_disabled_without_pyarrow(self, tmp_path, caplog):
+        """
+        Test that the cache is disabled with a warning when pyarrow is not installed.
+        """
+        assert get_batch_cache(CacheConfig()) is None
+        with patch.dict('sys.modules', {'pyarrow': None}):
+            assert get_batch_cache(CacheConfig(str(tmp_path))) is None
+        assert "requires the pyarrow package" in caplog.text
+
+    def test_invalid_config(self):
+        """
+        Test that negative limits are rejected.
+        """
+        with pytest.raises(ValueError, match="export_cache_max_mb must not be negative"):
+            CacheConfig(max_mb=-1)
+
+
+class TestRegenerateBatches:
+    """
+    Container for the unit tests for regenerate_batches.
+    """
+
+    def test_regenerates_identical_files(self, batch, cache_path, tmp_path, monkeypatch):
+        """
+        Test that a batch regenerated from the cache has the files of the original export.
+        """
+        expected_path = tmp_path / 'expected'
+        expected_path.mkdir()
+        export_units(batch, BASE_NAME, str(expected_path))
+        exported_path = tmp_path / 'exported'
+        exported_path.mkdir()
+        export_latest_batch(str(exported_path), ExportConfig(mode='stream'))
+
+        monkeypatch.setenv('csv_folder_path', str(tmp_path / 'regenerated'))
+        with patch('resources.database.Database._create_engine', side_effect=AssertionError("database used")):
+            assert regenerate_batches([BASE_NAME]) == len(batch)
+        assert read_folder(tmp_path / 'regenerated') == read_folder(expected_path)
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_regenerates_with_dedup(self, batch, cache_path, tmp_path, monkeypatch, workers):
+        """
+        Test that every file is regenerated with deduplication enabled, although the partitions are
+        unchanged since the batch was exported.
+        """
+        monkeypatch.setenv('export_dedup', 'true')
+        monkeypatch.setenv('export_fingerprint_path', str(tmp_path / 'fingerprints.json'))
+        expected_path = tmp_path / 'expected'
+        expected_path.mkdir()
+        export_units(batch, BASE_NAME, str(expected_path))
+        exported_path = tmp_path / 'exported'
+        exported_path.mkdir()
+        export_latest_batch(str(exported_path), ExportConfig(mode='stream'))
+
+        monkeypatch.setenv('csv_folder_path', str(tmp_path / 'regenerated'))
+        assert regenerate_batches([BASE_NAME], ExportConfig(workers=workers, pool='thread')) == len(batch)
+        assert read_folder(tmp_path / 'regenerated') == read_folder(expected_path)
+
+    def test_regenerates_every_batch(self, cache_path, tmp_path, monkeypatch):
+        """
+        Test that every cached batch is regenerated in another output format.
+        """
+        store_batches(BatchCache(str(cache_path)), 2)
+        monkeypatch.setenv('csv_folder_path', str(tmp_path / 'output'))
+
+        assert regenerate_batches(['all'], ExportConfig(output_format='csv.gz')) == 20
+        names = os.listdir(tmp_path / 'output')
+        assert 'UC_20240105120000_manifest.json' in names
+        assert 'UC_20240105130000_manifest.json' in names
+        assert all(name.endswith(('.csv.gz', '.json')) for name in names)
+
+    def test_cache_not_configured(self):
+        """
+        Test that regenerating without a cache is rejected.
+        """
+        with pytest.raises(ValueError, match="set export_cache_path"):
+            regenerate_batches(['all'])
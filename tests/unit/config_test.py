@@ -0,0 +1,48 @@
+"""
+This module contains unit tests for the config module.
+"""
+import os
+from unittest.mock import patch
+import pytest
+from resources.config import ExportConfig
+
+
+class TestExportConfig:
+    """
+    Container for the unit tests for the ExportConfig class.
+    """
+
+    def test_defaults(self):
+        """
+        Test the settings used when nothing is configured.
+        """
+        export_config = ExportConfig()
+        assert export_config.mode == 'pandas'
+        assert export_config.output_format == 'csv'
+        assert export_config.chunk_size == 5000
+        assert export_config.workers == 1
+        assert export_config.pool == 'process'
+        assert export_config.catch_up is False
+        assert export_config.procedure_rows is False
+        assert export_config.keyset is False
+
+    def test_arguments_override_environment(self):
+        """
+        Test that keyword arguments take precedence over environment variables.
+        """
+        with patch.dict(os.environ, {'export_format': 'csv.gz', 'export_workers': '4'}):
+            export_config = ExportConfig(output_format='parquet')
+        assert export_config.output_format == 'parquet'
+        assert export_config.workers == 4
+
+    @pytest.mark.parametrize("kwargs, message", [
+        ({'mode': 'excel'}, "Invalid export mode: excel"),
+        ({'chunk_size': 0}, "export_chunk_size must be at least 1"),
+        ({'workers': 0}, "export_workers must be at least 1"),
+    ])
+    def test_invalid_settings(self, kwargs, message):
+        """
+        Test that invalid settings are rejected.
+        """
+        with pytest.raises(ValueError, match=message):
+            ExportConfig(**kwargs)
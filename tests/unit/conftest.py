@@ -1,13 +1,21 @@
 """
 This module contains fixtures for the unit tests.
 """
+import asyncio
 import os
 from unittest.mock import patch
 import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from resources.async_database import dispose_async_databases
+from resources.database import dispose_databases, get_database
+from resources.models import Base, UnitsCompleteExport
+from resources.schema_cache import reset_schema_checks
 
 
 @pytest.fixture(autouse=True)
-def mock_env_variables():
+def mock_env_variables(tmp_path):
     """
     Fixture to create a Database instance for testing.
     """
@@ -16,5 +24,50 @@ def mock_env_variables():
         'SQL_DATABASE': 'test_db',
         'SQL_USERNAME': 'test_user',
         'SQL_PASSWORD': 'test_password',
+        'SQL_SCHEMA_CACHE_PATH': str(tmp_path / 'schema_cache.json'),
     }):
         yield
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_databases():
+    """
+    Fixture to make sure no shared Database or verified schema leaks from one test into the next.
+    """
+    yield
+    dispose_databases()
+    asyncio.run(dispose_async_databases())
+    reset_schema_checks()
+
+
+@pytest.fixture(name='sqlite_database')
+def sqlite_database_fixture():
+    """
+    Fixture to back the shared Database with an in-memory SQLite engine.
+    """
+    engine = create_engine(
+        'sqlite://',
+        poolclass=StaticPool,
+        connect_args={'check_same_thread': False},
+        execution_options={'schema_translate_map': {UnitsCompleteExport.__table__.schema: None}},
+    )
+    Base.metadata.create_all(engine)
+    with patch('resources.database.Database._create_engine', return_value=engine):
+        yield get_database()
+
+
+@pytest.fixture(name='async_sqlite_database')
+def async_sqlite_database_fixture(tmp_path_factory):
+    """
+    Fixture to back the shared Database and AsyncDatabase with the same SQLite file,
+    using aiosqlite for the async engine.
+    """
+    pytest.importorskip('aiosqlite')
+    database_path = tmp_path_factory.mktemp('database') / 'units.db'
+    execution_options = {'schema_translate_map': {UnitsCompleteExport.__table__.schema: None}}
+    engine = create_engine(f'sqlite:///{database_path}', execution_options=execution_options)
+    async_engine = create_async_engine(f'sqlite+aiosqlite:///{database_path}', execution_options=execution_options)
+    Base.metadata.create_all(engine)
+    with patch('resources.database.Database._create_engine', return_value=engine), \
+            patch('resources.async_database.AsyncDatabase._create_engine', return_value=async_engine):
+        yield get_database()
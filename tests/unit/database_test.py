@@ -1,9 +1,13 @@
 """
 This module contains unit tests for the database module.
 """
+import os
 from unittest.mock import patch
 import pytest
-from resources.database import Database
+from sqlalchemy import Column, Integer, MetaData, Table, VARCHAR, inspect, text
+from resources.database import Database, get_database, dispose_databases, initialize_database
+from resources.models import Base
+from resources.schema_cache import load_schema_cache, metadata_fingerprint, reset_schema_checks, save_schema_cache
 
 
 class TestDatabaseUnit:
@@ -55,3 +59,223 @@ class TestDatabaseUnit:
             db_instance.close()
             mock_remove.assert_called_once()
             mock_dispose.assert_called_once()
+
+
+class TestSharedDatabaseUnit:
+    """
+    Container for the unit tests for the process-wide Database registry.
+    """
+
+    @patch('resources.database.create_engine')
+    def test_get_database_reuses_instance(self, mock_create_engine):
+        """
+        Test that get_database returns the same Database and creates a single engine.
+        """
+        first = get_database()
+        second = get_database()
+        assert first is second
+        mock_create_engine.assert_called_once()
+
+    @patch('resources.database.create_engine')
+    def test_get_database_passes_pool_options(self, mock_create_engine):
+        """
+        Test that the pool settings from the environment are passed to create_engine.
+        """
+        with patch.dict(os.environ, {
+            'SQL_POOL_SIZE': '2',
+            'SQL_POOL_MAX_OVERFLOW': '0',
+            'SQL_POOL_RECYCLE': '60',
+            'SQL_POOL_PRE_PING': 'false',
+        }):
+            get_database()
+        _, kwargs = mock_create_engine.call_args
+        assert kwargs == {
+            'pool_size': 2,
+            'max_overflow': 0,
+            'pool_recycle': 60,
+            'pool_pre_ping': False,
+        }
+
+    def test_invalid_pool_size_raises(self):
+        """
+        Test that an invalid pool size is rejected.
+        """
+        with patch.dict(os.environ, {'SQL_POOL_SIZE': 'abc'}):
+            with pytest.raises(ValueError, match="SQL_POOL_SIZE must be an integer"):
+                get_database()
+
+    @patch('resources.database.create_engine')
+    def test_dispose_databases(self, mock_create_engine):
+        """
+        Test that dispose_databases disposes the engine and forgets the instance.
+        """
+        first = get_database()
+        dispose_databases()
+        first.engine.dispose.assert_called_once()
+        assert get_database() is not first
+        assert mock_create_engine.call_count == 2
+
+    @patch('resources.database.create_engine')
+    def test_close_removes_shared_database(self, _mock_create_engine):
+        """
+        Test that closing a shared Database removes it from the registry.
+        """
+        first = get_database()
+        first.close()
+        assert get_database() is not first
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_initialize_database_uses_shared_database(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that initialize_database reuses the shared Database.
+        """
+        assert initialize_database() is get_database()
+        mock_create_tables.assert_called_once()
+
+
+class TestCreateTablesIndexes:
+    """
+    Container for the unit tests for the indexes created by create_tables.
+    """
+
+    def test_creates_indexes_with_new_tables(self, sqlite_database):
+        """
+        Test that a new table is created with the declared indexes.
+        """
+        indexes = inspect(sqlite_database.engine).get_indexes('UnitsCompleteExport')
+        assert {index['name']: index['column_names'] for index in indexes} == {
+            'ix_UnitsCompleteExport_date_created_job_date': ['date_created', 'job_date'],
+        }
+
+    def test_leaves_existing_tables_alone(self, sqlite_database):
+        """
+        Test that no index DDL runs against an existing table, the migration scripts add indexes.
+        """
+        with sqlite_database.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_UnitsCompleteExport_date_created_job_date'))
+
+        sqlite_database.create_tables()
+
+        assert inspect(sqlite_database.engine).get_indexes('UnitsCompleteExport') == []
+
+
+class TestInitializeDatabaseSchemaCheck:
+    """
+    Container for the unit tests for the schema verification of initialize_database.
+    """
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_cache_skips_verified_schema(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that the tables are created once and later runs reuse the cached fingerprint.
+        """
+        initialize_database()
+        initialize_database()
+        assert mock_create_tables.call_count == 1
+
+        # A new process only has the cache file
+        reset_schema_checks()
+        initialize_database()
+        assert mock_create_tables.call_count == 1
+
+        cache = load_schema_cache(os.environ['SQL_SCHEMA_CACHE_PATH'])
+        assert cache == {'localhost/test_db': metadata_fingerprint(Base.metadata, 'localhost', 'test_db')}
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_new_target_is_verified(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that a different target database is verified again.
+        """
+        initialize_database()
+        with patch.dict(os.environ, {'SQL_DATABASE': 'other_db'}):
+            initialize_database()
+        assert mock_create_tables.call_count == 2
+        assert set(load_schema_cache(os.environ['SQL_SCHEMA_CACHE_PATH'])) == {
+            'localhost/test_db', 'localhost/other_db'}
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_changed_cache_is_verified(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that a cache file with a stale fingerprint does not skip the verification.
+        """
+        save_schema_cache(os.environ['SQL_SCHEMA_CACHE_PATH'], 'localhost/test_db', 'stale')
+        initialize_database()
+        mock_create_tables.assert_called_once()
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_process_mode(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that the process mode verifies once per process and writes no cache file.
+        """
+        with patch.dict(os.environ, {'SQL_SCHEMA_CHECK': 'process'}):
+            initialize_database()
+            initialize_database()
+            reset_schema_checks()
+            initialize_database()
+        assert mock_create_tables.call_count == 2
+        assert not os.path.exists(os.environ['SQL_SCHEMA_CACHE_PATH'])
+
+    @patch('resources.database.Database.create_tables')
+    @patch('resources.database.create_engine')
+    def test_always_mode(self, _mock_create_engine, mock_create_tables):
+        """
+        Test that the always mode creates the tables on every call.
+        """
+        with patch.dict(os.environ, {'SQL_SCHEMA_CHECK': 'always'}):
+            initialize_database()
+            initialize_database()
+        assert mock_create_tables.call_count == 2
+
+    def test_invalid_mode(self):
+        """
+        Test that an unknown schema check mode is rejected.
+        """
+        with patch.dict(os.environ, {'SQL_SCHEMA_CHECK': 'sometimes'}):
+            with pytest.raises(ValueError, match="Invalid value for SQL_SCHEMA_CHECK: sometimes"):
+                initialize_database()
+
+    def test_invalid_cache_file_is_ignored(self, tmp_path):
+        """
+        Test that an unreadable cache file is treated as empty.
+        """
+        path = tmp_path / 'broken.json'
+        path.write_text('not json', encoding='utf-8')
+        assert not load_schema_cache(str(path))
+
+
+class TestMetadataFingerprint:
+    """
+    Container for the unit tests for metadata_fingerprint.
+    """
+
+    @staticmethod
+    def build_metadata(length):
+        """
+        Build a MetaData with a single table.
+        """
+        metadata = MetaData()
+        Table('Example', metadata, Column('id', Integer, primary_key=True), Column('name', VARCHAR(length)),
+              schema='dbo')
+        return metadata
+
+    def test_stable(self):
+        """
+        Test that the same definitions give the same fingerprint.
+        """
+        assert (metadata_fingerprint(self.build_metadata(10), 'server', 'db')
+                == metadata_fingerprint(self.build_metadata(10), 'server', 'db'))
+
+    def test_changes_with_model_and_target(self):
+        """
+        Test that a changed column or target gives a different fingerprint.
+        """
+        fingerprint = metadata_fingerprint(self.build_metadata(10), 'server', 'db')
+        assert metadata_fingerprint(self.build_metadata(20), 'server', 'db') != fingerprint
+        assert metadata_fingerprint(self.build_metadata(10), 'other', 'db') != fingerprint
+        assert metadata_fingerprint(self.build_metadata(10), 'server', 'other') != fingerprint
+        assert metadata_fingerprint(self.build_metadata(10), 'server', 'db', 'east') != fingerprint
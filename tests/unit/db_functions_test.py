@@ -4,10 +4,19 @@ This module contains unit tests for the database functions.
 from unittest.mock import MagicMock, patch
 import os
 import datetime
+from decimal import Decimal
+import pandas as pd
 import pytest
-from resources.db_functions import run_stored_procedure
+from sqlalchemy import event
+from resources.db_functions import run_stored_procedure, run_stored_procedure_with_rows
 from resources.db_functions import fetch_latest_units_export, fetch_units_by_date
+from resources.db_functions import stream_units_by_date, fetch_units_frame, fetch_batch_dates_after
+from resources.db_functions import page_latest_batch, page_units_by_date
+from resources.db_functions import fetch_latest_batch, fetch_latest_units_frame, stream_latest_batch
+from resources.db_functions import read_latest_batch_rows
+from resources.metrics import reset_metrics
 from resources.models import UnitsCompleteExport
+from tests.utils import create_units_complete_exports
 
 
 class TestDbFunctionsUnit:
@@ -104,3 +113,355 @@ class TestDbFunctionsUnit:
 
         result = fetch_units_by_date(input_date)
         assert result == expected_results
+
+
+class TestStreamUnitsByDate:
+    """
+    Class to contain the unit tests for stream_units_by_date.
+    """
+
+    def test_streams_batch_in_chunks(self, sqlite_database):
+        """
+        Test that only records of the requested batch are returned, in chunks of the requested size.
+        """
+        batch_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(5, batch_date))
+            session.add_all(create_units_complete_exports(
+                3, batch_date + datetime.timedelta(seconds=1), start_id=100))
+            session.commit()
+
+        chunks = list(stream_units_by_date(batch_date, chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert sorted(unit.export_id for chunk in chunks for unit in chunk) == [1, 2, 3, 4, 5]
+
+    def test_invalid_chunk_size_raises(self):
+        """
+        Test that a chunk size below one is rejected.
+        """
+        with pytest.raises(ValueError, match="Chunk size must be at least 1"):
+            next(stream_units_by_date(datetime.datetime(2024, 1, 1), chunk_size=0))
+
+
+class TestPageUnits:
+    """
+    Class to contain the unit tests for the keyset pagination of page_units_by_date and page_latest_batch.
+    """
+
+    def test_pages_batch_in_index_order(self, sqlite_database):
+        """
+        Test that only records of the requested batch are returned, in (job_date, export_id) order
+        without overlap, also when a page ends within a job date.
+        """
+        batch_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(3, batch_date, start_id=20))
+            session.add_all(create_units_complete_exports(4, batch_date, start_id=1))
+            session.add_all(create_units_complete_exports(
+                3, batch_date + datetime.timedelta(seconds=1), start_id=100))
+            session.commit()
+
+        chunks = list(page_units_by_date(batch_date, chunk_size=3))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        assert [unit.export_id for chunk in chunks for unit in chunk] == [1, 4, 20, 2, 21, 3, 22]
+
+    def test_one_query_per_chunk(self, sqlite_database):
+        """
+        Test that a full last chunk costs one more query and the query count follows the chunk count.
+        """
+        batch_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(4, batch_date))
+            session.commit()
+
+        metrics = reset_metrics()
+        chunks = list(page_latest_batch(chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2]
+        assert metrics.counters['db_round_trips'] == 3
+        assert metrics.counters['rows_fetched'] == 4
+
+    def test_latest_batch_stays_on_first_batch(self, sqlite_database):
+        """
+        Test that a batch created while the latest batch is paged is not mixed in.
+        """
+        batch_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(4, batch_date))
+            session.commit()
+
+        chunks = page_latest_batch(chunk_size=2)
+        first_chunk = next(chunks)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(
+                2, batch_date + datetime.timedelta(hours=1), start_id=100))
+            session.commit()
+
+        units = list(first_chunk) + [unit for chunk in chunks for unit in chunk]
+        assert [unit.export_id for unit in units] == [1, 4, 2, 3]
+
+    def test_invalid_chunk_size_raises(self):
+        """
+        Test that a chunk size below one is rejected before the first query.
+        """
+        with pytest.raises(ValueError, match="Chunk size must be at least 1"):
+            page_units_by_date(datetime.datetime(2024, 1, 1), chunk_size=0)
+
+
+class TestFetchUnitsFrame:
+    """
+    Class to contain the unit tests for fetch_units_frame.
+    """
+
+    def test_matches_to_dict(self, sqlite_database):
+        """
+        Test that the columnar fetch returns the same rows as UnitsCompleteExport.to_dict.
+        """
+        batch_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(40, batch_date))
+            session.add(UnitsCompleteExport(
+                export_id=1000, job_number="1", job_date=datetime.date(2024, 1, 1),
+                phase_number="2", category_number="3", unit_change=0,
+                timesheet_id=0, vendor_name="", date_created=batch_date))
+            session.commit()
+            expected = [unit.to_dict() for unit in session.query(UnitsCompleteExport).all()]
+
+        # The batch is read through the (date_created, job_date) index, so only the order within a
+        # job_date partition is export_id order
+        df = fetch_units_frame(batch_date).sort_values('job_date', kind='stable', ignore_index=True)
+        expected = pd.DataFrame(expected).sort_values('job_date', kind='stable', ignore_index=True)
+        pd.testing.assert_frame_equal(df, expected)
+
+    @pytest.mark.usefixtures("sqlite_database")
+    def test_empty_batch(self):
+        """
+        Test that an empty batch returns an empty DataFrame with the export columns.
+        """
+        df = fetch_units_frame(datetime.datetime(2024, 1, 1))
+        assert df.empty
+        assert 'notes' in df.columns and 'cost_code' in df.columns
+
+
+class TestFetchBatchDatesAfter:
+    """
+    Class to contain the unit tests for fetch_batch_dates_after.
+    """
+
+    def test_returns_later_batches_in_order(self, sqlite_database):
+        """
+        Test that the date of every batch created after the date is returned once, oldest first.
+        """
+        first = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        second = first + datetime.timedelta(days=1)
+        third = second + datetime.timedelta(days=1)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(2, first, start_id=1))
+            session.add_all(create_units_complete_exports(2, third, start_id=3))
+            session.add_all(create_units_complete_exports(2, second, start_id=5))
+            session.commit()
+
+        assert fetch_batch_dates_after(first) == [second, third]
+        assert fetch_batch_dates_after(third) == []
+
+
+class TestFetchLatestBatch:
+    """
+    Class to contain the unit tests for the single query latest batch functions.
+    """
+
+    @pytest.fixture(name="batches")
+    def batches_fixture(self, sqlite_database):
+        """
+        Fixture to store two batches a millisecond apart and return the newest date_created.
+        """
+        older = datetime.datetime(2024, 1, 1, 12, 0, 0, 3000)
+        newer = older + datetime.timedelta(milliseconds=1)
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(3, older, start_id=1))
+            session.add_all(create_units_complete_exports(4, newer, start_id=10))
+            session.commit()
+        return newer
+
+    @pytest.fixture(name="statements")
+    def statements_fixture(self, sqlite_database):
+        """
+        Fixture to record every statement sent to the database.
+        """
+        statements = []
+
+        def before_cursor_execute(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(sqlite_database.engine, "before_cursor_execute", before_cursor_execute)
+        yield statements
+        event.remove(sqlite_database.engine, "before_cursor_execute", before_cursor_execute)
+
+    def test_fetch_latest_batch(self, batches, statements):
+        """
+        Test that only the newest batch is returned, with an exact match, in a single query.
+        """
+        units = fetch_latest_batch()
+        assert sorted(unit.export_id for unit in units) == [10, 11, 12, 13]
+        assert {unit.date_created for unit in units} == {batches}
+        assert len(statements) == 1
+
+    def test_fetch_latest_units_frame(self, batches, statements):
+        """
+        Test that the columnar latest batch includes date_created and takes a single query.
+        """
+        df = fetch_latest_units_frame()
+        assert len(df) == 4
+        assert set(df['date_created']) == {batches}
+        assert len(statements) == 1
+
+    def test_stream_latest_batch(self, batches, statements):
+        """
+        Test that the latest batch is streamed in chunks from a single query.
+        """
+        chunks = list(stream_latest_batch(chunk_size=3))
+        assert [len(chunk) for chunk in chunks] == [3, 1]
+        assert {unit.date_created for chunk in chunks for unit in chunk} == {batches}
+        assert len(statements) == 1
+
+    def test_read_latest_batch_rows(self, batches):
+        """
+        Test that the latest batch is read from a plain cursor in chunks, with the column types of the model.
+        """
+        metrics = reset_metrics()
+        chunks = list(read_latest_batch_rows(chunk_size=3))
+        assert [len(chunk) for chunk in chunks] == [3, 1]
+        rows = [row for chunk in chunks for row in chunk]
+        assert sorted(row[0] for row in rows) == [10, 11, 12, 13]
+        assert {row[-1] for row in rows} == {batches}
+        assert all(isinstance(row[1], datetime.date) for row in rows)
+        assert all(isinstance(row[5], Decimal) and row[5].as_tuple().exponent == -2 for row in rows)
+        assert metrics.counters['db_round_trips'] == 1
+        assert metrics.counters['rows_fetched'] == 4
+
+    @pytest.mark.usefixtures("sqlite_database")
+    def test_empty_table(self):
+        """
+        Test that an empty table returns no records.
+        """
+        assert not fetch_latest_batch()
+        assert fetch_latest_units_frame().empty
+        assert not list(stream_latest_batch())
+        assert not list(read_latest_batch_rows())
+
+
+class FakeCursor:
+    """
+    DBAPI cursor stand-in that returns a list of result sets.
+    Each result set is a (description, rows) pair, description None for row count results.
+    """
+    def __init__(self, result_sets):
+        self.result_sets = result_sets
+        self.index = 0
+        self.executed = None
+        self.position = 0
+
+    @property
+    def description(self):
+        """
+        Return the description of the current result set.
+        """
+        columns = self.result_sets[self.index][0]
+        return None if columns is None else [(column,) for column in columns]
+
+    def execute(self, statement):
+        """
+        Record the executed statement.
+        """
+        self.executed = statement
+
+    def fetchone(self):
+        """
+        Return the next row of the current result set.
+        """
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size):
+        """
+        Return the next rows of the current result set.
+        """
+        rows = self.result_sets[self.index][1][self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def nextset(self):
+        """
+        Move to the next result set.
+        """
+        if self.index + 1 >= len(self.result_sets):
+            return None
+        self.index += 1
+        self.position = 0
+        return True
+
+
+class TestRunStoredProcedureWithRows:
+    """
+    Class to contain the unit tests for run_stored_procedure_with_rows.
+    """
+
+    @pytest.fixture(name="connection")
+    def connection_fixture(self):
+        """
+        Fixture to patch the shared database with a raw connection returning a fake cursor.
+        """
+        connection = MagicMock()
+        with patch("resources.db_functions.get_database") as mock_get_database:
+            mock_get_database.return_value.engine.raw_connection.return_value = connection
+            yield connection
+
+    def test_returns_count_and_rows(self, connection):
+        """
+        Test that the count and the rows after intermediate row counts are read in one call.
+        """
+        connection.cursor.return_value = FakeCursor([
+            (["affected_rows"], [(3,)]),
+            (None, []),
+            (["export_id", "job_number"], [(1, "a"), (2, "b"), (3, "c")]),
+        ])
+
+        with run_stored_procedure_with_rows("dbo", "Export", chunk_size=2) as (affected_rows, chunks):
+            chunks = list(chunks)
+
+        assert connection.cursor.return_value.executed == "EXEC [dbo].[Export]"
+        assert affected_rows == 3
+        assert chunks == [(["export_id", "job_number"], [(1, "a"), (2, "b")]),
+                          (["export_id", "job_number"], [(3, "c")])]
+        connection.commit.assert_called_once()
+        connection.close.assert_called_once()
+
+    def test_without_row_result_set(self, connection):
+        """
+        Test that a procedure returning only the count yields no rows.
+        """
+        connection.cursor.return_value = FakeCursor([(["affected_rows"], [(0,)])])
+
+        with run_stored_procedure_with_rows("dbo", "Export") as (affected_rows, chunks):
+            assert affected_rows == 0
+            assert not list(chunks)
+
+    def test_rolls_back_on_error(self, connection):
+        """
+        Test that the transaction is rolled back when the export fails.
+        """
+        connection.cursor.return_value = FakeCursor([(["affected_rows"], [(1,)])])
+
+        with pytest.raises(RuntimeError):
+            with run_stored_procedure_with_rows("dbo", "Export"):
+                raise RuntimeError("write failed")
+        connection.rollback.assert_called_once()
+        connection.commit.assert_not_called()
+        connection.close.assert_called_once()
+
+    def test_invalid_procedure_name(self):
+        """
+        Test that the procedure name is validated before connecting.
+        """
+        with pytest.raises(ValueError, match="Invalid schema or procedure name"):
+            with run_stored_procedure_with_rows("dbo", "Export; DROP TABLE x"):
+                pass
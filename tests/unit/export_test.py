@@ -0,0 +1,404 @@
+"""
+This module contains unit tests for the export pipelines.
+"""
+import datetime
+import os
+from contextlib import contextmanager
+from unittest.mock import patch
+import pandas as pd
+import pytest
+from main import export_units, export_frame, export_catch_up, export_latest_batch
+from resources.config import ExportConfig
+from resources import db_functions
+from resources.db_functions import fetch_units_frame
+from resources.export import export_streaming, export_frame_parallel, export_procedure_rows
+from resources.export import PartitionExportError
+from resources.watermark import load_watermark
+from resources.writers import EXPORT_COLUMNS
+from tests.utils import ARROW_MODE, create_units_complete_exports
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+BASE_NAME = 'UC_20240105120000'
+
+
+def read_folder(path):
+    """
+    Read every export file in a folder, without the manifests, into a dictionary of file name to bytes.
+    """
+    return {name: (path / name).read_bytes() for name in sorted(os.listdir(path))
+            if not name.endswith('_manifest.json')}
+
+
+def export_per_group(units, base_name, csv_folder_path):
+    """
+    Reference export that writes each group with its own DataFrame.to_csv call.
+    """
+    df = pd.DataFrame([unit.to_dict() for unit in units])
+    df[df['missing_from_budget'] == 1].to_csv(os.path.join(csv_folder_path, f'{base_name}_missing_from_budget.csv'),
+                                              index=False, columns=EXPORT_COLUMNS)
+    for job_date, group_df in df.groupby('job_date'):
+        group_df.to_csv(os.path.join(csv_folder_path, f'{base_name}_{job_date.strftime("%Y%m%d")}.csv'),
+                        index=False, columns=EXPORT_COLUMNS)
+
+
+@pytest.fixture(name='batch')
+def batch_fixture(sqlite_database):
+    """
+    Fixture to store a batch of UnitsCompleteExport records and return them.
+    """
+    units = create_units_complete_exports(50, BATCH_DATE)
+    with sqlite_database.get_new_session() as session:
+        session.add_all(units)
+        session.commit()
+        # Reload the records so they carry the values the database returns
+        session.expire_all()
+        return session.query(type(units[0])).order_by('export_id').all()
+
+
+class TestExportUnits:
+    """
+    Container for the unit tests for the single-pass DataFrame export.
+    """
+
+    def test_matches_per_group_export(self, batch, tmp_path):
+        """
+        Test that the single-pass export produces the same files as one to_csv call per group.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        export_per_group(batch, BASE_NAME, str(expected_path))
+        export_units(batch, BASE_NAME, str(actual_path))
+
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+
+class TestExportStreaming:
+    """
+    Container for the unit tests for export_streaming.
+    """
+
+    @pytest.mark.parametrize("keyset", [False, True])
+    def test_matches_pandas_export(self, batch, tmp_path, keyset):
+        """
+        Test that streaming in small chunks, with a cursor or keyset pages, produces the same files
+        as the pandas export.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        export_units(batch, BASE_NAME, str(expected_path))
+        total = export_streaming(BATCH_DATE, BASE_NAME, str(actual_path), chunk_size=7, keyset=keyset)
+
+        assert total == len(batch)
+        assert read_folder(actual_path) == read_folder(expected_path)
+        assert f'{BASE_NAME}_missing_from_budget.csv' in os.listdir(actual_path)
+
+    def test_keyset_matches_other_modes(self, sqlite_database, tmp_path):
+        """
+        Test that keyset pages write the rows in the order of the other modes, also in the missing
+        budget file when its rows span several job dates.
+        """
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(50, BATCH_DATE, job_dates=4))
+            session.commit()
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        export_latest_batch(str(expected_path), ExportConfig(mode='columnar'))
+        export_latest_batch(str(actual_path), ExportConfig(mode='stream', keyset=True, chunk_size=7))
+
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+    @pytest.mark.usefixtures('sqlite_database')
+    def test_empty_batch_creates_no_files(self, tmp_path):
+        """
+        Test that a batch without records does not create any files.
+        """
+        assert export_streaming(BATCH_DATE, BASE_NAME, str(tmp_path)) == 0
+        assert not os.listdir(tmp_path)
+
+
+class TestExportColumnar:
+    """
+    Container for the unit tests for the columnar export path.
+    """
+
+    def test_matches_pandas_export(self, batch, tmp_path):
+        """
+        Test that exporting the columnar fetch produces the same files as the ORM export.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        export_units(batch, BASE_NAME, str(expected_path))
+        export_frame(fetch_units_frame(BATCH_DATE), BASE_NAME, str(actual_path))
+
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+
+class TestExportFrameParallel:
+    """
+    Container for the unit tests for export_frame_parallel.
+    """
+
+    @pytest.mark.parametrize("pool", ["thread", "process"])
+    def test_matches_serial_export(self, batch, tmp_path, pool):
+        """
+        Test that the parallel export produces the same files as the serial export.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        df = pd.DataFrame([unit.to_dict() for unit in batch])
+        export_frame(df, BASE_NAME, str(expected_path))
+        total = export_frame_parallel(df, BASE_NAME, str(actual_path), workers=2, pool=pool)
+
+        assert total == len(batch)
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+    def test_failures_are_aggregated(self, batch, tmp_path):
+        """
+        Test that a failing partition does not stop the others and is reported with the rest,
+        and that none of the files are committed.
+        """
+        df = pd.DataFrame([unit.to_dict() for unit in batch])
+        # A directory in place of the temporary file makes that partition fail
+        (tmp_path / f'.{BASE_NAME}_20231002.csv.tmp').mkdir()
+        (tmp_path / f'.{BASE_NAME}_missing_from_budget.csv.tmp').mkdir()
+
+        with pytest.raises(PartitionExportError) as error:
+            export_frame_parallel(df, BASE_NAME, str(tmp_path), workers=2, pool='thread')
+
+        assert sorted(error.value.failures) == [f'{BASE_NAME}_20231002.csv',
+                                                f'{BASE_NAME}_missing_from_budget.csv']
+        assert sorted(os.listdir(tmp_path)) == [f'.{BASE_NAME}_20231002.csv.tmp',
+                                                f'.{BASE_NAME}_missing_from_budget.csv.tmp']
+
+    def test_interrupted_export_leaves_no_files(self, batch, tmp_path):
+        """
+        Test that an error outside the partition tasks aborts the output and removes the
+        temporary files of every partition.
+        """
+        df = pd.DataFrame([unit.to_dict() for unit in batch])
+        with patch('resources.export.record_partitions', side_effect=KeyboardInterrupt), \
+                pytest.raises(KeyboardInterrupt):
+            export_frame_parallel(df, BASE_NAME, str(tmp_path), workers=2, pool='thread')
+
+        assert not os.listdir(tmp_path)
+
+    @pytest.mark.parametrize("workers, pool, message", [
+        (0, "thread", "Number of workers must be at least 1"),
+        (2, "fiber", "Invalid pool type: fiber"),
+    ])
+    def test_invalid_arguments(self, tmp_path, workers, pool, message):
+        """
+        Test that invalid worker counts and pool types are rejected.
+        """
+        with pytest.raises(ValueError, match=message):
+            export_frame_parallel(pd.DataFrame(), BASE_NAME, str(tmp_path), workers, pool)
+
+
+class TestExportCatchUp:
+    """
+    Container for the unit tests for export_catch_up.
+    """
+
+    @pytest.mark.parametrize("export_mode", ["pandas", "columnar", "stream", ARROW_MODE, "cursor"])
+    def test_exports_every_missed_batch(self, sqlite_database, tmp_path, monkeypatch, export_mode):
+        """
+        Test that every mode exports each batch after the watermark and the watermark moves to the newest.
+        """
+        state_path = str(tmp_path / 'state.json')
+        monkeypatch.setenv('export_state_path', state_path)
+        output_path = tmp_path / 'output'
+        output_path.mkdir()
+
+        dates = [BATCH_DATE + datetime.timedelta(days=day) for day in range(3)]
+        with sqlite_database.get_new_session() as session:
+            for index, date_created in enumerate(dates):
+                session.add_all(create_units_complete_exports(4, date_created, job_dates=1,
+                                                              start_id=index * 10 + 1))
+            session.commit()
+
+        total = export_catch_up(dates[0], str(output_path), ExportConfig(mode=export_mode, chunk_size=3))
+
+        assert total == 8
+        assert sorted(os.listdir(output_path)) == [
+            'UC_20240106120000_20231001.csv',
+            'UC_20240106120000_manifest.json',
+            'UC_20240106120000_missing_from_budget.csv',
+            'UC_20240107120000_20231001.csv',
+            'UC_20240107120000_manifest.json',
+            'UC_20240107120000_missing_from_budget.csv',
+        ]
+        assert load_watermark(state_path) == dates[2]
+
+    def test_reads_one_batch_at_a_time(self, sqlite_database, tmp_path, monkeypatch):
+        """
+        Test that each batch is read on its own and the watermark is saved before the next batch is read.
+        """
+        state_path = str(tmp_path / 'state.json')
+        monkeypatch.setenv('export_state_path', state_path)
+        dates = [BATCH_DATE + datetime.timedelta(days=day) for day in range(3)]
+        with sqlite_database.get_new_session() as session:
+            for index, date_created in enumerate(dates):
+                session.add_all(create_units_complete_exports(4, date_created, start_id=index * 10 + 1))
+            session.commit()
+
+        watermarks = []
+
+        def read_batch_rows(date, chunk_size):
+            watermarks.append(load_watermark(state_path))
+            return db_functions.read_batch_rows(date, chunk_size)
+
+        with patch('resources.export.read_batch_rows', read_batch_rows):
+            assert export_catch_up(dates[0], str(tmp_path), ExportConfig(mode='cursor')) == 8
+        assert watermarks == [None, dates[1]]
+
+    @pytest.mark.usefixtures('sqlite_database')
+    def test_nothing_to_catch_up(self, tmp_path, monkeypatch):
+        """
+        Test that no files are written and the watermark stays when there are no new batches.
+        """
+        state_path = str(tmp_path / 'state.json')
+        monkeypatch.setenv('export_state_path', state_path)
+
+        assert export_catch_up(BATCH_DATE, str(tmp_path)) == 0
+        assert not os.listdir(tmp_path)
+
+
+class TestExportLatestBatch:
+    """
+    Container for the unit tests for export_latest_batch.
+    """
+
+    @pytest.mark.parametrize("export_mode", ["pandas", "columnar", "stream", ARROW_MODE, "cursor"])
+    def test_exports_latest_batch(self, batch, sqlite_database, tmp_path, export_mode):
+        """
+        Test that every mode exports the newest batch with the same files.
+        """
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(5, BATCH_DATE - datetime.timedelta(days=1),
+                                                          start_id=1000))
+            session.commit()
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+
+        export_units(batch, BASE_NAME, str(expected_path))
+        latest_date, total = export_latest_batch(str(actual_path), ExportConfig(mode=export_mode, chunk_size=7))
+
+        assert latest_date == BATCH_DATE
+        assert total == len(batch)
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+    @pytest.mark.parametrize("export_mode, workers", [("pandas", 1), ("columnar", 2), ("stream", 1), ("arrow", 1),
+                                                      ("cursor", 1)])
+    def test_exports_parquet(self, batch, tmp_path, export_mode, workers):
+        """
+        Test that every mode writes the same rows to Parquet files named like the CSV files.
+        """
+        pq = pytest.importorskip("pyarrow.parquet")
+        csv_path = tmp_path / 'csv'
+        csv_path.mkdir()
+        export_units(batch, BASE_NAME, str(csv_path))
+
+        parquet_path = tmp_path / 'parquet'
+        parquet_path.mkdir()
+        export_config = ExportConfig(mode=export_mode, workers=workers, pool='thread', output_format='parquet')
+        assert export_latest_batch(str(parquet_path), export_config) == (BATCH_DATE, len(batch))
+
+        csv_files = read_folder(csv_path)
+        parquet_files = read_folder(parquet_path)
+        assert sorted(parquet_files) == sorted(name[:-len('csv')] + 'parquet' for name in csv_files)
+        for name in parquet_files:
+            expected = pd.read_csv(csv_path / (name[:-len('parquet')] + 'csv'), dtype=str, keep_default_na=False)
+            actual = pq.read_table(parquet_path / name).to_pandas()
+            assert len(actual) == len(expected)
+            assert list(actual['cost_code']) == list(expected['cost_code'])
+            assert [str(value) for value in actual['unit_change']] == list(expected['unit_change'])
+
+    @pytest.mark.parametrize("export_mode", ["pandas", "columnar", "stream", ARROW_MODE, "cursor"])
+    @pytest.mark.usefixtures('sqlite_database')
+    def test_empty_table(self, tmp_path, export_mode):
+        """
+        Test that no batch is reported when the table is empty.
+        """
+        assert export_latest_batch(str(tmp_path), ExportConfig(mode=export_mode)) == (None, 0)
+        assert not os.listdir(tmp_path)
+
+
+class TestExportProcedureRows:
+    """
+    Container for the unit tests for export_procedure_rows.
+    """
+
+    def test_matches_pandas_export(self, batch, tmp_path):
+        """
+        Test that the rows returned by the procedure are exported like the rows read from the table.
+        """
+        expected_path = tmp_path / 'expected'
+        actual_path = tmp_path / 'actual'
+        expected_path.mkdir()
+        actual_path.mkdir()
+        export_units(batch, BASE_NAME, str(expected_path))
+
+        columns = ['export_id', 'job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                   'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name', 'date_created',
+                   'missing_from_budget']
+        rows = [tuple(getattr(unit, column) for column in columns) for unit in batch]
+
+        @contextmanager
+        def procedure(*_args):
+            yield 99, iter([(columns, rows[:20]), (columns, rows[20:])])
+
+        with patch('resources.export.run_stored_procedure_with_rows', procedure):
+            result = export_procedure_rows(str(actual_path))
+
+        assert result == (99, BATCH_DATE, len(batch))
+        assert read_folder(actual_path) == read_folder(expected_path)
+
+    def test_no_rows(self, tmp_path):
+        """
+        Test that no files are written when the procedure returns no rows.
+        """
+        @contextmanager
+        def procedure(*_args):
+            yield 0, iter([])
+
+        with patch('resources.export.run_stored_procedure_with_rows', procedure):
+            assert export_procedure_rows(str(tmp_path)) == (0, None, 0)
+        assert not os.listdir(tmp_path)
+
+    def test_failed_database_commit_leaves_no_files(self, batch, tmp_path):
+        """
+        Test that the files are not committed when the transaction of the procedure fails to commit.
+        """
+        columns = ['export_id', 'job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                   'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name', 'date_created',
+                   'missing_from_budget']
+        rows = [tuple(getattr(unit, column) for column in columns) for unit in batch]
+        committed = []
+
+        @contextmanager
+        def procedure(*_args):
+            yield 99, iter([(columns, rows)])
+            raise ConnectionError("commit failed")
+
+        with patch('resources.export.run_stored_procedure_with_rows', procedure):
+            with pytest.raises(ConnectionError, match="commit failed"):
+                export_procedure_rows(str(tmp_path), on_commit=committed.append)
+        assert committed == []
+        assert not os.listdir(tmp_path)
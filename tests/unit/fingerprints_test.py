@@ -0,0 +1,184 @@
+"""
+This module contains unit tests for the fingerprints module and the deduplicated export.
+"""
+import datetime
+import json
+import os
+import pandas as pd
+import pytest
+from main import export_frame, export_latest_batch
+from resources.config import ExportConfig
+from resources.export import PartitionExportError, export_frame_parallel
+from resources.fingerprints import FingerprintIndex, PartitionFingerprint, partition_name
+from tests.utils import create_units_complete_exports, requires_pyarrow
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+def fingerprint(rows):
+    """
+    Return the fingerprint of rows.
+    """
+    partition = PartitionFingerprint()
+    partition.update(rows)
+    return partition.hexdigest()
+
+
+def units_frame(count=20, date_created=BATCH_DATE):
+    """
+    Return a DataFrame of export rows.
+    """
+    return pd.DataFrame([unit.to_dict() for unit in create_units_complete_exports(count, date_created)])
+
+
+def export_files(path):
+    """
+    Return the export files in a folder, without the manifests.
+    """
+    return sorted(name for name in os.listdir(path) if not name.endswith('_manifest.json'))
+
+
+@pytest.fixture(name='dedup')
+def dedup_fixture(tmp_path, monkeypatch):
+    """
+    Fixture to enable deduplication with an index outside of the output folder.
+    """
+    index_path = tmp_path / 'index' / 'fingerprints.json'
+    index_path.parent.mkdir()
+    monkeypatch.setenv('export_dedup', 'true')
+    monkeypatch.setenv('export_fingerprint_path', str(index_path))
+    output_path = tmp_path / 'output'
+    output_path.mkdir()
+    return output_path
+
+
+class TestPartitionFingerprint:
+    """
+    Container for the unit tests for the PartitionFingerprint class.
+    """
+
+    def test_order_independent(self):
+        """
+        Test that the fingerprint does not depend on the row order or on how rows are added.
+        """
+        rows = [('2024-01-01', 'J1', 1.5), ('2024-01-01', 'J2', None), ('2024-01-01', 'J3', 'x')]
+        partition = PartitionFingerprint()
+        partition.update(rows[2:])
+        partition.update(rows[:2])
+        assert partition.hexdigest() == fingerprint(list(reversed(rows)))
+        assert partition.rows == 3
+
+    def test_detects_changes(self):
+        """
+        Test that a changed value, a missing row and a duplicated row change the fingerprint.
+        """
+        rows = [('J1', '1.50'), ('J2', '2.00')]
+        assert fingerprint(rows) != fingerprint([('J1', '1.50'), ('J2', '2.01')])
+        assert fingerprint(rows) != fingerprint(rows[:1])
+        assert fingerprint(rows) != fingerprint(rows + rows[:1])
+
+
+class TestFingerprintIndex:
+    """
+    Container for the unit tests for the FingerprintIndex class.
+    """
+
+    def test_round_trip(self, tmp_path):
+        """
+        Test that saved fingerprints are found again and a different fingerprint is not.
+        """
+        index = FingerprintIndex(str(tmp_path / 'index.json'))
+        index.update('20231001.csv', 'abc', 'UC_20240105120000_20231001.csv', 3)
+        index.save()
+
+        index = FingerprintIndex(str(tmp_path / 'index.json'))
+        assert index.lookup('20231001.csv', 'abc')['file'] == 'UC_20240105120000_20231001.csv'
+        assert index.lookup('20231001.csv', 'abd') is None
+        assert index.lookup('20231002.csv', 'abc') is None
+
+    def test_invalid_file_is_empty(self, tmp_path):
+        """
+        Test that an unreadable index is ignored, so every partition is exported again.
+        """
+        (tmp_path / 'index.json').write_text('[1, 2', encoding='utf-8')
+        assert not FingerprintIndex(str(tmp_path / 'index.json')).entries
+
+    def test_partition_name(self):
+        """
+        Test that partitions of different batches share their name.
+        """
+        assert partition_name('UC_20240105120000_20231001.csv', 'UC_20240105120000') == '20231001.csv'
+        assert partition_name('UC_20240106120000_missing_from_budget.csv.gz',
+                              'UC_20240106120000') == 'missing_from_budget.csv.gz'
+
+
+class TestDeduplicatedExport:
+    """
+    Container for the unit tests for exports that skip unchanged partitions.
+    """
+
+    def test_unchanged_partitions_are_skipped(self, dedup):
+        """
+        Test that only partitions that changed since the last export are written again.
+        """
+        df = units_frame()
+        export_frame(df, 'UC_20240105120000', str(dedup))
+        first_files = export_files(dedup)
+
+        changed = df.copy()
+        changed.loc[changed['job_date'] == changed['job_date'].iloc[0], 'notes'] = 'changed'
+        export_frame(changed, 'UC_20240106120000', str(dedup))
+
+        second_files = sorted(set(export_files(dedup)) - set(first_files))
+        job_date = changed['job_date'].iloc[0].strftime('%Y%m%d')
+        assert second_files == [f'UC_20240106120000_{job_date}.csv',
+                                'UC_20240106120000_missing_from_budget.csv']
+
+        manifest = json.loads((dedup / 'UC_20240106120000_manifest.json').read_text(encoding='utf-8'))
+        assert sorted(entry['file'] for entry in manifest['files']) == second_files
+        assert sorted(entry['exported_as'] for entry in manifest['unchanged']) == sorted(
+            name for name in first_files
+            if name not in (f'UC_20240105120000_{job_date}.csv', 'UC_20240105120000_missing_from_budget.csv'))
+
+    @pytest.mark.parametrize("export_config", [
+        ExportConfig(mode='stream', chunk_size=7),
+        ExportConfig(mode='pandas', workers=2, pool='thread'),
+        pytest.param(ExportConfig(mode='arrow', chunk_size=7), marks=requires_pyarrow),
+        ExportConfig(mode='cursor', chunk_size=7),
+    ])
+    def test_modes_share_fingerprints(self, sqlite_database, dedup, export_config):
+        """
+        Test that a batch exported again by another mode is recognized as unchanged.
+        """
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(20, BATCH_DATE))
+            session.commit()
+        export_latest_batch(str(dedup), ExportConfig(mode='pandas'))
+        first_files = export_files(dedup)
+
+        assert export_latest_batch(str(dedup), export_config) == (BATCH_DATE, 20)
+
+        assert export_files(dedup) == first_files
+        manifest = json.loads((dedup / 'UC_20240105120000_manifest.json').read_text(encoding='utf-8'))
+        assert not manifest['files']
+        assert len(manifest['unchanged']) == len(first_files)
+
+    def test_parallel_failure_keeps_index(self, dedup):
+        """
+        Test that the index is only updated by a committed export.
+        """
+        df = units_frame()
+        (dedup / '.UC_20240105120000_missing_from_budget.csv.tmp').mkdir()
+        with pytest.raises(PartitionExportError):
+            export_frame_parallel(df, 'UC_20240105120000', str(dedup), workers=2, pool='thread')
+        assert not FingerprintIndex().entries
+
+    def test_disabled_by_default(self, tmp_path):
+        """
+        Test that every partition is written again without deduplication.
+        """
+        df = units_frame()
+        export_frame(df, 'UC_20240105120000', str(tmp_path))
+        export_frame(df, 'UC_20240106120000', str(tmp_path))
+        assert len([name for name in export_files(tmp_path) if name.startswith('UC_20240106120000')]) == \
+            len([name for name in export_files(tmp_path) if name.startswith('UC_20240105120000')])
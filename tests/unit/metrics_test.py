@@ -0,0 +1,135 @@
+"""
+This module contains unit tests for the metrics module.
+"""
+import datetime
+import json
+import os
+from unittest.mock import patch
+import pytest
+from main import export_latest_batch
+from resources.config import ExportConfig
+from resources.metrics import RunMetrics, format_prometheus, reset_metrics, write_report
+from tests.utils import create_units_complete_exports
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+class TestRunMetrics:
+    """
+    Container for the unit tests for the RunMetrics class.
+    """
+
+    def test_spans_add_up(self):
+        """
+        Test that a stage that runs several times is reported once with its total time.
+        """
+        metrics = RunMetrics()
+        metrics.add_span('fetch', 1.5)
+        metrics.add_span('fetch', 0.5)
+        with metrics.span('write'):
+            pass
+
+        spans = metrics.report()['spans']
+        assert [span['name'] for span in spans] == ['fetch', 'write']
+        assert spans[0] == {'name': 'fetch', 'seconds': 2.0, 'calls': 2}
+
+    def test_timed_counts_items(self):
+        """
+        Test that timed yields every item and counts one call per item.
+        """
+        metrics = RunMetrics()
+        assert list(metrics.timed('fetch', [[1, 2], [3]])) == [[1, 2], [3]]
+        assert metrics.spans['fetch']['calls'] == 2
+
+    def test_record_partition(self, tmp_path):
+        """
+        Test that a written partition adds its rows, bytes and write time.
+        """
+        file_path = tmp_path / 'UC_1_20240102.csv'
+        metrics = RunMetrics()
+        metrics.record_partition(datetime.date(2024, 1, 2), str(file_path), 1, 0.25, 4)
+
+        report = metrics.report()
+        assert report['counters'] == {'rows_written': 1, 'bytes_written': 4}
+        assert report['partitions'] == [{'partition': '2024-01-02', 'file': str(file_path),
+                                         'rows': 1, 'bytes': 4, 'seconds': 0.25}]
+        assert report['spans'] == [{'name': 'write', 'seconds': 0.25, 'calls': 1}]
+
+    def test_failed_report(self):
+        """
+        Test that a failed run reports its status and error.
+        """
+        report = RunMetrics().report('failed', ValueError('boom'))
+        assert report['status'] == 'failed'
+        assert report['error'] == 'boom'
+        assert report['peak_memory_bytes'] > 0
+
+
+class TestWriteReport:
+    """
+    Container for the unit tests for write_report and format_prometheus.
+    """
+
+    def test_writes_json_and_prometheus(self, tmp_path):
+        """
+        Test that the report is written as JSON and in the Prometheus text format.
+        """
+        metrics = RunMetrics()
+        metrics.add_span('fetch', 1.25)
+        metrics.increment('rows_fetched', 10)
+        report = metrics.report()
+        report_path = tmp_path / 'report.json'
+        prometheus_path = tmp_path / 'uc_export.prom'
+
+        with patch.dict(os.environ, {'export_prometheus_path': str(prometheus_path)}):
+            write_report(report, str(report_path))
+
+        assert json.loads(report_path.read_text(encoding='utf-8')) == report
+        assert prometheus_path.read_text(encoding='utf-8') == format_prometheus(report)
+        assert sorted(os.listdir(tmp_path)) == ['report.json', 'uc_export.prom']
+
+    def test_prometheus_format(self):
+        """
+        Test the samples written to the Prometheus textfile.
+        """
+        metrics = RunMetrics()
+        metrics.add_span('fetch', 1.25)
+        metrics.increment('rows_fetched', 10)
+        lines = format_prometheus(metrics.report()).splitlines()
+
+        assert 'uc_export_stage_seconds{stage="fetch"} 1.25' in lines
+        assert 'uc_export_count{counter="rows_fetched"} 10' in lines
+        assert 'uc_export_last_run_success 1' in lines
+        assert '# TYPE uc_export_duration_seconds gauge' in lines
+
+
+class TestExportMetrics:
+    """
+    Container for the unit tests for the metrics recorded by the export pipelines.
+    """
+
+    @pytest.mark.parametrize("export_mode, workers", [
+        ("pandas", 1), ("pandas", 2), ("columnar", 1), ("stream", 1),
+    ])
+    def test_export_records_metrics(self, sqlite_database, tmp_path, export_mode, workers):
+        """
+        Test that every mode records its stages, rows, bytes and round trips.
+        """
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(50, BATCH_DATE))
+            session.commit()
+        metrics = reset_metrics()
+
+        export_latest_batch(str(tmp_path), ExportConfig(mode=export_mode, workers=workers, pool='thread'))
+
+        report = metrics.report()
+        missing = len(range(0, 50, 6))
+        files = [name for name in os.listdir(tmp_path) if not name.endswith('_manifest.json')]
+        assert {'fetch', 'transform', 'write'} <= {span['name'] for span in report['spans']}
+        assert report['counters']['rows_fetched'] == 50
+        assert report['counters']['rows_written'] == 50 + missing
+        assert report['counters']['bytes_written'] == sum(
+            os.path.getsize(tmp_path / name) for name in files)
+        assert report['counters']['db_round_trips'] >= 1
+        assert sorted(partition['file'] for partition in report['partitions']) == sorted(
+            str(tmp_path / name) for name in files)
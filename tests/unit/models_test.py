@@ -1,8 +1,10 @@
 """
 This module contains tests for the models in the resources package
 """
+import pandas as pd
 import pytest
-from tests.utils import create_units_complete_export
+from resources.models import UnitsCompleteExport
+from tests.utils import create_units_complete_export, create_units_complete_exports
 
 
 class TestUnitsCompleteExport:
@@ -51,6 +53,17 @@ class TestUnitsCompleteExport:
         }
         assert export.to_dict() == expected_dict
 
+    def test_declares_export_indexes(self):
+        """
+        Test that the indexes used to find and page through a batch are declared on the table.
+        """
+        indexes = {index.name: [column.name for column in index.columns]
+                   for index in UnitsCompleteExport.__table__.indexes}
+        assert indexes == {
+            'ix_UnitsCompleteExport_date_created_job_date': ['date_created', 'job_date'],
+        }
+        assert UnitsCompleteExport.__table__.schema == 'dbo'
+
     def test_units_complete_export_repr(self, valid_export):
         """
         Test that the __repr__ method returns the correct string representation.
@@ -68,3 +81,67 @@ class TestUnitsCompleteExport:
                          f"vendor_name={export.vendor_name}, "
                          f"date_created={export.date_created})>")
         assert repr(export) == expected_repr
+
+
+class TestUnitsCompleteExportBatch:
+    """
+    Test class for the batch notes and cost code derivation.
+    """
+
+    @pytest.fixture(scope="function")
+    def exports(self):
+        """
+        Fixture to create UnitsCompleteExport instances covering the notes edge cases.
+        """
+        exports = create_units_complete_exports(60, "2023-10-01 00:00:00")
+        exports[0].timesheet_id = 0
+        exports[1].vendor_name = ""
+        exports[2].vendor_name = " Vendor with spaces "
+        exports[3].vendor_name = "Vendor Ünïcode"
+        exports[4].category_number = None
+        return exports
+
+    def test_batch_notes_matches_get_notes(self, exports):
+        """
+        Test that batch_notes returns exactly what get_notes returns for every row.
+        """
+        notes = UnitsCompleteExport.batch_notes(
+            [export.timesheet_id for export in exports],
+            [export.change_order_id for export in exports],
+            [export.sub_report_id for export in exports],
+            [export.vendor_name for export in exports],
+        )
+        assert list(notes) == [export.get_notes() for export in exports]
+
+    def test_batch_notes_accepts_float_columns(self, exports):
+        """
+        Test that ids stored as floats with NaN, as pandas does for nullable integers, format as integers.
+        """
+        df = pd.DataFrame({
+            "timesheet_id": [export.timesheet_id for export in exports],
+            "change_order_id": [export.change_order_id for export in exports],
+            "sub_report_id": [export.sub_report_id for export in exports],
+            "vendor_name": [export.vendor_name for export in exports],
+        })
+        assert df["timesheet_id"].dtype == float
+        notes = UnitsCompleteExport.batch_notes(
+            df["timesheet_id"], df["change_order_id"], df["sub_report_id"], df["vendor_name"])
+        assert list(notes) == [export.get_notes() for export in exports]
+
+    def test_batch_cost_codes_matches_get_cost_code(self, exports):
+        """
+        Test that batch_cost_codes returns exactly what get_cost_code returns for every row.
+        """
+        cost_codes = UnitsCompleteExport.batch_cost_codes(
+            [export.job_number for export in exports],
+            [export.phase_number for export in exports],
+            [export.category_number for export in exports],
+        )
+        assert list(cost_codes) == [export.get_cost_code() for export in exports]
+
+    def test_empty_columns(self):
+        """
+        Test that empty columns produce empty results.
+        """
+        assert len(UnitsCompleteExport.batch_notes([], [], [], [])) == 0
+        assert len(UnitsCompleteExport.batch_cost_codes([], [], [])) == 0
@@ -0,0 +1,186 @@
+"""
+This module contains unit tests for the output module.
+"""
+import datetime
+import hashlib
+import json
+import os
+from unittest.mock import patch
+import pandas as pd
+import pytest
+from main import export_frame
+from resources.output import OutputCommit, get_durability, remove_stale_temp_files, temp_path
+from resources.writers import CsvPartitionWriter, GzipCsvPartitionWriter
+from tests.utils import create_units_complete_exports
+
+BASE_NAME = 'UC_20240105120000'
+
+
+def write_temp(folder, file_name, content):
+    """
+    Write content to the temporary path of a file and return the final path.
+    """
+    file_path = str(folder / file_name)
+    with open(temp_path(file_path), 'w', encoding='utf-8') as file:
+        file.write(content)
+    return file_path
+
+
+class TestOutputCommit:
+    """
+    Container for the unit tests for the OutputCommit class.
+    """
+
+    def test_commit_renames_and_writes_manifest(self, tmp_path):
+        """
+        Test that commit renames the files and lists them with their rows and checksums.
+        """
+        output = OutputCommit(str(tmp_path), BASE_NAME)
+        output.add(write_temp(tmp_path, f'{BASE_NAME}_20231001.csv', 'a\n1\n2\n'), 2)
+
+        manifest = output.commit()
+
+        assert sorted(os.listdir(tmp_path)) == [f'{BASE_NAME}_20231001.csv', f'{BASE_NAME}_manifest.json']
+        assert json.loads((tmp_path / f'{BASE_NAME}_manifest.json').read_text(encoding='utf-8')) == manifest
+        assert manifest['base_name'] == BASE_NAME
+        assert manifest['files'] == [{
+            'file': f'{BASE_NAME}_20231001.csv',
+            'rows': 2,
+            'bytes': 6,
+            'sha256': hashlib.sha256(b'a\n1\n2\n').hexdigest(),
+        }]
+
+    def test_commit_without_files(self, tmp_path):
+        """
+        Test that an export without files does not write a manifest.
+        """
+        assert OutputCommit(str(tmp_path), BASE_NAME).commit() is None
+        assert not os.listdir(tmp_path)
+
+    def test_abort_removes_temp_files(self, tmp_path):
+        """
+        Test that abort removes added files and files of the export that were never added.
+        """
+        output = OutputCommit(str(tmp_path), BASE_NAME)
+        output.add(write_temp(tmp_path, f'{BASE_NAME}_20231001.csv', 'a\n'), 0)
+        write_temp(tmp_path, f'{BASE_NAME}_20231002.csv', 'a\n')
+        write_temp(tmp_path, 'UC_20240106120000_20231001.csv', 'a\n')
+
+        output.abort()
+
+        assert os.listdir(tmp_path) == ['.UC_20240106120000_20231001.csv.tmp']
+
+    @pytest.mark.parametrize("durability, file_syncs", [("file", 2), ("batch", 2), ("none", 0)])
+    def test_durability(self, tmp_path, durability, file_syncs):
+        """
+        Test that only the files of the export are synced, as they are added in 'file' mode and at
+        commit in 'batch' mode, and never the whole file system.
+        """
+        output = OutputCommit(str(tmp_path), BASE_NAME, durability)
+        with patch('resources.output._fsync_file') as mock_fsync_file, patch('resources.output.os.sync',
+                                                                             create=True) as mock_sync:
+            output.add(write_temp(tmp_path, f'{BASE_NAME}_20231001.csv', 'a\n'), 0)
+            output.add(write_temp(tmp_path, f'{BASE_NAME}_20231002.csv', 'a\n'), 0)
+            output.commit()
+
+        assert mock_fsync_file.call_count == file_syncs
+        mock_sync.assert_not_called()
+
+    def test_invalid_durability(self, monkeypatch):
+        """
+        Test that an unknown durability mode is rejected.
+        """
+        monkeypatch.setenv('export_durability', 'sometimes')
+        with pytest.raises(ValueError, match="Invalid durability mode: sometimes"):
+            get_durability()
+
+    def test_remove_stale_temp_files(self, tmp_path):
+        """
+        Test that temporary export files of an interrupted run are removed and other files are kept.
+        """
+        write_temp(tmp_path, f'{BASE_NAME}_20231001.csv', 'a\n')
+        (tmp_path / f'{BASE_NAME}_20231002.csv').write_text('a\n', encoding='utf-8')
+        (tmp_path / '.other.tmp').write_text('a\n', encoding='utf-8')
+
+        assert remove_stale_temp_files(str(tmp_path)) == 1
+        assert sorted(os.listdir(tmp_path)) == ['.other.tmp', f'{BASE_NAME}_20231002.csv']
+
+
+class TestAtomicExport:
+    """
+    Container for the unit tests for exports written through an OutputCommit.
+    """
+
+    def test_failed_export_leaves_no_files(self, tmp_path):
+        """
+        Test that an export that fails halfway leaves neither final nor temporary files.
+        """
+        units = create_units_complete_exports(20, datetime.datetime(2024, 1, 5, 12, 0, 0))
+        df = pd.DataFrame([unit.to_dict() for unit in units])
+        write_rows = CsvPartitionWriter._write_rows
+        calls = []
+
+        def failing_write_rows(writer, key, rows):
+            calls.append(key)
+            if len(calls) == 3:
+                raise OSError("disk full")
+            write_rows(writer, key, rows)
+
+        with patch.object(CsvPartitionWriter, '_write_rows', failing_write_rows), \
+                pytest.raises(OSError, match="disk full"):
+            export_frame(df, BASE_NAME, str(tmp_path))
+
+        assert not os.listdir(tmp_path)
+
+    def test_manifest_matches_files(self, tmp_path):
+        """
+        Test that the manifest lists every written file with its row count and checksum.
+        """
+        units = create_units_complete_exports(20, datetime.datetime(2024, 1, 5, 12, 0, 0))
+        export_frame(pd.DataFrame([unit.to_dict() for unit in units]), BASE_NAME, str(tmp_path))
+
+        manifest = json.loads((tmp_path / f'{BASE_NAME}_manifest.json').read_text(encoding='utf-8'))
+        files = sorted(name for name in os.listdir(tmp_path) if name != f'{BASE_NAME}_manifest.json')
+        assert [entry['file'] for entry in manifest['files']] == files
+        for entry in manifest['files']:
+            content = (tmp_path / entry['file']).read_bytes()
+            assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+            assert entry['rows'] == len(content.splitlines()) - 1
+
+    @pytest.mark.parametrize("output_format", ["csv", "csv.gz", "csv.zst", "parquet", "arrow"])
+    def test_checksums_are_computed_while_writing(self, tmp_path, output_format):
+        """
+        Test that the size and checksum in the manifest are computed while the files are written,
+        without reading the files back.
+        """
+        if output_format == 'csv.zst':
+            pytest.importorskip('zstandard')
+        elif output_format in ('parquet', 'arrow'):
+            pytest.importorskip('pyarrow')
+        units = create_units_complete_exports(20, datetime.datetime(2024, 1, 5, 12, 0, 0))
+        with patch('resources.output.file_checksum', side_effect=AssertionError("file read back")):
+            export_frame(pd.DataFrame([unit.to_dict() for unit in units]), BASE_NAME, str(tmp_path), output_format)
+
+        manifest = json.loads((tmp_path / f'{BASE_NAME}_manifest.json').read_text(encoding='utf-8'))
+        assert manifest['files']
+        for entry in manifest['files']:
+            content = (tmp_path / entry['file']).read_bytes()
+            assert entry['bytes'] == len(content)
+            assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+
+    @pytest.mark.parametrize("writer_class", [CsvPartitionWriter, GzipCsvPartitionWriter])
+    def test_checksums_of_reopened_files(self, tmp_path, writer_class):
+        """
+        Test that the checksum of a file closed and reopened for appending covers the whole file.
+        """
+        with OutputCommit(str(tmp_path), BASE_NAME) as output, \
+                writer_class(str(tmp_path), BASE_NAME, columns=['a'], output=output, max_open_files=1) as writer:
+            for value in range(6):
+                writer.write(datetime.date(2024, 1, 2 + value % 2), [value])
+
+        manifest = json.loads((tmp_path / f'{BASE_NAME}_manifest.json').read_text(encoding='utf-8'))
+        assert len(manifest['files']) == 2
+        for entry in manifest['files']:
+            content = (tmp_path / entry['file']).read_bytes()
+            assert entry['bytes'] == len(content)
+            assert entry['sha256'] == hashlib.sha256(content).hexdigest()
@@ -0,0 +1,109 @@
+"""
+This module contains unit tests for the records module.
+"""
+import datetime
+import tracemalloc
+from decimal import Decimal
+import pytest
+from resources.db_functions import fetch_latest_batch
+from resources.records import RECORD_FIELDS, RecordBatch, format_cents, to_cents
+from resources.writers import EXPORT_COLUMNS, MISSING_FROM_BUDGET
+from tests.utils import create_units_complete_exports, generate_units_rows
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+def record_rows(units):
+    """
+    Return the RECORD_FIELDS values of UnitsCompleteExport instances.
+    """
+    return [tuple(getattr(unit, field) for field in RECORD_FIELDS) for unit in units]
+
+
+class TestCents:
+    """
+    Container for the unit tests for the cents conversion.
+    """
+
+    @pytest.mark.parametrize("value", ["0.00", "0.05", "-0.05", "1.00", "-12.50", "100.10", "999999.99",
+                                       "-999999.99"])
+    def test_round_trip_matches_decimal_text(self, value):
+        """
+        Test that formatted cents are the text of the NUMERIC(8, 2) Decimal.
+        """
+        assert format_cents(to_cents(Decimal(value))) == str(Decimal(value))
+
+    def test_every_cent_value(self):
+        """
+        Test the formatting of a contiguous range of amounts around zero.
+        """
+        for cents in range(-100_000, 100_001, 7):
+            assert format_cents(cents) == str(Decimal(cents).scaleb(-2))
+
+    def test_more_than_two_decimal_places(self):
+        """
+        Test that an amount that cents cannot represent is rejected.
+        """
+        with pytest.raises(ValueError, match="more than two decimal places"):
+            to_cents(Decimal("1.005"))
+
+
+class TestRecordBatch:
+    """
+    Container for the unit tests for the RecordBatch class.
+    """
+
+    def test_records_round_trip(self):
+        """
+        Test that the records of a batch hold the values they were built from.
+        """
+        units = create_units_complete_exports(12, BATCH_DATE)
+        batch = RecordBatch.from_rows(record_rows(units))
+
+        assert len(batch) == 12
+        for record, unit in zip(batch, units):
+            assert record.export_id == unit.export_id
+            assert record.job_date == unit.job_date
+            assert record.unit_change == unit.unit_change
+            assert record.timesheet_id == unit.timesheet_id
+            assert record.vendor_name == unit.vendor_name
+            assert record.date_created == unit.date_created
+        assert batch[-1].export_id == 12
+
+    def test_partitions_match_to_dict(self, sqlite_database):
+        """
+        Test that the export rows of a batch have the text of UnitsCompleteExport.to_dict for
+        records read from the database.
+        """
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(30, BATCH_DATE))
+            session.commit()
+        units = fetch_latest_batch()
+        partitions = RecordBatch.from_rows(record_rows(units)).partitions()
+
+        expected = {}
+        for unit in units:
+            data = unit.to_dict()
+            row = tuple(str(data[column]) for column in EXPORT_COLUMNS)
+            if data['missing_from_budget'] == 1:
+                expected.setdefault(MISSING_FROM_BUDGET, []).append(row)
+            expected.setdefault(data['job_date'], []).append(row)
+        actual = {key: [tuple(str(value) for value in row) for row in rows] for key, rows in partitions.items()}
+        assert actual == expected
+
+    def test_memory_per_record(self):
+        """
+        Test that a record takes tens of bytes.
+        """
+        rows = generate_units_rows(20_000, BATCH_DATE)
+        rows = [tuple(row[field] for field in RECORD_FIELDS) for row in rows]
+
+        tracemalloc.start()
+        try:
+            batch = RecordBatch.from_rows(rows)
+            allocated, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert len(batch) == 20_000
+        assert allocated / len(batch) < 120
@@ -0,0 +1,282 @@
+"""
+This module contains unit tests for the retry and checkpoint modules and the resumable export.
+"""
+import datetime
+from contextlib import contextmanager
+from unittest.mock import patch
+import pytest
+from sqlalchemy import exc
+import main
+from resources.checkpoint import load_checkpoint, save_checkpoint
+from resources.config import ExportConfig, RetryConfig
+from resources.metrics import reset_metrics
+from resources.retry import RetryPolicy, is_transient
+from resources.watermark import load_watermark
+from tests.utils import create_units_complete_exports
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+
+
+def odbc_error(sqlstate, message):
+    """
+    Return an OperationalError wrapping an error with the arguments of a pyodbc error.
+    """
+    return exc.OperationalError('SELECT 1', {}, Exception(sqlstate, message))
+
+
+def failing(error, times, result=None):
+    """
+    Return a function that raises error the first times calls and then returns result.
+    """
+    calls = []
+
+    def func(*_args, **_kwargs):
+        calls.append(1)
+        if len(calls) <= times:
+            raise error
+        return result
+    func.calls = calls
+    return func
+
+
+class TestIsTransient:
+    """
+    Container for the unit tests for is_transient.
+    """
+
+    @pytest.mark.parametrize("error, transient", [
+        (odbc_error('08S01', '[08S01] Communication link failure (10054)'), True),
+        (odbc_error('HYT00', '[HYT00] Query timeout expired (0)'), True),
+        (odbc_error('40001', '[40001] Transaction was deadlocked (1205)'), True),
+        (odbc_error('42000', '[42000] Database is not currently available (40613)'), True),
+        (odbc_error('42S02', "[42S02] Invalid object name 'units' (208)"), False),
+        (odbc_error('23000', '[23000] Violation of PRIMARY KEY constraint (2627)'), False),
+        (exc.TimeoutError("QueuePool limit reached"), True),
+        (ConnectionResetError("reset by peer"), True),
+        (ValueError("Invalid schema name"), False),
+    ])
+    def test_classification(self, error, transient):
+        """
+        Test that connection failures, timeouts and deadlocks are transient and other errors are not.
+        """
+        assert is_transient(error) is transient
+
+    def test_invalidated_connection(self):
+        """
+        Test that an error that invalidated its connection is transient.
+        """
+        error = exc.DBAPIError('SELECT 1', {}, Exception('HY000', 'unknown'), connection_invalidated=True)
+        assert is_transient(error)
+
+
+class TestRetryPolicy:
+    """
+    Container for the unit tests for the RetryPolicy class.
+    """
+
+    def test_retries_transient_errors(self):
+        """
+        Test that a call is retried after transient errors with growing delays.
+        """
+        metrics = reset_metrics()
+        delays = []
+        policy = RetryPolicy(attempts=4, delay=1.0, max_delay=3.0, sleep=delays.append)
+        func = failing(odbc_error('08S01', 'Communication link failure'), 3, 'done')
+
+        assert policy.call(func) == 'done'
+        assert len(func.calls) == 4
+        assert 0.5 <= delays[0] <= 1.0
+        assert 1.0 <= delays[1] <= 2.0
+        assert 1.5 <= delays[2] <= 3.0
+        assert metrics.counters['db_retries'] == 3
+
+    def test_stops_after_attempts(self):
+        """
+        Test that the last error is raised once no attempt is left.
+        """
+        func = failing(odbc_error('HYT00', 'Query timeout expired'), 5)
+        with pytest.raises(exc.OperationalError, match="Query timeout expired"):
+            RetryPolicy(attempts=3, delay=0, sleep=lambda _: None).call(func)
+        assert len(func.calls) == 3
+
+    def test_permanent_error_is_not_retried(self):
+        """
+        Test that an error that is not transient is raised right away.
+        """
+        func = failing(odbc_error('42S02', 'Invalid object name'), 1)
+        with pytest.raises(exc.OperationalError):
+            RetryPolicy(sleep=lambda _: None).call(func)
+        assert len(func.calls) == 1
+
+    def test_deadline(self):
+        """
+        Test that no retry starts after the deadline.
+        """
+        func = failing(odbc_error('08S01', 'Communication link failure'), 5)
+        with pytest.raises(exc.OperationalError):
+            RetryPolicy(attempts=10, delay=2.0, deadline=1.0, sleep=lambda _: None).call(func)
+        assert len(func.calls) == 1
+
+    def test_from_config(self):
+        """
+        Test that the policy takes its settings from RetryConfig, and invalid settings are rejected.
+        """
+        policy = RetryPolicy.from_config(RetryConfig(attempts=2, delay_ms=250, max_delay_ms=1000, deadline=10))
+        assert (policy.attempts, policy.delay, policy.max_delay, policy.deadline) == (2, 0.25, 1.0, 10)
+        with pytest.raises(ValueError, match="SQL_RETRY_ATTEMPTS must be at least 1"):
+            RetryConfig(attempts=0)
+
+
+@pytest.fixture(name='run_paths')
+def run_paths_fixture(sqlite_database, tmp_path, monkeypatch):
+    """
+    Fixture to keep the output and state files of a run in the test folder, with a batch in the
+    database and retries that do not wait.
+    """
+    for name in ('state', 'checkpoint', 'report'):
+        monkeypatch.setenv(f'export_{name}_path', str(tmp_path / f'{name}.json'))
+    monkeypatch.setenv('csv_folder_path', str(tmp_path / 'output'))
+    monkeypatch.setenv('SQL_RETRY_DELAY_MS', '0')
+    with sqlite_database.get_new_session() as session:
+        session.add_all(create_units_complete_exports(5, BATCH_DATE))
+        session.commit()
+    return tmp_path
+
+
+class TestResumableExport:
+    """
+    Container for the unit tests for retrying and resuming the stages of main.
+    """
+
+    def test_transient_export_error_is_retried(self, run_paths):
+        """
+        Test that a transient error while exporting retries the export without running the procedure again.
+        """
+        export_latest_batch = main.export_latest_batch
+        calls = []
+
+        def flaky_export(*args):
+            calls.append(1)
+            if len(calls) == 1:
+                raise odbc_error('08S01', 'Communication link failure')
+            return export_latest_batch(*args)
+
+        with patch('resources.db_functions.run_stored_procedure', return_value=5) as procedure, \
+                patch('main.export_latest_batch', flaky_export):
+            assert main.main(ExportConfig(mode='stream')) == 5
+
+        procedure.assert_called_once()
+        assert len(calls) == 2
+        assert load_watermark() == BATCH_DATE
+        assert load_checkpoint() is None
+
+    def test_failed_export_resumes_before_procedure(self, run_paths):
+        """
+        Test that the run after a failed export exports the batch first and runs the procedure afterwards.
+        """
+        with patch('resources.db_functions.run_stored_procedure', return_value=5), \
+                patch('main.export_latest_batch', side_effect=OSError("share unavailable")):
+            with pytest.raises(OSError, match="share unavailable"):
+                main.main(ExportConfig(mode='pandas'))
+        assert load_checkpoint()['affected_rows'] == 5
+        assert load_watermark() is None
+
+        watermarks = []
+        with patch('resources.db_functions.run_stored_procedure',
+                   side_effect=lambda: watermarks.append(load_watermark()) or 0) as procedure:
+            assert main.main(ExportConfig(mode='pandas')) == 5
+
+        procedure.assert_called_once()
+        assert watermarks == [BATCH_DATE]
+        assert load_watermark() == BATCH_DATE
+        assert load_checkpoint() is None
+
+    def test_transient_procedure_error_is_not_retried(self, run_paths):
+        """
+        Test that the procedure is not run again after a transient error, and the latest batch is
+        exported since it is newer than the watermark.
+        """
+        error = odbc_error('08S01', 'Communication link failure')
+        with patch('resources.db_functions.run_stored_procedure', side_effect=error) as procedure:
+            assert main.main(ExportConfig(mode='stream')) == 5
+
+        procedure.assert_called_once()
+        assert load_watermark() == BATCH_DATE
+        assert load_checkpoint() is None
+
+    def test_transient_procedure_error_without_new_batch(self, run_paths):
+        """
+        Test that nothing is exported after a transient procedure error when the latest batch was
+        already exported.
+        """
+        with patch('resources.db_functions.run_stored_procedure', return_value=5):
+            main.main(ExportConfig(mode='pandas'))
+
+        error = odbc_error('HYT00', 'Query timeout expired')
+        with patch('resources.db_functions.run_stored_procedure', side_effect=error), \
+                patch('main.export_latest_batch') as export:
+            assert main.main(ExportConfig(mode='pandas')) == 0
+        export.assert_not_called()
+
+    def test_permanent_procedure_error_is_raised(self, run_paths):
+        """
+        Test that a procedure error that is not transient fails the run without exporting.
+        """
+        error = odbc_error('42S02', "Invalid object name 'dbo.UnitsComplete'. (208)")
+        with patch('resources.db_functions.run_stored_procedure', side_effect=error), \
+                patch('main.export_latest_batch') as export:
+            with pytest.raises(exc.OperationalError):
+                main.main(ExportConfig(mode='pandas'))
+        export.assert_not_called()
+
+    def test_no_checkpoint_without_changes(self, run_paths):
+        """
+        Test that a procedure run without affected rows leaves no checkpoint.
+        """
+        with patch('resources.db_functions.run_stored_procedure', return_value=0):
+            assert main.main(ExportConfig(mode='pandas')) == 0
+        assert load_checkpoint() is None
+
+    def test_procedure_rows_are_not_run_again_after_commit(self, run_paths):
+        """
+        Test that a failed export of the procedure rows after the procedure committed exports the
+        latest batch instead of running the procedure again.
+        """
+        commit = main.OutputCommit.commit
+        calls = []
+
+        def flaky_commit(output):
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("share unavailable")
+            return commit(output)
+
+        rows = [(1, datetime.date(2024, 1, 1), '1', '2', '3', 100, None, None, None, None, BATCH_DATE, 0)]
+        columns = ['export_id', 'job_date', 'job_number', 'phase_number', 'category_number', 'unit_change',
+                   'timesheet_id', 'change_order_id', 'sub_report_id', 'vendor_name', 'date_created',
+                   'missing_from_budget']
+        procedure_calls = []
+
+        @contextmanager
+        def procedure(*_args):
+            procedure_calls.append(1)
+            yield 5, iter([(columns, rows)])
+
+        with patch('resources.export.run_stored_procedure_with_rows', procedure), \
+                patch('main.OutputCommit.commit', flaky_commit):
+            assert main.main(ExportConfig(mode='pandas', procedure_rows=True)) == 5
+
+        assert len(procedure_calls) == 1
+        assert load_watermark() == BATCH_DATE
+        assert load_checkpoint() is None
+
+    def test_invalid_checkpoint(self, tmp_path):
+        """
+        Test that a checkpoint file that cannot be parsed is reported.
+        """
+        path = tmp_path / 'checkpoint.json'
+        save_checkpoint(3, str(path))
+        assert load_checkpoint(str(path))['affected_rows'] == 3
+        path.write_text('{"affected_rows": "many"}', encoding='utf-8')
+        with pytest.raises(ValueError, match="Invalid export checkpoint file"):
+            load_checkpoint(str(path))
@@ -0,0 +1,212 @@
+"""
+This module contains unit tests for the service module.
+"""
+import datetime
+import threading
+from unittest.mock import MagicMock, patch
+import pytest
+from main import main
+from resources.config import ExportConfig, ServiceConfig
+from resources.db_functions import fetch_latest_batch_date
+from resources.service import (
+    CronSchedule,
+    ExportService,
+    IntervalSchedule,
+    parse_interval,
+    parse_schedule
+)
+from resources.watermark import load_watermark
+from tests.utils import create_units_complete_exports
+
+START = datetime.datetime(2024, 1, 5, 12, 0, 30)
+
+
+class TestSchedules:
+    """
+    Container for the unit tests for the schedules.
+    """
+
+    @pytest.mark.parametrize("text, seconds", [("90", 90), ("90s", 90), ("15m", 900), ("2h", 7200), ("1d", 86400)])
+    def test_parse_interval(self, text, seconds):
+        """
+        Test that intervals are read in seconds, minutes, hours and days.
+        """
+        assert parse_interval(text) == seconds
+
+    @pytest.mark.parametrize("text", ["0", "-5", "15x", "m"])
+    def test_invalid_interval(self, text):
+        """
+        Test that invalid intervals are rejected.
+        """
+        with pytest.raises(ValueError, match="Invalid interval"):
+            parse_interval(text)
+
+    @pytest.mark.parametrize("expression, after, expected", [
+        ("*/15 * * * *", START, datetime.datetime(2024, 1, 5, 12, 15)),
+        ("0 6 * * *", START, datetime.datetime(2024, 1, 6, 6, 0)),
+        ("30 6-18/6 * * 1-5", START, datetime.datetime(2024, 1, 5, 12, 30)),
+        ("0 7 * * 0", START, datetime.datetime(2024, 1, 7, 7, 0)),
+        ("0 7 * * 7", START, datetime.datetime(2024, 1, 7, 7, 0)),
+        ("0 0 1 3 *", START, datetime.datetime(2024, 3, 1, 0, 0)),
+        ("0 0 29 2 *", START, datetime.datetime(2024, 2, 29, 0, 0)),
+        ("0 0 13 * 5", START, datetime.datetime(2024, 1, 12, 0, 0)),
+    ])
+    def test_cron_next_run(self, expression, after, expected):
+        """
+        Test the next run of cron expressions, including day of week and either-day matching.
+        """
+        assert CronSchedule(expression).next_run(after) == expected
+
+    @pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "*/0 * * * *", "a * * * *"])
+    def test_invalid_cron(self, expression):
+        """
+        Test that invalid cron expressions are rejected.
+        """
+        with pytest.raises(ValueError, match="Invalid cron"):
+            CronSchedule(expression)
+
+    def test_cron_never_matches(self):
+        """
+        Test that an expression without a matching day is reported.
+        """
+        with pytest.raises(ValueError, match="never matches"):
+            CronSchedule("0 0 30 2 *").next_run(START)
+
+    def test_parse_schedule(self):
+        """
+        Test that cron expressions and intervals are told apart.
+        """
+        assert isinstance(parse_schedule("0 6 * * *"), CronSchedule)
+        assert parse_schedule("15m").seconds == 900
+
+
+class TestExportService:
+    """
+    Container for the unit tests for the ExportService class.
+    """
+
+    def test_scheduled_runs(self):
+        """
+        Test that a scheduled run calls the procedure and a failed run does not stop the service.
+        """
+        run = MagicMock(side_effect=[RuntimeError("boom"), None])
+        service = ExportService(run, schedule=IntervalSchedule(60))
+
+        assert service.tick(START) == START + datetime.timedelta(seconds=60)
+        run.assert_not_called()
+        service.tick(START + datetime.timedelta(seconds=60))
+        service.tick(START + datetime.timedelta(seconds=120))
+
+        assert run.call_count == 2
+        run.assert_called_with(run_procedure=True)
+
+    def test_polling_exports_new_batches(self):
+        """
+        Test that polling starts a run without the procedure only for batches newer than the last export.
+        """
+        batch_dates = iter([START, START, START + datetime.timedelta(hours=1)])
+        run = MagicMock()
+        service = ExportService(run, poll_interval=30, latest_batch_date=lambda: next(batch_dates),
+                                exported_batch_date=lambda: START)
+
+        assert service.tick(START) == START + datetime.timedelta(seconds=30)
+        service.tick(START + datetime.timedelta(seconds=10))
+        service.tick(START + datetime.timedelta(seconds=30))
+        run.assert_not_called()
+        service.tick(START + datetime.timedelta(seconds=60))
+
+        run.assert_called_once_with(run_procedure=False)
+        assert service.last_batch_date == START + datetime.timedelta(hours=1)
+
+    def test_failed_poll_run_is_retried(self):
+        """
+        Test that a batch whose export failed is exported again on the next poll.
+        """
+        run = MagicMock(side_effect=[RuntimeError("boom"), None])
+        service = ExportService(run, poll_interval=30, latest_batch_date=lambda: START)
+
+        service.tick(START)
+        service.tick(START + datetime.timedelta(seconds=30))
+        service.tick(START + datetime.timedelta(seconds=60))
+
+        assert run.call_count == 2
+
+    def test_requires_schedule_or_polling(self):
+        """
+        Test that a service without a schedule or polling is rejected.
+        """
+        with pytest.raises(ValueError, match="needs a schedule or a poll interval"):
+            ExportService(MagicMock())
+
+    def test_stop(self):
+        """
+        Test that run_forever returns once stop is called.
+        """
+        service = ExportService(MagicMock(), schedule=IntervalSchedule(3600))
+        thread = threading.Thread(target=service.run_forever)
+        thread.start()
+        service.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+class TestServiceConfig:
+    """
+    Container for the unit tests for the ServiceConfig class.
+    """
+
+    def test_reads_environment(self, monkeypatch):
+        """
+        Test that the settings are read from the environment.
+        """
+        monkeypatch.setenv('export_schedule', '*/5 * * * *')
+        monkeypatch.setenv('export_poll_interval', '30')
+        config = ServiceConfig()
+        assert (config.schedule, config.poll_interval) == ('*/5 * * * *', 30)
+
+    def test_requires_schedule_or_polling(self):
+        """
+        Test that a service configuration without a schedule or polling is rejected.
+        """
+        with pytest.raises(ValueError, match="needs export_schedule or export_poll_interval"):
+            ServiceConfig()
+
+
+class TestFetchLatestBatchDate:
+    """
+    Container for the unit tests for the new batch lookup used by polling.
+    """
+
+    def test_fetch_latest_batch_date(self, sqlite_database):
+        """
+        Test that the latest batch date is looked up, and None is returned for an empty table.
+        """
+        assert fetch_latest_batch_date() is None
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(3, START, start_id=1))
+            session.add_all(create_units_complete_exports(3, START - datetime.timedelta(days=1), start_id=10))
+            session.commit()
+        assert fetch_latest_batch_date() == START
+
+
+class TestMainWithoutProcedure:
+    """
+    Container for the unit tests for the runs started by polling.
+    """
+
+    def test_exports_latest_batch(self, sqlite_database, tmp_path, monkeypatch):
+        """
+        Test that a run without the stored procedure exports the latest batch and moves the watermark.
+        """
+        monkeypatch.setenv('csv_folder_path', str(tmp_path / 'output'))
+        monkeypatch.setenv('export_state_path', str(tmp_path / 'state.json'))
+        monkeypatch.setenv('export_report_path', str(tmp_path / 'report.json'))
+        with sqlite_database.get_new_session() as session:
+            session.add_all(create_units_complete_exports(5, START))
+            session.commit()
+
+        with patch('resources.db_functions.run_stored_procedure') as mock_run_stored_procedure:
+            assert main(ExportConfig(mode='pandas'), run_procedure=False) == 5
+
+        mock_run_stored_procedure.assert_not_called()
+        assert load_watermark() == START
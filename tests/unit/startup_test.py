@@ -0,0 +1,102 @@
+"""
+This module contains the import time budget tests for the command line and the UI.
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cumulative import time allowed for the entry points, in milliseconds
+IMPORT_TIME_BUDGET_MS = int(os.environ.get('IMPORT_TIME_BUDGET_MS', '500'))
+
+# Modules that must only be imported once an export runs
+HEAVY_MODULES = ('pandas', 'numpy', 'sqlalchemy', 'pyarrow', 'pyodbc')
+
+
+def import_times(module):
+    """
+    Import a module in a new interpreter with -X importtime.
+
+    :return: Dictionary of every imported module to its cumulative import time in microseconds
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime:
+    """
+    Container for the import time budget tests.
+    """
+
+    @pytest.mark.parametrize("module", [
+        "main",
+        pytest.param("ui", marks=pytest.mark.skipif(importlib.util.find_spec('tkinter') is None,
+                                                    reason="tkinter is not available")),
+    ])
+    def test_entry_point_is_light(self, module):
+        """
+        Test that the entry points do not import the export dependencies and stay within the budget.
+        """
+        times = import_times(module)
+        assert module in times
+        assert sorted(name for name in times if name.split('.')[0] in HEAVY_MODULES) == []
+        assert times[module] / 1000 < IMPORT_TIME_BUDGET_MS
+
+    def test_models_are_light(self):
+        """
+        Test that importing main and the models does not import NumPy or pandas.
+        """
+        script = "import sys, main, resources.models; print(sorted({'numpy', 'pandas'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '[]'
+
+    def test_export_does_not_import_async_layer(self):
+        """
+        Test that importing the export pipelines does not import the async database layer.
+        """
+        script = ("import sys, resources.export; "
+                  "print(sorted(name for name in sys.modules if name.startswith('resources.async_')))")
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '[]'
+
+    def test_cursor_mode_does_not_import_pandas(self, tmp_path):
+        """
+        Test that the cursor export mode exports a batch without importing pandas.
+        """
+        database_path = tmp_path / 'units.db'
+        output_path = tmp_path / 'output'
+        output_path.mkdir()
+        script = f"""
+import datetime
+import sys
+from unittest.mock import patch
+from sqlalchemy import create_engine
+import main
+from resources.config import ExportConfig
+from resources.database import get_database
+from resources.models import Base, UnitsCompleteExport
+from tests.utils import create_units_complete_exports
+
+engine = create_engine('sqlite:///{database_path}',
+                       execution_options={{'schema_translate_map': {{UnitsCompleteExport.__table__.schema: None}}}})
+Base.metadata.create_all(engine)
+with patch('resources.database.Database._create_engine', return_value=engine):
+    with get_database().get_new_session() as session:
+        session.add_all(create_units_complete_exports(10, datetime.datetime(2024, 1, 5, 12, 0, 0)))
+        session.commit()
+    print(main.export_latest_batch({str(output_path)!r}, ExportConfig(mode='cursor'))[1])
+print('pandas' in sys.modules)
+"""
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True)
+        assert result.stdout.split() == ['10', 'False']
+        assert os.listdir(output_path)
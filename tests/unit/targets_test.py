@@ -0,0 +1,202 @@
+"""
+This module contains unit tests for the targets module and the multi-target run.
+"""
+import datetime
+import json
+import os
+import threading
+from unittest.mock import patch
+import pytest
+from sqlalchemy import create_engine, event
+from main import run_targets
+from resources.config import TargetsConfig, get_setting, get_target_schema, use_target_settings
+from resources.database import get_database, initialize_database
+from resources.models import UnitsCompleteExport
+from resources.targets import ExportTarget, TargetExportError, load_targets
+from resources.watermark import load_watermark
+from tests.utils import create_units_complete_exports
+
+BATCH_DATE = datetime.datetime(2024, 1, 5, 12, 0, 0)
+SCHEMAS = ('east', 'west')
+
+
+def write_targets(path, entries):
+    """
+    Write a targets file and return its path.
+    """
+    path.write_text(json.dumps(entries), encoding='utf-8')
+    return str(path)
+
+
+def target_entries(tmp_path, names=SCHEMAS):
+    """
+    Return targets file entries with one schema and output folder per name.
+    """
+    return [{'name': name, 'schema_name': name, 'csv_folder_path': str(tmp_path / 'output' / name)}
+            for name in names]
+
+
+@pytest.fixture(name='target_paths')
+def target_paths_fixture(tmp_path, monkeypatch):
+    """
+    Fixture to keep the state, report and fingerprint files of every target in the test folder.
+    """
+    monkeypatch.setenv('export_state_path', str(tmp_path / 'state.json'))
+    monkeypatch.setenv('export_report_path', str(tmp_path / 'report.json'))
+    monkeypatch.setenv('export_fingerprint_path', str(tmp_path / 'fingerprints.json'))
+    return tmp_path
+
+
+@pytest.fixture(name='schema_database')
+def schema_database_fixture(tmp_path):
+    """
+    Fixture to back the shared Database with a SQLite file that has one attached database per schema.
+    """
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "main.db"}',
+        execution_options={'schema_translate_map': {UnitsCompleteExport.__table__.schema: None}},
+    )
+
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(dbapi_connection, _connection_record):
+        for schema in SCHEMAS:
+            dbapi_connection.execute(f"ATTACH DATABASE '{tmp_path / schema}.db' AS {schema}")
+
+    with patch('resources.database.Database._create_engine', return_value=engine):
+        yield get_database()
+
+
+class TestTargetSettings:
+    """
+    Container for the unit tests for the settings of the current target.
+    """
+
+    def test_overrides_environment(self, monkeypatch):
+        """
+        Test that target settings replace the environment only inside the context and thread.
+        """
+        monkeypatch.setenv('csv_folder_path', 'shared')
+        seen = []
+        with use_target_settings({'csv_folder_path': 'east', 'schema_name': 'east'}):
+            thread = threading.Thread(target=lambda: seen.append(get_setting('csv_folder_path')))
+            thread.start()
+            thread.join()
+            assert get_setting('csv_folder_path') == 'east'
+            assert get_target_schema() == 'east'
+        assert get_setting('csv_folder_path') == 'shared'
+        assert get_target_schema() is None
+        assert seen == ['shared']
+
+
+class TestExportTarget:
+    """
+    Container for the unit tests for the ExportTarget class and load_targets.
+    """
+
+    def test_target_cache_folder(self, monkeypatch):
+        """
+        Test that every target gets its own batch cache folder.
+        """
+        monkeypatch.setenv('export_cache_path', os.path.join('cache', 'batches') + os.sep)
+        target = ExportTarget('east', {'schema_name': 'east', 'csv_folder_path': 'out'})
+        assert target.settings['export_cache_path'] == os.path.join('cache', 'batches_east')
+
+    def test_target_files(self, target_paths):
+        """
+        Test that every target gets its own state, report and fingerprint files.
+        """
+        target = ExportTarget('east', {'schema_name': 'east', 'csv_folder_path': 'out', 'export_workers': 2})
+        assert target.settings['export_state_path'] == str(target_paths / 'state_east.json')
+        assert target.settings['export_checkpoint_path'] == 'export_checkpoint_east.json'
+        assert target.settings['export_report_path'] == str(target_paths / 'report_east.json')
+        assert target.settings['export_fingerprint_path'] == str(target_paths / 'fingerprints_east.json')
+        assert 'export_prometheus_path' not in target.settings
+        assert 'export_cache_path' not in target.settings
+        assert target.settings['export_workers'] == '2'
+
+    @pytest.mark.parametrize("name, settings, message", [
+        ('east west', {'schema_name': 'east', 'csv_folder_path': 'out'}, "Invalid target name"),
+        ('east', {'csv_folder_path': 'out'}, "missing schema_name"),
+        ('east', {'schema_name': 'east;', 'csv_folder_path': 'out'}, "Invalid schema name"),
+        ('east', {'schema_name': 'east', 'csv_folder_path': 'out', 'SQL_DATABASE': 'other'},
+         "cannot override the database connection settings"),
+    ])
+    def test_invalid_target(self, name, settings, message):
+        """
+        Test that invalid targets are rejected.
+        """
+        with pytest.raises(ValueError, match=message):
+            ExportTarget(name, settings)
+
+    def test_load_targets(self, tmp_path):
+        """
+        Test that targets are loaded in order and shared names or folders are rejected.
+        """
+        path = write_targets(tmp_path / 'targets.json', target_entries(tmp_path))
+        assert [str(target) for target in load_targets(path)] == ['east (schema east)', 'west (schema west)']
+
+        entries = target_entries(tmp_path, ('east', 'east'))
+        with pytest.raises(ValueError, match="names must be unique"):
+            load_targets(write_targets(tmp_path / 'targets.json', entries))
+
+        entries = target_entries(tmp_path)
+        entries[1]['csv_folder_path'] = entries[0]['csv_folder_path']
+        with pytest.raises(ValueError, match="its own csv_folder_path"):
+            load_targets(write_targets(tmp_path / 'targets.json', entries))
+
+        with pytest.raises(ValueError, match="expected a list of targets"):
+            load_targets(write_targets(tmp_path / 'targets.json', {'name': 'east'}))
+
+
+class TestRunTargets:
+    """
+    Container for the unit tests for exporting several targets in one process.
+    """
+
+    def test_exports_every_schema(self, schema_database, target_paths):
+        """
+        Test that every target exports the latest batch of its own schema to its own folder.
+        """
+        for index, schema in enumerate(SCHEMAS):
+            with use_target_settings({'schema_name': schema}):
+                initialize_database()
+                with schema_database.get_new_session() as session:
+                    session.add_all(create_units_complete_exports(
+                        5 + index, BATCH_DATE + datetime.timedelta(hours=index)))
+                    session.commit()
+
+        path = write_targets(target_paths / 'targets.json', target_entries(target_paths))
+        results = run_targets(TargetsConfig(path, 2), {'mode': 'stream'}, run_procedure=False)
+
+        assert results == {'east': 5, 'west': 6}
+        assert load_watermark(str(target_paths / 'state_east.json')) == BATCH_DATE
+        assert load_watermark(str(target_paths / 'state_west.json')) == BATCH_DATE + datetime.timedelta(hours=1)
+        assert 'UC_20240105120000_manifest.json' in os.listdir(target_paths / 'output' / 'east')
+        assert 'UC_20240105130000_manifest.json' in os.listdir(target_paths / 'output' / 'west')
+        report = json.loads((target_paths / 'report_west.json').read_text(encoding='utf-8'))
+        assert report['counters']['rows_fetched'] == 6
+
+    def test_targets_run_concurrently(self, target_paths):
+        """
+        Test that targets run at the same time and a failed target does not stop the others.
+        """
+        started = threading.Barrier(2, timeout=5)
+
+        def fake_main(_export_config, _run_procedure):
+            started.wait()
+            if get_setting('schema_name') == 'west':
+                raise RuntimeError("boom")
+            return 3
+
+        path = write_targets(target_paths / 'targets.json', target_entries(target_paths))
+        with patch('main.main', side_effect=fake_main):
+            with pytest.raises(TargetExportError, match="1 target\\(s\\): west: boom") as error:
+                run_targets(TargetsConfig(path, 2))
+        assert list(error.value.failures) == ['west']
+
+    def test_invalid_concurrency(self):
+        """
+        Test that a concurrency below one is rejected.
+        """
+        with pytest.raises(ValueError, match="export_target_concurrency must be at least 1"):
+            TargetsConfig('targets.json', 0)
@@ -0,0 +1,49 @@
+"""
+This module contains unit tests for the watermark module.
+"""
+import datetime
+import os
+from unittest.mock import patch
+import pytest
+from resources.watermark import get_state_path, load_watermark, save_watermark, DEFAULT_STATE_PATH
+
+
+class TestWatermark:
+    """
+    Container for the unit tests for the export watermark.
+    """
+
+    def test_state_path_from_environment(self):
+        """
+        Test that the state path comes from the argument, then the environment, then the default.
+        """
+        with patch.dict(os.environ, {'export_state_path': 'from_env.json'}):
+            assert get_state_path('explicit.json') == 'explicit.json'
+            assert get_state_path() == 'from_env.json'
+        with patch.dict(os.environ, {}, clear=True):
+            assert get_state_path() == DEFAULT_STATE_PATH
+
+    def test_load_without_state_file(self, tmp_path):
+        """
+        Test that no watermark is returned before the first export.
+        """
+        assert load_watermark(str(tmp_path / 'state.json')) is None
+
+    def test_save_and_load(self, tmp_path):
+        """
+        Test that a saved watermark is loaded back with its microseconds.
+        """
+        path = str(tmp_path / 'state.json')
+        date_created = datetime.datetime(2024, 1, 2, 3, 4, 5, 123000)
+        save_watermark(date_created, 10, path)
+        assert load_watermark(path) == date_created
+        assert os.listdir(tmp_path) == ['state.json']
+
+    def test_invalid_state_file(self, tmp_path):
+        """
+        Test that a corrupt state file is reported instead of silently exporting everything again.
+        """
+        path = tmp_path / 'state.json'
+        path.write_text('{"date_created": "yesterday"}', encoding='utf-8')
+        with pytest.raises(ValueError, match="Invalid export state file"):
+            load_watermark(str(path))
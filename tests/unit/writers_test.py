@@ -0,0 +1,202 @@
+"""
+This module contains unit tests for the writers module.
+"""
+import datetime
+import os
+from decimal import Decimal
+import pandas as pd
+import pytest
+from resources.writers import (
+    CsvPartitionWriter,
+    EXPORT_COLUMNS,
+    MISSING_FROM_BUDGET,
+    create_partition_writer,
+    partition_file_name
+)
+
+ROWS = [
+    [datetime.date(2024, 1, 2), "123", "001", "C1", Decimal("1.50"), "", "123.001.C1"],
+    [datetime.date(2024, 1, 2), "123", "001", "C1", Decimal("-2.00"), 'Vendor Name: A, "B"', "123.001.C1"],
+    [datetime.date(2024, 1, 3), "124", "002", "C2", Decimal("3.25"), None, "124.002.C2"],
+]
+
+
+class TestPartitionFileName:
+    """
+    Container for the unit tests for partition_file_name.
+    """
+
+    @pytest.mark.parametrize(
+        "key, expected",
+        [
+            (datetime.date(2024, 1, 2), "UC_20240105120000_20240102.csv"),
+            ("2024-01-02", "UC_20240105120000_20240102.csv"),
+            (MISSING_FROM_BUDGET, "UC_20240105120000_missing_from_budget.csv"),
+        ],
+    )
+    def test_partition_file_name(self, key, expected):
+        """
+        Test that partition keys map to the documented file naming scheme.
+        """
+        assert partition_file_name("UC_20240105120000", key) == expected
+
+
+class TestCsvPartitionWriter:
+    """
+    Container for the unit tests for the CsvPartitionWriter class.
+    """
+
+    def test_output_matches_to_csv(self, tmp_path):
+        """
+        Test that the writer produces the same bytes as DataFrame.to_csv.
+        """
+        rows = [
+            [datetime.date(2024, 1, 2), "123", "001", "C1", Decimal("1.50"), "", "123.001.C1"],
+            [datetime.date(2024, 1, 2), "123", "001", "C1", Decimal("-2.00"),
+             'Vendor Name: A, "B"', "123.001.C1"],
+            [datetime.date(2024, 1, 2), "123", "001", "C1", Decimal("3.25"), None, "123.001.C1"],
+        ]
+        with CsvPartitionWriter(str(tmp_path), "UC_1") as writer:
+            for row in rows:
+                writer.write(datetime.date(2024, 1, 2), row)
+
+        expected_path = tmp_path / "expected.csv"
+        pd.DataFrame(rows, columns=EXPORT_COLUMNS).to_csv(expected_path, index=False)
+
+        actual = (tmp_path / "UC_1_20240102.csv").read_bytes()
+        assert actual == expected_path.read_bytes()
+        assert writer.row_counts == {datetime.date(2024, 1, 2): 3}
+
+    def test_only_written_partitions_create_files(self, tmp_path):
+        """
+        Test that files are only created for partitions that receive rows.
+        """
+        with CsvPartitionWriter(str(tmp_path), "UC_1") as writer:
+            writer.write(datetime.date(2024, 1, 3), ["a"] * len(EXPORT_COLUMNS))
+        assert os.listdir(tmp_path) == ["UC_1_20240103.csv"]
+
+    def test_bounded_open_files(self, tmp_path):
+        """
+        Test that evicted partitions are reopened for appending without repeating the header.
+        """
+        keys = [datetime.date(2024, 1, day) for day in (1, 2, 3, 1, 2, 3, 1)]
+        with CsvPartitionWriter(str(tmp_path), "UC_1", max_open_files=2) as writer:
+            for index, key in enumerate(keys):
+                writer.write(key, [key, index, "", "", "", "", ""])
+                assert len(writer._open) <= 2
+
+        lines = (tmp_path / "UC_1_20240101.csv").read_text(encoding="utf-8").splitlines()
+        assert lines == [",".join(EXPORT_COLUMNS), "2024-01-01,0,,,,,", "2024-01-01,3,,,,,",
+                         "2024-01-01,6,,,,,"]
+        assert writer.row_counts[datetime.date(2024, 1, 1)] == 3
+
+    def test_invalid_max_open_files(self, tmp_path):
+        """
+        Test that max_open_files below one is rejected.
+        """
+        with pytest.raises(ValueError, match="max_open_files must be at least 1"):
+            CsvPartitionWriter(str(tmp_path), "UC_1", max_open_files=0)
+
+    def test_write_frame_matches_to_csv(self, tmp_path):
+        """
+        Test that write_frame splits a DataFrame like groupby and to_csv, including empty floats.
+        """
+        df = pd.DataFrame({
+            "job_date": [datetime.date(2024, 1, 2), datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)],
+            "job_number": ["1", "2", "3"],
+            "phase_number": ["p", "p", "p"],
+            "category_number": ["c", "c", "c"],
+            "unit_change": [1.5, float("nan"), -2.0],
+            "missing_from_budget": [1, None, 0],
+            "notes": ["", "Vendor Name: x,y", ""],
+            "cost_code": ["1.p.c", "2.p.c", "3.p.c"],
+        })
+        with CsvPartitionWriter(str(tmp_path), "UC_1", max_open_files=1) as writer:
+            writer.write_frame(df)
+
+        for job_date, group_df in df.groupby("job_date"):
+            expected = group_df.to_csv(index=False, columns=EXPORT_COLUMNS, lineterminator=os.linesep)
+            assert (tmp_path / f"UC_1_{job_date:%Y%m%d}.csv").read_bytes() == expected.encode()
+        missing = df[df["missing_from_budget"] == 1].to_csv(
+            index=False, columns=EXPORT_COLUMNS, lineterminator=os.linesep)
+        assert (tmp_path / "UC_1_missing_from_budget.csv").read_bytes() == missing.encode()
+
+
+class TestCreatePartitionWriter:
+    """
+    Container for the unit tests for create_partition_writer and the output formats.
+    """
+
+    def write_rows(self, folder, output_format):
+        """
+        Write ROWS by job date with the writer of an output format.
+        """
+        folder.mkdir(exist_ok=True)
+        with create_partition_writer(str(folder), "UC_1", output_format) as writer:
+            for row in ROWS:
+                writer.write(row[0], row)
+        return writer
+
+    @pytest.mark.parametrize("output_format, compression", [("csv.gz", "gzip"), ("csv.zst", "zstd")])
+    def test_compressed_csv_matches_csv(self, tmp_path, output_format, compression):
+        """
+        Test that compressed CSV files decompress to the plain CSV output.
+        """
+        if compression == "zstd":
+            zstandard = pytest.importorskip("zstandard")
+        self.write_rows(tmp_path / "csv", "csv")
+        writer = self.write_rows(tmp_path / "compressed", output_format)
+
+        assert os.path.basename(writer.file_paths[datetime.date(2024, 1, 2)]) == f"UC_1_20240102.{output_format}"
+        for key, file_path in writer.file_paths.items():
+            plain = (tmp_path / "csv" / f"UC_1_{key.strftime('%Y%m%d')}.csv").read_bytes()
+            with open(file_path, "rb") as file:
+                data = file.read()
+            if compression == "gzip":
+                import gzip  # pylint: disable=import-outside-toplevel
+                data = gzip.decompress(data)
+            else:
+                data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+            assert data == plain
+
+    @pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+    def test_columnar_formats_are_typed(self, tmp_path, output_format):
+        """
+        Test that Parquet and Arrow files store job_date as a date and unit_change as a decimal.
+        """
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.ipc  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        writer = self.write_rows(tmp_path, output_format)
+
+        file_path = writer.file_paths[datetime.date(2024, 1, 2)]
+        assert file_path.endswith(f"UC_1_20240102.{output_format}")
+        if output_format == "parquet":
+            table = pyarrow.parquet.read_table(file_path)
+        else:
+            table = pyarrow.ipc.open_file(file_path).read_all()
+
+        assert table.schema.field("job_date").type == pa.date32()
+        assert table.schema.field("unit_change").type == pa.decimal128(8, 2)
+        assert table.column_names == EXPORT_COLUMNS
+        assert table.to_pylist() == [dict(zip(EXPORT_COLUMNS, row)) for row in ROWS[:2]]
+
+    def test_columnar_writer_flushes_row_groups(self, tmp_path):
+        """
+        Test that rows beyond row_group_size are written across several row groups.
+        """
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        with create_partition_writer(str(tmp_path), "UC_1", "parquet", row_group_size=2) as writer:
+            writer.write_rows(datetime.date(2024, 1, 2), [ROWS[0]] * 5)
+
+        metadata = pyarrow.parquet.ParquetFile(writer.file_paths[datetime.date(2024, 1, 2)]).metadata
+        assert metadata.num_rows == 5
+        assert metadata.num_row_groups == 3
+
+    def test_invalid_format(self, tmp_path):
+        """
+        Test that an unknown output format is rejected.
+        """
+        with pytest.raises(ValueError, match="Invalid output format: xlsx"):
+            create_partition_writer(str(tmp_path), "UC_1", "xlsx")
@@ -1,8 +1,29 @@
 """
 Utility functions for testing.
 """
+import datetime
+import importlib.util
+import random
+from decimal import Decimal
+import pytest
+from sqlalchemy import insert
 from resources.models import UnitsCompleteExport
 
+# Default share of rows without a value for each note field in synthetic datasets
+DEFAULT_NULL_RATIOS = {
+    'timesheet_id': 0.3,
+    'change_order_id': 0.8,
+    'sub_report_id': 0.9,
+    'vendor_name': 0.7,
+}
+
+# Skips a parametrization that needs the optional pyarrow package when it is not installed
+requires_pyarrow = pytest.mark.skipif(importlib.util.find_spec('pyarrow') is None,
+                                      reason="pyarrow is not installed")
+
+# The arrow export mode as a parameter, for tests that run every export mode
+ARROW_MODE = pytest.param("arrow", marks=requires_pyarrow)
+
 
 def create_units_complete_export(export_id=None):
     """
@@ -21,3 +42,81 @@ def create_units_complete_export(export_id=None):
         vendor_name="Vendor",
         date_created="2023-10-01 00:00:00",
     )
+
+
+def create_units_complete_exports(count, date_created, job_dates=3, start_id=1):
+    """
+    Utility function to create a varied batch of UnitsCompleteExport instances.
+    Every few rows leave note fields empty or are flagged as missing from budget.
+    """
+    first_job_date = datetime.date(2023, 10, 1)
+    units = []
+    for i in range(count):
+        units.append(UnitsCompleteExport(
+            export_id=start_id + i,
+            job_number=f"J{i % 7:05d}",
+            job_date=first_job_date + datetime.timedelta(days=i % job_dates),
+            phase_number=f"{i % 5:03d}",
+            category_number=f"C{i % 11}",
+            unit_change=Decimal(i * 37 % 20000 - 5000) / 100,
+            timesheet_id=i if i % 2 else None,
+            change_order_id=i if i % 3 == 0 else None,
+            sub_report_id=i if i % 4 == 1 else None,
+            vendor_name=f'Vendor, "{i % 3}"' if i % 5 == 0 else None,
+            date_created=date_created,
+            missing_from_budget=1 if i % 6 == 0 else 0,
+        ))
+    return units
+
+
+def generate_units_rows(count, date_created, job_dates=30, null_ratios=None, missing_fraction=0.05,
+                        seed=0, start_id=1):
+    """
+    Utility function to generate a realistic synthetic batch of UnitsCompleteExport rows.
+    The rows are plain dictionaries so large datasets can be bulk inserted.
+
+    :param count: Number of rows
+    :param date_created: The date_created of the batch
+    :param job_dates: Number of distinct job dates, which is the number of job date files
+    :param null_ratios: Dictionary of note field to the share of rows without a value,
+        defaults to DEFAULT_NULL_RATIOS
+    :param missing_fraction: Share of rows flagged as missing from budget
+    :param seed: Random seed, the same arguments always generate the same rows
+    :param start_id: First export_id
+    :return: A list of row dictionaries
+    """
+    null_ratios = {**DEFAULT_NULL_RATIOS, **(null_ratios or {})}
+    rng = random.Random(seed)
+    first_job_date = datetime.date(2023, 10, 1)
+    job_numbers = [f"{rng.randrange(100000, 999999)}" for _ in range(200)]
+    vendors = [f"Vendor {i}, Inc." for i in range(500)]
+
+    def maybe(field, value):
+        return None if rng.random() < null_ratios[field] else value
+
+    rows = []
+    for i in range(count):
+        rows.append({
+            'export_id': start_id + i,
+            'job_number': rng.choice(job_numbers),
+            'job_date': first_job_date + datetime.timedelta(days=rng.randrange(job_dates)),
+            'phase_number': f"{rng.randrange(1, 40):03d}",
+            'category_number': rng.choice(('L', 'M', 'E', 'S', 'O')),
+            'unit_change': Decimal(rng.randrange(-500000, 500000)) / 100,
+            'timesheet_id': maybe('timesheet_id', rng.randrange(1, 10_000_000)),
+            'change_order_id': maybe('change_order_id', rng.randrange(1, 100_000)),
+            'sub_report_id': maybe('sub_report_id', rng.randrange(1, 100_000)),
+            'vendor_name': maybe('vendor_name', rng.choice(vendors)),
+            'date_created': date_created,
+            'missing_from_budget': 1 if rng.random() < missing_fraction else 0,
+        })
+    return rows
+
+
+def insert_units_rows(engine, rows, batch_size=10_000):
+    """
+    Utility function to bulk insert UnitsCompleteExport row dictionaries.
+    """
+    with engine.begin() as connection:
+        for start in range(0, len(rows), batch_size):
+            connection.execute(insert(UnitsCompleteExport), rows[start:start + batch_size])
@@ -5,9 +5,9 @@ from tkinter import ttk
 import tkinter as tk
 from tkinter import messagebox
 import threading
+import multiprocessing
 import os
 import sys
-from main import main
 
 
 def resource_path(relative_path):
@@ -81,8 +81,10 @@ class MainApplication(tk.Frame):
         """
         Runs the main function defined in the main module.
         Displays a message after the function is done running.
+        The main module is imported here, so the window opens before the export modules are loaded.
         """
         try:
+            from main import main  # pylint: disable=import-outside-toplevel
             new_records = main()
             if new_records and new_records > 0:
                 messagebox.showinfo(
@@ -112,6 +114,9 @@ class MainApplication(tk.Frame):
 
 
 if __name__ == '__main__':
+    # Required for the parallel export's process pool in the packaged executable
+    multiprocessing.freeze_support()
+
     root = tk.Tk()
     MainApplication(root).pack(side="top", fill="both", expand=True)
 